@@ -0,0 +1,204 @@
+"""Benchmark of the network build on synthetic THERMOS results
+
+For every size, a synthetic network is generated (or reused from the data
+directory), loaded, and every stage of Network.build and the problematic_*
+reports is timed. A second pass measures the peak Python memory of every stage
+with tracemalloc (memory allocated inside QGIS itself is not seen). The results
+are written as JSON, so runs of different versions can be compared.
+"""
+
+# pylint: disable=[no-name-in-module]
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, field
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+from qgis.core import Qgis, QgsCoordinateReferenceSystem
+
+from benchmarks.synthetic import SyntheticNetwork
+from modules import batch
+from modules import features as ftr
+from modules import loaders
+
+SIZES: list[int] = [1_000, 10_000, 100_000]
+# in the order of Network.build
+BUILD_STAGES: list[str] = [
+    "index_ids",
+    "match_buildings",
+    "resolve_multi_building_pipes",
+    "classify_pipes",
+    "build_nodes",
+    "detect_forks",
+    "count_connectors",
+]
+REPORTS: list[str] = ["problematic_pipes", "problematic_buildings"]
+
+
+@dataclass
+class StageResult:
+    """Time and peak Python memory of one stage"""
+
+    seconds: float = 0.0
+    peak_bytes: int = 0
+
+
+@dataclass
+class SizeResult:
+    """Results of one network size"""
+
+    features: int
+    pipes: int = 0
+    buildings: int = 0
+    forks: int = 0
+    stages: dict[str, StageResult] = field(default_factory=dict)
+
+
+def load_records(path: Path) -> tuple[list[ftr.Pipe], list[ftr.Building]]:
+    """Read the pipes and buildings in the solution from a GeoJSON export"""
+    pipes: list[ftr.Pipe] = []
+    buildings: list[ftr.Building] = []
+    for feature in loaders.iter_geojson_features(path):
+        record: ftr.Pipe | ftr.Building | None = loaders.record_from_geojson(
+            feature, path
+        )
+        if isinstance(record, ftr.Pipe):
+            pipes.append(record)
+        elif isinstance(record, ftr.Building):
+            buildings.append(record)
+    return pipes, buildings
+
+
+def empty_network(
+    pipes: list[ftr.Pipe], buildings: list[ftr.Building], workers: int = 1
+) -> ftr.Network:
+    """Network with the records, but none of the build stages run yet"""
+    return ftr.Network(
+        pipes=pipes,
+        buildings=buildings,
+        crs=QgsCoordinateReferenceSystem(loaders.GEOJSON_CRS),
+        workers=workers,
+        resolve=False,
+    )
+
+
+def stage_calls(network: ftr.Network) -> list[tuple[str, Callable[[], Any]]]:
+    """Build stages and reports of a network, in the order they run"""
+    return [(name, getattr(network, name)) for name in BUILD_STAGES + REPORTS]
+
+
+def timed_pass(path: Path, result: SizeResult, workers: int = 1) -> None:
+    """Time loading, every build stage and the reports"""
+    start: float = time.perf_counter()
+    pipes, buildings = load_records(path)
+    result.stages["load"] = StageResult(time.perf_counter() - start)
+
+    network: ftr.Network = empty_network(pipes, buildings, workers)
+    for name, call in stage_calls(network):
+        start = time.perf_counter()
+        call()
+        result.stages[name] = StageResult(time.perf_counter() - start)
+
+    result.pipes = len(network.all_pipes)
+    result.buildings = len(network.all_buildings)
+    result.forks = len(network.forks)
+
+
+def memory_pass(path: Path, result: SizeResult, workers: int = 1) -> None:
+    """Measure the peak Python memory of loading, every stage and the reports"""
+    tracemalloc.start()
+    try:
+        pipes, buildings = load_records(path)
+        result.stages["load"].peak_bytes = tracemalloc.get_traced_memory()[1]
+
+        network: ftr.Network = empty_network(pipes, buildings, workers)
+        for name, call in stage_calls(network):
+            tracemalloc.reset_peak()
+            before: int = tracemalloc.get_traced_memory()[0]
+            call()
+            result.stages[name].peak_bytes = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+
+def git_revision() -> str | None:
+    """Commit of the working tree (None outside a git checkout)"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],  # noqa: S607
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    sizes: list[int], data_dir: Path, seed: int = 0, workers: int = 1
+) -> dict[str, Any]:
+    """Benchmark every size and return the results with their environment"""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    results: list[SizeResult] = []
+    for size in sizes:
+        path: Path = data_dir / f"synthetic_{size}_{seed}.json"
+        if not path.exists():
+            SyntheticNetwork(size, seed).write(path)
+        result = SizeResult(size)
+        timed_pass(path, result, workers)
+        memory_pass(path, result, workers)
+        results.append(result)
+
+    return {
+        "created": datetime.now(UTC).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "qgis": Qgis.version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "workers": workers,
+        "results": [asdict(result) for result in results],
+    }
+
+
+def main() -> None:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=SIZES, help="numbers of features"
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        default=Path("benchmarks/data"),
+        help="directory of the generated networks",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="threads for matching buildings"
+    )
+    parser.add_argument(
+        "--output", type=Path, default=None, help="results JSON file (default: stdout)"
+    )
+    args = parser.parse_args()
+
+    batch.init_worker()
+    results: str = json.dumps(
+        run_benchmarks(args.sizes, args.data_dir, args.seed, args.workers), indent=2
+    )
+    if args.output:
+        args.output.write_text(results, encoding="utf-8")
+    else:
+        print(results)  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
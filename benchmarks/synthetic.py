@@ -0,0 +1,394 @@
+"""Synthetic THERMOS results for scaling tests
+
+Generates a THERMOS GeoJSON export of a tree-shaped street network. The ratios
+follow thermos_output_for_testing/thermos_output.json: about one connector per
+building, 1.2 to 1.3 links per building (streets are split where connectors
+join), forks at about 10 % of the building count (12 % in the sample), and a
+few paths outside the solution. Every feature has all THERMOS_FIELD_NAMES,
+and capacity, diversity and diameter of the pipes are consistent with the
+downstream demand.
+"""
+
+import argparse
+import base64
+import itertools
+import json
+import math
+import random
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from modules import constants as cont
+
+ORIGIN: tuple[float, float] = (8.57, 53.18)  # lon, lat
+METRES_PER_DEGREE_LAT: float = 110_574.0
+METRES_PER_DEGREE_LON: float = 111_320.0 * math.cos(math.radians(ORIGIN[1]))
+STREET_SPACING: float = 60.0  # metres between street crossings
+BUILDINGS_PER_STREET: tuple[int, int] = (1, 5)
+BUILDING_OFFSET: tuple[float, float] = (4.0, 10.0)  # metres from the street
+BUILDING_HALF_WIDTH: float = 3.0
+STRAIGHT_ON: float = 0.9  # probability a street continues at a crossing
+SIDE_STREET: float = 0.5  # probability of a side street per side at a crossing
+UNUSED_PATHS: float = 0.07  # paths outside the solution per street
+FEATURES_PER_BUILDING: float = 3.35
+DIVERSITY_LIMIT: float = 0.62
+SUPPLY_CAPACITY: int = 100_000
+# upper capacity limit (kW) -> diameter (mm), from the sample results
+DIAMETERS: list[tuple[float, int]] = [
+    (20, 20),
+    (35, 25),
+    (60, 32),
+    (110, 40),
+    (230, 50),
+    (480, 65),
+    (700, 80),
+    (1350, 100),
+    (2400, 125),
+    (4000, 150),
+    (7000, 200),
+    (11000, 250),
+    (math.inf, 300),
+]
+DIRECTIONS: list[tuple[int, int]] = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+
+
+def diameter_for(capacity: float) -> int:
+    """Pipe diameter for a capacity"""
+    return next(diameter for limit, diameter in DIAMETERS if capacity <= limit)
+
+
+def lon_lat(x: float, y: float) -> list[float]:
+    """Coordinates of a point given in metres from the origin"""
+    return [
+        ORIGIN[0] + x / METRES_PER_DEGREE_LON,
+        ORIGIN[1] + y / METRES_PER_DEGREE_LAT,
+    ]
+
+
+def plot_positions(count: int) -> list[float]:
+    """Distances of the buildings along a street from its start"""
+    if count == 1:
+        return [STREET_SPACING / 2]
+    return [
+        STREET_SPACING / 4 + STREET_SPACING / 2 * index / (count - 1)
+        for index in range(count)
+    ]
+
+
+@dataclass
+class Street:
+    """Street between two crossings with the peak demand of the buildings along it"""
+
+    start: tuple[int, int]
+    end: tuple[int, int]
+    demands: list[float] = field(default_factory=list)  # kWp per building
+    downstream: tuple[int, float] = (0, 0.0)  # buildings and kWp behind the end
+
+    def direction(self) -> tuple[int, int]:
+        """Unit direction from start to end"""
+        return (self.end[0] - self.start[0], self.end[1] - self.start[1])
+
+    def load(self) -> tuple[int, float]:
+        """Buildings and kWp supplied through the start of the street"""
+        return (
+            self.downstream[0] + len(self.demands),
+            self.downstream[1] + sum(self.demands),
+        )
+
+
+def metres(crossing: tuple[int, int]) -> tuple[float, float]:
+    """Position of a crossing in metres from the origin"""
+    return (crossing[0] * STREET_SPACING, crossing[1] * STREET_SPACING)
+
+
+@dataclass
+class SyntheticNetwork:
+    """Generator of one synthetic THERMOS result"""
+
+    features: int = 1_000
+    seed: int = 0
+    rng: random.Random = field(init=False, repr=False)
+    node_ids: dict[tuple[int, int], str] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        """Seed the random numbers"""
+        self.rng = random.Random(self.seed)
+        self.node_ids = {}
+
+    def new_id(self) -> str:
+        """Random id in the style of THERMOS"""
+        return base64.b64encode(self.rng.randbytes(12)).decode()
+
+    def crossing_id(self, crossing: tuple[int, int]) -> str:
+        """Id of the node at a street crossing"""
+        if crossing not in self.node_ids:
+            self.node_ids[crossing] = self.new_id()
+        return self.node_ids[crossing]
+
+    def streets(self, buildings: int) -> list[Street]:
+        """Grow a tree of streets from the origin until it has the buildings
+
+        Streets are returned in the order they were grown, so every street
+        comes after the street leading to it. The demand behind every street
+        is filled in from the outermost streets inwards.
+        """
+        occupied: set[tuple[int, int]] = {(0, 0), (-1, 0)}  # (-1, 0): supply side
+        frontier: list[tuple[tuple[int, int], tuple[int, int]]] = [((0, 0), (1, 0))]
+        streets: list[Street] = []
+        placed: int = 0
+        while placed < buildings:
+            if not frontier:
+                start: tuple[int, int] = self.rng.choice(streets).end
+                frontier.extend((start, direction) for direction in DIRECTIONS)
+                continue
+
+            start, direction = frontier.pop(self.rng.randrange(len(frontier)))
+            end: tuple[int, int] = (start[0] + direction[0], start[1] + direction[1])
+            if end in occupied:
+                continue
+            occupied.add(end)
+            count: int = min(
+                buildings - placed, self.rng.randint(*BUILDINGS_PER_STREET)
+            )
+            streets.append(
+                Street(
+                    start,
+                    end,
+                    [round(self.rng.uniform(8.0, 120.0), 3) for _ in range(count)],
+                )
+            )
+            placed += count
+
+            if self.rng.random() < STRAIGHT_ON:
+                frontier.append((end, direction))
+            for side in ((direction[1], -direction[0]), (-direction[1], direction[0])):
+                if self.rng.random() < SIDE_STREET:
+                    frontier.append((end, side))
+
+        behind: dict[tuple[int, int], tuple[int, float]] = {}
+        for street in reversed(streets):
+            street.downstream = behind.get(street.end, (0, 0.0))
+            count, kwp = behind.get(street.start, (0, 0.0))
+            load: tuple[int, float] = street.load()
+            behind[street.start] = (count + load[0], kwp + load[1])
+        return streets
+
+    def building_feature(
+        self,
+        corner: tuple[float, float],
+        along: tuple[float, float],
+        side: tuple[float, float],
+        kwp: float,
+    ) -> dict[str, Any]:
+        """Rectangular building beside a street, touching the connection point"""
+        near, far = BUILDING_OFFSET
+        ring: list[list[float]] = [
+            lon_lat(
+                corner[0] + a * along[0] + s * side[0],
+                corner[1] + a * along[1] + s * side[1],
+            )
+            for a, s in (
+                (-BUILDING_HALF_WIDTH, 0.0),
+                (BUILDING_HALF_WIDTH, 0.0),
+                (BUILDING_HALF_WIDTH, far - near),
+                (-BUILDING_HALF_WIDTH, far - near),
+                (-BUILDING_HALF_WIDTH, 0.0),
+            )
+        ]
+        area: float = 2 * BUILDING_HALF_WIDTH * (far - near)
+        building_id: str = self.new_id()
+        properties: dict[str, Any] = dict.fromkeys(cont.THERMOS_FIELD_NAMES)
+        properties |= {
+            "id": building_id,
+            "candidate/id": building_id,
+            "candidate/type": ":building",
+            "candidate/inclusion": ":optional",
+            "candidate/selected": False,
+            "candidate/ground-area": area,
+            "candidate/roof-area": area,
+            "candidate/wall-area": 2 * (2 * BUILDING_HALF_WIDTH + far - near) * 6.0,
+            "candidate/user-fields Category": "Residential",
+            "candidate/user-fields Height": self.rng.randint(3, 15),
+            "demand/kwp": kwp,
+            "demand/kwh": round(kwp * self.rng.uniform(1200, 1800), 3),
+            "demand/connection-count": 1,
+            "demand/source": "synthetic",
+            "cooling/kwp": 0.0,
+            "cooling/kwh": 0.0,
+            "solution/included": True,
+            "solution/connected": True,
+            "solution/kwp": kwp,
+        }
+        return {
+            "type": "Feature",
+            "id": building_id,
+            "properties": properties,
+            "geometry": {"type": "Polygon", "coordinates": [ring]},
+        }
+
+    def path_feature(  # noqa: PLR0913
+        self,
+        start: tuple[float, float],
+        end: tuple[float, float],
+        start_id: str,
+        end_id: str,
+        category: str,
+        load: tuple[int, float],
+    ) -> dict[str, Any]:
+        """Pipe between two points (outside the solution if nothing is behind it)"""
+        path_id: str = self.new_id()
+        properties: dict[str, Any] = dict.fromkeys(cont.THERMOS_FIELD_NAMES)
+        properties |= {
+            "id": path_id,
+            "candidate/id": path_id,
+            "candidate/type": ":path",
+            "candidate/inclusion": ":optional",
+            "candidate/selected": False,
+            "candidate/user-fields Category": category,
+            "path/start": start_id,
+            "path/end": end_id,
+            "path/length": round(math.dist(start, end), 7),
+        }
+        count, kwp = load
+        if count:
+            diversity: float = DIVERSITY_LIMIT + (1 - DIVERSITY_LIMIT) / count
+            capacity: float = kwp * diversity
+            properties |= {
+                "solution/included": True,
+                "solution/capacity-kw": capacity,
+                "solution/max-capacity-kw": capacity * 1.5,
+                "solution/diversity": diversity,
+                "solution/diameter-mm": diameter_for(capacity),
+                "solution/length-factor": 1,
+            }
+        return {
+            "type": "Feature",
+            "id": path_id,
+            "properties": properties,
+            "geometry": {
+                "type": "LineString",
+                "coordinates": [lon_lat(*start), lon_lat(*end)],
+            },
+        }
+
+    def street_features(self, street: Street) -> Iterator[dict[str, Any]]:
+        """Buildings, connectors and links of a street
+
+        The street is split into links where the connectors join, buildings
+        alternate between the two sides.
+        """
+        direction: tuple[int, int] = street.direction()
+        origin: tuple[float, float] = metres(street.start)
+        junctions: list[tuple[tuple[float, float], str]] = [
+            (origin, self.crossing_id(street.start))
+        ]
+        loads: list[tuple[int, float]] = []
+        count, kwp = street.load()
+        for index, (position, demand) in enumerate(
+            zip(plot_positions(len(street.demands)), street.demands, strict=True)
+        ):
+            sign: int = 1 if index % 2 == 0 else -1
+            side: tuple[float, float] = (-direction[1] * sign, direction[0] * sign)
+            junction: tuple[float, float] = (
+                origin[0] + direction[0] * position,
+                origin[1] + direction[1] * position,
+            )
+            corner: tuple[float, float] = (
+                junction[0] + side[0] * BUILDING_OFFSET[0],
+                junction[1] + side[1] * BUILDING_OFFSET[0],
+            )
+            building: dict[str, Any] = self.building_feature(
+                corner, (float(direction[0]), float(direction[1])), side, demand
+            )
+            junction_id: str = self.new_id()
+            connection_id: str = self.new_id()
+            building["properties"]["candidate/connections 0"] = connection_id
+            yield building
+            yield self.path_feature(
+                junction, corner, junction_id, connection_id, "Connector", (1, demand)
+            )
+
+            loads.append((count, kwp))
+            count, kwp = count - 1, kwp - demand
+            junctions.append((junction, junction_id))
+
+        junctions.append((metres(street.end), self.crossing_id(street.end)))
+        loads.append(street.downstream)
+        for ((start, start_id), (stop, stop_id)), load in zip(
+            itertools.pairwise(junctions), loads, strict=True
+        ):
+            yield self.path_feature(start, stop, start_id, stop_id, "Residential", load)
+
+    def supply_features(self, load: tuple[int, float]) -> Iterator[dict[str, Any]]:
+        """Supply building west of the origin and its connector"""
+        corner: tuple[float, float] = (-BUILDING_OFFSET[0], 0.0)
+        supply: dict[str, Any] = self.building_feature(
+            corner, (0.0, 1.0), (-1.0, 0.0), 0.0
+        )
+        connection_id: str = self.new_id()
+        supply["properties"] |= {
+            "supply/capacity-kwp": SUPPLY_CAPACITY,
+            "candidate/connections 0": connection_id,
+            "candidate/inclusion": ":required",
+        }
+        yield supply
+        yield self.path_feature(
+            (0.0, 0.0),
+            corner,
+            self.crossing_id((0, 0)),
+            connection_id,
+            "Connector",
+            load,
+        )
+
+    def unused_path(self, street: Street) -> dict[str, Any]:
+        """Short path beyond the end of a street that is not in the solution"""
+        direction: tuple[int, int] = street.direction()
+        end: tuple[float, float] = metres(street.end)
+        stub: tuple[float, float] = (
+            end[0] + direction[0] * STREET_SPACING / 3,
+            end[1] + direction[1] * STREET_SPACING / 3,
+        )
+        return self.path_feature(
+            end, stub, self.crossing_id(street.end), self.new_id(), "Footway", (0, 0.0)
+        )
+
+    def iter_features(self) -> Iterator[dict[str, Any]]:
+        """All features of the network, the supply first"""
+        buildings: int = max(1, round(self.features / FEATURES_PER_BUILDING))
+        streets: list[Street] = self.streets(buildings)
+        yield from self.supply_features(streets[0].load() if streets else (0, 0.0))
+        for street in streets:
+            yield from self.street_features(street)
+            if self.rng.random() < UNUSED_PATHS:
+                yield self.unused_path(street)
+
+    def write(self, path: str | Path) -> Path:
+        """Write the network as a GeoJSON FeatureCollection, one feature per line"""
+        path = Path(path)
+        with path.open("w", encoding="utf-8") as file:
+            file.write('{"type": "FeatureCollection", "features": [\n')
+            for index, feature in enumerate(self.iter_features()):
+                if index:
+                    file.write(",\n")
+                json.dump(
+                    feature, file, ensure_ascii=False, separators=(",", ":")
+                )
+            file.write("\n]}\n")
+        return path
+
+
+def main() -> None:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("features", type=int, help="approximate number of features")
+    parser.add_argument("output", type=Path, help="GeoJSON file to write")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+    SyntheticNetwork(args.features, args.seed).write(args.output)
+
+
+if __name__ == "__main__":
+    main()
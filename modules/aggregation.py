@@ -0,0 +1,164 @@
+"""Downstream demand and diversity along the network"""
+
+from array import array
+from dataclasses import dataclass
+
+from modules import features as ftr
+from modules import graph as grp
+
+DIVERSITY_LIMIT: float = 0.62  # THERMOS default: share of peak demand for n -> inf
+CAPACITY_TOLERANCE: float = 0.05  # relative
+DIVERSITY_TOLERANCE: float = 0.01  # absolute
+
+
+def diversity_factor(buildings: int, limit: float = DIVERSITY_LIMIT) -> float:
+    """Simultaneity of the peak demand of a number of buildings (limit + (1 - limit) / n)"""
+    if buildings <= 0:
+        return 1.0
+    return limit + (1 - limit) / buildings
+
+
+@dataclass
+class LoadAggregation:
+    """Connected buildings and summed demand downstream of every pipe
+
+    The arrays are indexed by pipe position in graph.pipes. How the flow splits
+    around a loop is up to the THERMOS solution, so the sums of pipes on a loop
+    (and the orientation within it) are arbitrary; those pipes are reported as
+    such instead of being compared with their THERMOS results. The sums of all
+    other pipes do not depend on the split.
+    """
+
+    graph: grp.NetworkGraph
+    orientation: grp.Orientation
+    in_loop: bytearray  # 1 for pipes on a loop
+    buildings: array  # connected buildings
+    demand_kwp: array  # summed peak demand
+    demand_kwh: array  # summed annual demand
+    diversity_limit: float = DIVERSITY_LIMIT
+
+    def diversity(self, position: int) -> float:
+        """Diversity factor of a pipe"""
+        return diversity_factor(self.buildings[position], self.diversity_limit)
+
+    def load_kw(self, position: int) -> float:
+        """Diversity-adjusted peak load of a pipe"""
+        return self.demand_kwp[position] * self.diversity(position)
+
+    def issues(
+        self,
+        *,
+        capacity_tolerance: float = CAPACITY_TOLERANCE,
+        diversity_tolerance: float = DIVERSITY_TOLERANCE,
+        return_ids: bool = True,
+    ) -> dict[str, list[str]] | dict[str, list[ftr.Pipe]]:
+        """Pipes whose THERMOS results do not fit the aggregated demand"""
+        unreached: str = "pipes not reachable from a supply"
+        loop: str = "pipes in loops (load depends on the flow split)"
+        capacity: str = "pipes with capacity not matching the downstream load"
+        diversity: str = "pipes with diversity not matching the connected buildings"
+        diameter: str = "pipes wider than the pipe upstream without more capacity"
+        dic: dict[str, list[ftr.Pipe]] = {
+            unreached: [],
+            loop: [],
+            capacity: [],
+            diversity: [],
+            diameter: [],
+        }
+
+        parent: array = self.orientation.parent
+        for position, pipe in enumerate(self.graph.pipes):
+            if not self.orientation.reached[position]:
+                dic[unreached].append(pipe)
+                continue
+            if self.in_loop[position]:
+                dic[loop].append(pipe)
+                continue
+
+            load: float = self.load_kw(position)
+            if pipe.capacity is not None and abs(pipe.capacity - load) > (
+                capacity_tolerance * max(abs(pipe.capacity), load)
+            ):
+                dic[capacity].append(pipe)
+            if (
+                pipe.diversity is not None
+                and self.buildings[position]
+                and abs(pipe.diversity - self.diversity(position)) > diversity_tolerance
+            ):
+                dic[diversity].append(pipe)
+
+            upstream: int = parent[position]
+            if (
+                upstream >= 0
+                and not self.in_loop[upstream]
+                and self.wider_than(pipe, self.graph.pipes[upstream])
+            ):
+                dic[diameter].append(pipe)
+
+        if not return_ids:
+            return dic
+        return {
+            issue: sorted([p.id for p in pipes if p.id], key=str.lower)
+            for issue, pipes in dic.items()
+        }
+
+    @staticmethod
+    def wider_than(pipe: ftr.Pipe, upstream: ftr.Pipe) -> bool:
+        """Check if a pipe is wider than the pipe upstream without more capacity
+
+        With diversity, a connector of a large building may carry more than
+        the street pipe feeding it, so it may be wider as well.
+        """
+        if pipe.diameter is None or upstream.diameter is None:
+            return False
+        return pipe.diameter > upstream.diameter and (
+            pipe.capacity is None
+            or upstream.capacity is None
+            or pipe.capacity <= upstream.capacity
+        )
+
+
+def aggregate_loads(
+    network: ftr.Network, diversity_limit: float = DIVERSITY_LIMIT
+) -> LoadAggregation:
+    """Accumulate buildings and demand downstream of every pipe
+
+    The pipes are oriented from the supply nodes (the supply ends of their
+    connectors) and the demand of every building is put on its connector; one
+    pass over the pipes in reverse breadth first order then adds every pipe to
+    the pipe upstream of it.
+    Buildings connected to several pipes are counted once, supplies never.
+    """
+    graph: grp.NetworkGraph = grp.NetworkGraph.from_network(network)
+    orientation: grp.Orientation = graph.orient(graph.supply_positions(network))
+
+    pipe_count: int = len(graph.pipes)
+    buildings: array = array("l", [0]) * pipe_count
+    demand_kwp: array = array("d", [0.0]) * pipe_count
+    demand_kwh: array = array("d", [0.0]) * pipe_count
+    counted: set[ftr.Building] = set()
+    for position, pipe in enumerate(graph.pipes):
+        for building in ftr.as_list(pipe.connected_buildings):
+            if building.supply_capacity or building in counted:
+                continue
+            counted.add(building)
+            buildings[position] += 1
+            demand_kwp[position] += building.demand_cap_heat or 0.0
+            demand_kwh[position] += building.demand_cons_heat or 0.0
+
+    parent: array = orientation.parent
+    for position in reversed(orientation.order):
+        if (upstream := parent[position]) >= 0:
+            buildings[upstream] += buildings[position]
+            demand_kwp[upstream] += demand_kwp[position]
+            demand_kwh[upstream] += demand_kwh[position]
+
+    return LoadAggregation(
+        graph,
+        orientation,
+        graph.loop_pipes(),
+        buildings,
+        demand_kwp,
+        demand_kwh,
+        diversity_limit,
+    )
@@ -0,0 +1,170 @@
+"""Batch analysis of many THERMOS results in parallel"""
+
+# pylint: disable=[no-name-in-module]
+
+import argparse
+import json
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from qgis.core import QgsApplication, QgsProject
+
+from modules import exceptions as ex
+from modules import features as ftr
+from modules import loaders
+from modules import snapshot
+
+PROJECT_SUFFIXES: frozenset[str] = frozenset({".qgz", ".qgs"})
+
+# QGIS application of a worker process (kept referenced for the process lifetime)
+QGIS_APPLICATION: QgsApplication | None = None
+
+
+@dataclass
+class ScenarioReport:
+    """Validation report of one THERMOS result"""
+
+    source: str
+    pipes: int = 0
+    buildings: int = 0
+    forks: int = 0
+    problematic_pipes: dict[str, list[str]] = field(default_factory=dict)
+    problematic_buildings: dict[str, list[str]] = field(default_factory=dict)
+    error: str | None = None
+    seconds: float = 0.0
+
+
+@dataclass
+class BatchSummary:
+    """Merged reports of a batch run"""
+
+    reports: list[ScenarioReport]
+
+    def failed(self) -> list[ScenarioReport]:
+        """Reports of scenarios that could not be analysed"""
+        return [report for report in self.reports if report.error]
+
+    def issue_counts(self) -> dict[str, int]:
+        """Number of problematic pipes and buildings per issue over all scenarios"""
+        counts: Counter[str] = Counter()
+        for report in self.reports:
+            for issues in (report.problematic_pipes, report.problematic_buildings):
+                for issue, ids in issues.items():
+                    counts[issue] += len(ids)
+        return dict(counts)
+
+    def to_dict(self) -> dict:
+        """Summary as a JSON-serialisable dictionary"""
+        return {
+            "scenarios": len(self.reports),
+            "failed": len(self.failed()),
+            "issues": self.issue_counts(),
+            "reports": [asdict(report) for report in self.reports],
+        }
+
+
+def init_worker() -> None:
+    """Start the QGIS application of a worker process"""
+    global QGIS_APPLICATION  # noqa: PLW0603 # pylint: disable=global-statement
+    QGIS_APPLICATION = QgsApplication([], False)
+    QGIS_APPLICATION.initQgis()
+
+
+def build_network(source: str) -> ftr.Network:
+    """Build the network of a QGIS project, a THERMOS export or a snapshot"""
+    suffix: str = Path(source).suffix.lower()
+    if suffix == snapshot.SNAPSHOT_SUFFIX:
+        return snapshot.load_snapshot(source)
+    if suffix not in PROJECT_SUFFIXES:
+        return loaders.load_network(source)
+
+    read_project(source)
+    return ftr.Network()
+
+
+def read_project(source: str) -> QgsProject:
+    """Replace the current project by a project file
+
+    An empty project is an error here: the THERMOS layers would otherwise be
+    looked up in the test project.
+    """
+    project: QgsProject | None = QgsProject.instance()
+    if not project:
+        raise ex.NoProjectError
+    project.clear()
+    if not project.read(source):
+        raise ex.ThermosExportError(source, project.error())
+    if not project.mapLayers():
+        raise ex.ThermosExportError(source, "the project has no layers")
+    return project
+
+
+def analyse_scenario(source: str) -> ScenarioReport:
+    """Build and validate one scenario, reporting failures instead of raising"""
+    start: float = time.perf_counter()
+    report = ScenarioReport(source)
+    try:
+        network: ftr.Network = build_network(source)
+        report.pipes = len(network.all_pipes)
+        report.buildings = len(network.all_buildings)
+        report.forks = len(network.forks)
+        report.problematic_pipes = network.problematic_pipes()  # type: ignore[assignment]
+        report.problematic_buildings = network.problematic_buildings()  # type: ignore[assignment]
+    except Exception as error:  # noqa: BLE001 - one broken scenario must not stop the batch
+        report.error = f"{type(error).__name__}: {error}"
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def run_batch(sources: list[str], max_workers: int | None = None) -> BatchSummary:
+    """Analyse the scenarios in a process pool (one QGIS application per worker)
+
+    Reports are returned in the order of the sources. Exceptions are caught per
+    scenario; if a worker process dies (e.g. a crash inside QGIS), the scenarios
+    still pending in the pool are reported as failed instead of raising.
+    """
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+    ) as pool:
+        futures: list[Future[ScenarioReport]] = [
+            pool.submit(analyse_scenario, source) for source in sources
+        ]
+        reports: list[ScenarioReport] = []
+        for source, future in zip(sources, futures, strict=True):
+            try:
+                reports.append(future.result())
+            except Exception as error:  # noqa: BLE001 - e.g. BrokenProcessPool
+                reports.append(
+                    ScenarioReport(source, error=f"{type(error).__name__}: {error}")
+                )
+
+    return BatchSummary(reports)
+
+
+def main() -> None:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "sources", nargs="+", help="QGIS projects, THERMOS exports or snapshots"
+    )
+    parser.add_argument("--workers", type=int, default=None, help="worker processes")
+    parser.add_argument("--output", type=Path, default=None, help="summary JSON file")
+    args = parser.parse_args()
+
+    summary: str = json.dumps(
+        run_batch(args.sources, args.workers).to_dict(), indent=2, ensure_ascii=False
+    )
+    if args.output:
+        args.output.write_text(summary, encoding="utf-8")
+    else:
+        print(summary)  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
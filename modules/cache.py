@@ -0,0 +1,127 @@
+"""On-disk cache of resolved network topology"""
+
+# pylint: disable=[no-name-in-module]
+
+import gzip
+import hashlib
+import json
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from qgis.core import QgsProject, QgsProviderRegistry, QgsRectangle, QgsVectorLayer
+
+CACHE_VERSION: int = 3
+CACHE_SUFFIX: str = ".topology.json.gz"
+MAX_ENTRIES: int = 16
+MAX_BYTES: int = 256 * 1024 * 1024
+# SQLite write-ahead log: GeoPackage commits land here until a checkpoint. The
+# -shm index is left out, as every reader writes its read mark into it.
+SIDECAR_SUFFIXES: tuple[str, ...] = ("-wal",)
+
+
+def layer_fingerprint(layer: QgsVectorLayer) -> bytes | None:
+    """Fingerprint of the content of a layer, or None if it cannot be cached
+
+    Only layers read from a file are cached, since every commit to them
+    changes the size or modification time of the file or of its write-ahead
+    log. Commits to database providers leave no such trace, and in-memory
+    layers and layers with uncommitted edits have no file to show them.
+    """
+    if layer.isModified():
+        return None
+    path: str | None = (
+        QgsProviderRegistry.instance()
+        .decodeUri(layer.providerType(), layer.source())
+        .get("path")
+    )
+    if not path or not (file := Path(path)).is_file():
+        return None
+
+    hasher = hashlib.sha256()
+    hasher.update(layer.providerType().encode())
+    hasher.update(layer.source().encode())
+    hasher.update(layer.subsetString().encode())
+    for written in (file, *(file.with_name(file.name + s) for s in SIDECAR_SUFFIXES)):
+        if written.is_file():
+            stat = written.stat()
+            hasher.update(f"{written.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    hasher.update(array("q", sorted(layer.allFeatureIds())).tobytes())
+    return hasher.digest()
+
+
+def topology_key(
+    layers: list[QgsVectorLayer], options: dict[str, Any]
+) -> str | None:
+    """Cache key of the topology built from the layers with the given options"""
+    hasher = hashlib.sha256(f"{CACHE_VERSION}".encode())
+    for layer in layers:
+        if (fingerprint := layer_fingerprint(layer)) is None:
+            return None
+        hasher.update(fingerprint)
+
+    for name, value in sorted(options.items()):
+        if isinstance(value, QgsRectangle):
+            value = value.toString(12)  # noqa: PLW2901
+        hasher.update(f"{name}={value}".encode())
+    return hasher.hexdigest()
+
+
+def project_cache_dir() -> Path | None:
+    """Cache directory next to the current project file (None if unsaved)"""
+    project: QgsProject | None = QgsProject.instance()
+    if not project or not project.absoluteFilePath():
+        return None
+    project_file = Path(project.absoluteFilePath())
+    return project_file.with_name(f"{project_file.stem}.topology-cache")
+
+
+@dataclass
+class TopologyCache:
+    """Directory of gzipped JSON topology records, evicted least recently used"""
+
+    directory: Path
+    max_entries: int = MAX_ENTRIES
+    max_bytes: int = MAX_BYTES
+
+    def path(self, key: str) -> Path:
+        """File of a cache entry"""
+        return self.directory / f"{key}{CACHE_SUFFIX}"
+
+    def load(self, key: str) -> dict[str, Any] | None:
+        """Return the cached record (None on a miss or an unreadable entry)"""
+        path: Path = self.path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                record: dict[str, Any] = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if record.get("version") != CACHE_VERSION:
+            return None
+        path.touch()  # mark as recently used
+        return record
+
+    def store(self, key: str, record: dict[str, Any]) -> None:
+        """Write a record and evict old entries beyond the size limits"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temporary: Path = self.path(key).with_suffix(".tmp")
+        with gzip.open(temporary, "wt", encoding="utf-8") as file:
+            json.dump({**record, "version": CACHE_VERSION}, file, separators=(",", ":"))
+        temporary.replace(self.path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete the least recently used entries beyond the limits"""
+        entries: list[Path] = sorted(
+            self.directory.glob(f"*{CACHE_SUFFIX}"),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True,
+        )
+        total: int = 0
+        for count, entry in enumerate(entries, start=1):
+            total += entry.stat().st_size
+            if count > self.max_entries or total > self.max_bytes:
+                entry.unlink(missing_ok=True)
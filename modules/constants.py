@@ -1,6 +1,6 @@
 """Constants"""
 
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 
 TEST_PROJECT_PATH: str = "thermos_output_for_testing/thermos_output_full.qgz"
 TEST_MINI_PROJECT_PATH: str = "thermos_output_for_testing/thermos_output_mini.qgz"
@@ -15,7 +15,7 @@ class ThermosFields:
     area_ground: str = "candidate/ground-area"
     capacity: str = "solution/capacity-kw"
     connected: str = "solution/connected"
-    diversity_pipe: str = "solution/diversity"
+    diversity: str = "solution/diversity"
     demand_cap_cooling: str = "cooling/kwp"
     demand_cap_heat: str = "demand/kwp"
     demand_cons_cooling: str = "cooling/kwh"
@@ -32,6 +32,9 @@ class ThermosFields:
     supply_capacity: str = "supply/capacity-kwp"
 
 
+THERMOS_FIELDS_IN_USE: list[str] = list(asdict(ThermosFields()).values())
+
+
 THERMOS_FIELD_NAMES: list[str] = [
     "candidate/connections 0",
     "candidate/connections 1",
@@ -141,3 +144,5 @@ THERMOS_FIELD_NAMES: list[str] = [
     "tariff/cc-id",
     "tariff/id",
 ]
+
+THERMOS_FIELD_NAME_SET: frozenset[str] = frozenset(THERMOS_FIELD_NAMES)
@@ -3,7 +3,10 @@
 # ruff: noqa: D101,D107
 # pylint: disable=missing-class-docstring
 
-from modules.features import Pipe
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from modules.features import Pipe
 
 
 class NoProjectError(Exception):
@@ -22,5 +25,30 @@ class NewLayerInvalidError(Exception):
 
 
 class PipeNotConnectedToMultipleBuildingsError(Exception):
-    def __init__(self, pipe: Pipe) -> None:
+    def __init__(self, pipe: "Pipe") -> None:
         super().__init__(f"Pipe {pipe.id} is not connected to multiple buildings")
+
+
+class MissingLayerError(Exception):
+    def __init__(self, kind: str) -> None:
+        super().__init__(f"No THERMOS {kind} layer found in the project")
+
+
+class ThermosExportError(Exception):
+    def __init__(self, path: str, reason: str) -> None:
+        super().__init__(f"{path} is not a readable THERMOS export: {reason}")
+
+
+class ResultExportError(Exception):
+    def __init__(self, path: str, reason: str) -> None:
+        super().__init__(f"could not write {path}: {reason}")
+
+
+class SnapshotError(Exception):
+    def __init__(self, path: str, reason: str) -> None:
+        super().__init__(f"{path} is not a readable network snapshot: {reason}")
+
+
+class TopologyRecordError(Exception):
+    def __init__(self) -> None:
+        super().__init__("Topology record does not fit the pipes and buildings")
@@ -0,0 +1,280 @@
+"""Export of analysis results as layers"""
+
+# pylint: disable=[no-name-in-module]
+
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from enum import StrEnum
+from itertools import islice
+from pathlib import Path
+from typing import Any
+
+from qgis.core import (
+    QgsFeature,
+    QgsField,
+    QgsFields,
+    QgsGeometry,
+    QgsProject,
+    QgsVectorFileWriter,
+    QgsVectorLayer,
+)
+from qgis.PyQt.QtCore import QVariant
+
+from modules import aggregation as agg
+from modules import exceptions as ex
+from modules import features as ftr
+from modules import project_layers as prl
+
+BATCH_SIZE: int = 10_000
+GROUP_NAME: str = "UTEC_Automation"
+
+
+class ExportFormat(StrEnum):
+    """Where result layers are written"""
+
+    MEMORY = "memory"  # temporary layers, lost when the project is closed
+    GEOPACKAGE = "gpkg"  # one GeoPackage table per layer
+
+
+@dataclass
+class ResultLayer:
+    """Schema and rows (geometry and attribute values) of a result layer"""
+
+    name: str
+    geometry_type: str
+    fields: list[tuple[str, QVariant.Type]]
+    rows: Iterable[tuple[QgsGeometry, list[Any]]]
+
+    def qgs_fields(self) -> QgsFields:
+        """Fields of the layer"""
+        qgs_fields = QgsFields()
+        for name, field_type in self.fields:
+            qgs_fields.append(QgsField(name, field_type))
+        return qgs_fields
+
+
+def multi_polygon(building: ftr.Building) -> QgsGeometry:
+    """Footprint of a building as a multipolygon"""
+    geometry: QgsGeometry = building.geometry
+    geometry.convertToMultiType()
+    return geometry
+
+
+def forks_layer(network: ftr.Network) -> ResultLayer:
+    """Forks with the number of pipes meeting there"""
+    return ResultLayer(
+        "forks",
+        "Point",
+        [("id", QVariant.String), ("pipes", QVariant.Int)],
+        (
+            (
+                QgsGeometry.fromPointXY(node.coordinates),
+                [node.id, len(ftr.as_list(node.pipes))],
+            )
+            for node in network.forks
+        ),
+    )
+
+
+def branches_layer(network: ftr.Network) -> ResultLayer:
+    """Branches as multilines (computed if not done yet)"""
+    branches: list[ftr.Branch] = network.branches or network.find_branches()
+    return ResultLayer(
+        "branches",
+        "MultiLineString",
+        [
+            ("id", QVariant.String),
+            ("connected_to_source", QVariant.Bool),
+            ("pipes", QVariant.Int),
+            ("buildings", QVariant.Int),
+        ],
+        (
+            (
+                QgsGeometry.fromMultiPolylineXY(
+                    [pipe.polyline() for pipe in ftr.as_list(branch.pipes)]
+                ),
+                [
+                    branch.id,
+                    branch.connected_to_source,
+                    len(ftr.as_list(branch.pipes)),
+                    len(ftr.as_list(branch.buildings)),
+                ],
+            )
+            for branch in branches
+        ),
+    )
+
+
+def problematic_pipes_layer(
+    network: ftr.Network, aggregation: agg.LoadAggregation | None = None
+) -> ResultLayer:
+    """Problematic pipes with their issue (one row per pipe and issue)"""
+    issues: dict[str, list[ftr.Pipe]] = dict(
+        network.problematic_pipes(return_ids=False)  # type: ignore[arg-type]
+    )
+    if aggregation is not None:
+        issues |= aggregation.issues(return_ids=False)  # type: ignore[arg-type]
+    return ResultLayer(
+        "problematic pipes",
+        "LineString",
+        [("id", QVariant.String), ("issue", QVariant.String)],
+        (
+            (pipe.geometry, [pipe.id, issue])
+            for issue, pipes in issues.items()
+            for pipe in pipes
+        ),
+    )
+
+
+def problematic_buildings_layer(network: ftr.Network) -> ResultLayer:
+    """Problematic buildings with their issue (one row per building and issue)"""
+    issues: dict[str, list[ftr.Building]] = network.problematic_buildings(
+        return_ids=False
+    )  # type: ignore[assignment]
+    return ResultLayer(
+        "problematic buildings",
+        "MultiPolygon",
+        [("id", QVariant.String), ("issue", QVariant.String)],
+        (
+            (multi_polygon(building), [building.id, issue])
+            for issue, buildings in issues.items()
+            for building in buildings
+        ),
+    )
+
+
+def loads_layer(aggregation: agg.LoadAggregation) -> ResultLayer:
+    """Aggregated downstream demand and load of every pipe"""
+    return ResultLayer(
+        "loads",
+        "LineString",
+        [
+            ("id", QVariant.String),
+            ("buildings", QVariant.Int),
+            ("demand_kwp", QVariant.Double),
+            ("demand_kwh", QVariant.Double),
+            ("diversity", QVariant.Double),
+            ("load_kw", QVariant.Double),
+            ("capacity_kw", QVariant.Double),
+            ("diameter_mm", QVariant.Int),
+        ],
+        (
+            (
+                pipe.geometry,
+                [
+                    pipe.id,
+                    aggregation.buildings[position],
+                    aggregation.demand_kwp[position],
+                    aggregation.demand_kwh[position],
+                    aggregation.diversity(position),
+                    aggregation.load_kw(position),
+                    pipe.capacity,
+                    pipe.diameter,
+                ],
+            )
+            for position, pipe in enumerate(aggregation.graph.pipes)
+        ),
+    )
+
+
+def result_layers(network: ftr.Network) -> list[ResultLayer]:
+    """All result layers of a network"""
+    aggregation: agg.LoadAggregation = agg.aggregate_loads(network)
+    return [
+        forks_layer(network),
+        branches_layer(network),
+        problematic_pipes_layer(network, aggregation),
+        problematic_buildings_layer(network),
+        loads_layer(aggregation),
+    ]
+
+
+def batches(
+    rows: Iterable[tuple[QgsGeometry, list[Any]]],
+    fields: QgsFields,
+    size: int = BATCH_SIZE,
+) -> Iterator[list[QgsFeature]]:
+    """Features of the rows in lists of at most size features"""
+    iterator: Iterator[tuple[QgsGeometry, list[Any]]] = iter(rows)
+    while chunk := list(islice(iterator, size)):
+        features: list[QgsFeature] = []
+        for geometry, values in chunk:
+            feature = QgsFeature(fields)
+            feature.setGeometry(geometry)
+            feature.setAttributes(values)
+            features.append(feature)
+        yield features
+
+
+def fill_layer(
+    layer: QgsVectorLayer, rows: Iterable[tuple[QgsGeometry, list[Any]]]
+) -> None:
+    """Add the rows to the layer with one provider call per batch"""
+    provider = layer.dataProvider()
+    for features in batches(rows, layer.fields()):
+        if not provider.addFeatures(features):
+            raise ex.ResultExportError(layer.name(), provider.lastError())
+    layer.updateExtents()
+
+
+def write_geopackage_table(
+    layer: QgsVectorLayer, path: Path, project: QgsProject
+) -> QgsVectorLayer:
+    """Write a layer as a table of a GeoPackage and return the written layer"""
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "GPKG"
+    options.layerName = layer.name()
+    options.actionOnExistingFile = (
+        QgsVectorFileWriter.ActionOnExistingFile.CreateOrOverwriteLayer
+        if path.exists()
+        else QgsVectorFileWriter.ActionOnExistingFile.CreateOrOverwriteFile
+    )
+    error, message, *_ = QgsVectorFileWriter.writeAsVectorFormatV3(
+        layer, str(path), project.transformContext(), options
+    )
+    if error != QgsVectorFileWriter.WriterError.NoError:
+        raise ex.ResultExportError(str(path), message)
+
+    written = QgsVectorLayer(f"{path}|layername={layer.name()}", layer.name(), "ogr")
+    if not written.isValid():
+        raise ex.NewLayerInvalidError(layer.name())
+    return written
+
+
+def export_results(  # noqa: PLR0913
+    network: ftr.Network,
+    export_format: ExportFormat = ExportFormat.MEMORY,
+    path: str | Path | None = None,
+    group_name: str | None = GROUP_NAME,
+    qgis_project: QgsProject | None = None,
+    layers: list[ResultLayer] | None = None,
+) -> list[QgsVectorLayer]:
+    """Write the result layers of a network and save the project once
+
+    Memory layers are filled in batches through their provider. For a
+    GeoPackage (path required), every filled layer is written as one table and
+    the table is added to the project instead of the memory layer.
+    """
+    proj: QgsProject = qgis_project or prl.load_project()
+    if export_format == ExportFormat.GEOPACKAGE and path is None:
+        msg = "a GeoPackage export needs a path"
+        raise ValueError(msg)
+
+    added: list[QgsVectorLayer] = []
+    for result in layers if layers is not None else result_layers(network):
+        filled: QgsVectorLayer = prl.memory_layer(
+            result.name, result.geometry_type, network.crs, result.qgs_fields()
+        )
+        fill_layer(filled, result.rows)
+
+        layer: QgsVectorLayer = (
+            write_geopackage_table(filled, Path(path), proj)  # type: ignore[arg-type]
+            if export_format == ExportFormat.GEOPACKAGE
+            else filled
+        )
+        prl.add_layer_to_project(layer, group_name, proj)
+        added.append(layer)
+
+    if proj.fileName():
+        prl.save_project(proj)
+    return added
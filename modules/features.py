@@ -2,26 +2,200 @@
 
 # pylint: disable=[no-name-in-module]
 
-from dataclasses import dataclass, field, fields
-from typing import Self, cast
+import functools
+import math
+from array import array
+from collections import Counter, deque
+from collections.abc import Callable, Iterable, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import InitVar, dataclass, field, fields
+from pathlib import Path
+from typing import Any, Self, TypeVar, cast, get_args
 
-from qgis.core import Qgis, QgsDistanceArea, QgsFeature, QgsGeometry, QgsPointXY
+from qgis.core import (
+    Qgis,
+    QgsCoordinateReferenceSystem,
+    QgsFeature,
+    QgsFields,
+    QgsGeometry,
+    QgsPointXY,
+    QgsRectangle,
+)
+from qgis.PyQt.QtCore import QVariant
 
+from modules import cache
 from modules import constants as cont
 from modules import exceptions as ex
+from modules import instrumentation as instr
 from modules import project_layers as prl
+from modules import spatial
 
+T = TypeVar("T")
+Record = TypeVar("Record", bound="Building | Pipe")
 
-@dataclass
+CHUNKS_PER_WORKER: int = 4  # pipe chunks per matching thread, for load balancing
+
+
+def as_list(value: list[T] | T | None) -> list[T]:
+    """Return a single-or-list attribute (e.g. connected_buildings) as a list"""
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def single_or_list(values: list[T]) -> list[T] | T | None:
+    """Return a list in the single-or-list form of e.g. connected_buildings"""
+    if not values:
+        return None
+    return values[0] if len(values) == 1 else values
+
+
+def to_float(value: Any) -> float | None:
+    """Attribute value as a float (None for NULL and non-numbers)"""
+    if isinstance(value, bool | QVariant) or value is None:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def to_int(value: Any) -> int | None:
+    """Attribute value as an int (floats are rounded, None for NULL and non-numbers)"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    number: float | None = to_float(value)
+    return round(number) if number is not None else None
+
+
+def to_bool(value: Any) -> bool | None:
+    """Attribute value as a bool (also 0/1 and "true"/"false", None for NULL)"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int | float):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ("true", "1"):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ("false", "0"):
+        return False
+    return None
+
+
+def to_str(value: Any) -> str | None:
+    """Attribute value as a str (numbers are formatted, None for NULL)"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, int | float) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+
+CONVERTERS: dict[type, Callable[[Any], Any]] = {
+    bool: to_bool,
+    float: to_float,
+    int: to_int,
+    str: to_str,
+}
+
+
+@dataclass(frozen=True, slots=True)
+class AttributeColumn:
+    """ThermosFields attribute of a record class and the converter of its type"""
+
+    name: str  # field of the record
+    field_name: str  # THERMOS field
+    convert: Callable[[Any], Any]
+
+
+@functools.cache
+def attribute_columns(record_type: type) -> tuple[AttributeColumn, ...]:
+    """ThermosFields attributes of a pipe or building class (resolved once)"""
+    columns: list[AttributeColumn] = []
+    for attr in fields(record_type):
+        field_name: str | None = getattr(cont.ThermosFields, attr.name, None)
+        if not isinstance(field_name, str):
+            continue
+        value_type: type = next(
+            arg for arg in (*get_args(attr.type), attr.type) if arg in CONVERTERS
+        )
+        columns.append(AttributeColumn(attr.name, field_name, CONVERTERS[value_type]))
+    return tuple(columns)
+
+
+@dataclass(frozen=True, slots=True)
+class AttributeReader:
+    """Reads the ThermosFields attributes of the features of one layer
+
+    The field indexes are looked up once for the layer fields; every feature
+    then hands over its attribute list once and the columns are picked by index.
+    """
+
+    columns: tuple[AttributeColumn, ...]
+    indexes: tuple[int, ...]  # -1 for fields missing in the layer
+
+    @classmethod
+    def for_fields(cls, record_type: type, qgs_fields: QgsFields) -> Self:
+        """Reader of a pipe or building class for features with the given fields"""
+        columns: tuple[AttributeColumn, ...] = attribute_columns(record_type)
+        return cls(
+            columns, tuple(qgs_fields.lookupField(col.field_name) for col in columns)
+        )
+
+    def read(self, target: "Building | Pipe", feature: QgsFeature) -> None:
+        """Copy the converted attributes of a feature into the record"""
+        values: list[Any] = feature.attributes()
+        for column, index in zip(self.columns, self.indexes, strict=True):
+            if index >= 0 and (value := column.convert(values[index])) is not None:
+                setattr(target, column.name, value)
+
+
+def read_thermos_attributes(
+    target: "Building | Pipe",
+    source: QgsFeature | Mapping[str, Any],
+    reader: AttributeReader | None = None,
+) -> None:
+    """Copy the ThermosFields attributes of a feature (or of a mapping of field
+    names to values, e.g. GeoJSON properties) into the matching fields
+
+    Pass the reader of the layer when reading many features of it.
+    """
+    if isinstance(source, QgsFeature):
+        (reader or AttributeReader.for_fields(type(target), source.fields())).read(
+            target, source
+        )
+        return
+    for column in attribute_columns(type(target)):
+        if (value := column.convert(source.get(column.field_name))) is not None:
+            setattr(target, column.name, value)
+
+
+def thermos_attributes(source: "Building | Pipe") -> dict:
+    """Return the ThermosFields attributes of a building or pipe by field name"""
+    return {
+        column.field_name: getattr(source, column.name)
+        for column in attribute_columns(type(source))
+    }
+
+
+@dataclass(eq=False, slots=True)
 class Building:
-    """Building feature"""
+    """Building feature
 
-    feature: QgsFeature
+    Only the ThermosFields attributes are kept, and the footprint is stored as
+    WKB; the QgsFeature itself is not held on to. Instead of a feature, a
+    mapping of THERMOS field names to values can be given (with the wkb).
+    The bounding box is kept as a tuple; a QgsGeometry is only built when the
+    geometry property is accessed.
+    """
+
+    feature: InitVar[QgsFeature | Mapping[str, Any] | None] = None
     id: str | None = None
+    fid: int | None = None  # QGIS feature id
     node: "Node | None" = None
     pipe: "Pipe | None" = None
-    attributes: dict = field(init=False)
-    geometry: QgsGeometry = field(init=False)
+    wkb: bytes = field(default=b"", repr=False)
+    bbox: spatial.Bounds | None = field(default=None, repr=False)
     area_roof: float | None = None
     area_ground: float | None = None
     demand_cap_cooling: float | None = None
@@ -32,62 +206,129 @@ class Building:
     demand_cons_ww: float | None = None
     height: int | None = None
     in_solution: bool | None = None
-    supply_capacity: int | None = None
+    supply_capacity: float | None = None
+    reader: InitVar[AttributeReader | None] = None
 
-    def __post_init__(self) -> None:
+    def __post_init__(
+        self,
+        feature: QgsFeature | Mapping[str, Any] | None,
+        reader: AttributeReader | None,
+    ) -> None:
         """Fill class attributes"""
-        self.attributes = self.feature.attributeMap()
-        self.geometry = self.feature.geometry()
-        for attr in fields(self):
-            field_name: str | None = getattr(cont.ThermosFields, attr.name, None)
-            if isinstance(field_name, str) and isinstance(
-                self.attributes.get(field_name),
-                attr.type,  # type: ignore[argument-type]
-            ):
-                setattr(self, attr.name, self.attributes.get(field_name))
+        if isinstance(feature, QgsFeature):
+            self.fid = feature.id()
+            geometry: QgsGeometry = feature.geometry()
+            self.wkb = geometry.asWkb().data()
+            self.bbox = spatial.rectangle_bounds(geometry.boundingBox())
+        if feature is not None:
+            read_thermos_attributes(self, feature, reader)
 
+    def bounds(self) -> spatial.Bounds:
+        """Bounding box of the footprint (read from the WKB on first use)"""
+        if self.bbox is None:
+            self.bbox = spatial.wkb_bounds(self.wkb)
+        return self.bbox
 
-@dataclass
+    def bounding_box(self) -> QgsRectangle:
+        """Bounding box of the footprint"""
+        return spatial.rectangle(self.bounds())
+
+    @property
+    def geometry(self) -> QgsGeometry:
+        """Footprint geometry (built from the stored WKB on every access)"""
+        geometry = QgsGeometry()
+        geometry.fromWkb(self.wkb)
+        return geometry
+
+    @property
+    def attributes(self) -> dict:
+        """ThermosFields attributes by field name"""
+        return thermos_attributes(self)
+
+
+@dataclass(eq=False, slots=True)
 class Pipe:
-    """Pipe feature"""
+    """Pipe feature
 
-    feature: QgsFeature
+    Only the ThermosFields attributes are kept, and the vertices are stored as
+    a flat array of x, y coordinates; the QgsFeature itself is not held on to.
+    Instead of a feature, a mapping of THERMOS field names to values can be
+    given (with the vertices).
+    """
+
+    feature: InitVar[QgsFeature | Mapping[str, Any] | None] = None
     id: str | None = None
+    fid: int | None = None  # QGIS feature id
     node_start: "Node | None" = None
     node_end: "Node | None" = None
     connected_buildings: list[Building] | Building | None = None
     connected_pipes: list[Self] | Self | None = None
-    attributes: dict = field(init=False)
-    geometry: QgsGeometry = field(init=False)
+    vertices: array = field(default_factory=lambda: array("d"), repr=False)
+    point_id_start: str | None = None
+    point_id_end: str | None = None
     diameter: int | None = None
-    length: int | None = None
-    capacity: int | None = None  # Heizleistung in Leitung
+    length: float | None = None
+    capacity: float | None = None  # Heizleistung in Leitung
     diversity: float | None = None  # Gleichzeitigkeitsfaktor
+    reader: InitVar[AttributeReader | None] = None
 
-    def __post_init__(self) -> None:
+    def __post_init__(
+        self,
+        feature: QgsFeature | Mapping[str, Any] | None,
+        reader: AttributeReader | None,
+    ) -> None:
         """Fill class attributes"""
-        self.attributes = self.feature.attributeMap()
-        self.geometry = self.feature.geometry()
-        self.node_start = Node(
-            self.geometry.asPolyline()[0],
-            cast(str | None, self.attributes.get(cont.ThermosFields.point_id_start)),
-        )
-        self.node_end = Node(
-            self.geometry.asPolyline()[-1],
-            cast(str | None, self.attributes.get(cont.ThermosFields.point_id_end)),
-        )
-        for attr in fields(self):
-            field_name: str | None = getattr(cont.ThermosFields, attr.name, None)
-            if isinstance(field_name, str) and isinstance(
-                self.attributes.get(field_name),
-                attr.type,  # type: ignore[argument-type]
-            ):
-                setattr(self, attr.name, self.attributes.get(field_name))
+        if isinstance(feature, QgsFeature):
+            self.fid = feature.id()
+            self.vertices = array(
+                "d",
+                (
+                    coordinate
+                    for point in feature.geometry().asPolyline()
+                    for coordinate in (point.x(), point.y())
+                ),
+            )
+        if feature is not None:
+            read_thermos_attributes(self, feature, reader)
 
+        if self.vertices and self.node_start is None:
+            self.node_start = Node(
+                QgsPointXY(self.vertices[0], self.vertices[1]), self.point_id_start
+            )
+        if self.vertices and self.node_end is None:
+            self.node_end = Node(
+                QgsPointXY(self.vertices[-2], self.vertices[-1]), self.point_id_end
+            )
 
-@dataclass
+    def polyline(self) -> list[QgsPointXY]:
+        """Vertices as points"""
+        return [
+            QgsPointXY(self.vertices[i], self.vertices[i + 1])
+            for i in range(0, len(self.vertices), 2)
+        ]
+
+    def bounds(self) -> spatial.Bounds:
+        """Bounding box of the vertices"""
+        return spatial.coordinate_bounds(self.vertices)
+
+    def bounding_box(self) -> QgsRectangle:
+        """Bounding box of the vertices"""
+        return spatial.rectangle(self.bounds())
+
+    @property
+    def geometry(self) -> QgsGeometry:
+        """Line geometry (built from the stored vertices on every access)"""
+        return QgsGeometry.fromPolylineXY(self.polyline())
+
+    @property
+    def attributes(self) -> dict:
+        """ThermosFields attributes by field name"""
+        return thermos_attributes(self)
+
+
+@dataclass(eq=False, slots=True)
 class Node:
-    """Node feature"""
+    """Node feature (compared and hashed by identity, see NodeIndex for merging)"""
 
     coordinates: QgsPointXY
     id: str | None = None
@@ -95,9 +336,49 @@ class Node:
     building: Building | None = None
     pipes: list[Pipe] | Pipe | None = None
 
-    def __hash__(self) -> int:
-        """Hash from coordinates"""
-        return hash((self.coordinates.x(), self.coordinates.y()))
+
+@dataclass
+class NodeIndex:
+    """Shared nodes of the pipe ends, by path id and on a snapping grid
+
+    A pipe end is merged into the node with the same path id (path/start,
+    path/end) if there is one, otherwise into the nearest node within the
+    snapping tolerance of the grid, as long as their ids do not contradict.
+    Each lookup touches a dict and nine grid cells, so merging is linear.
+    """
+
+    grid: spatial.PointGrid[Node]
+    by_id: dict[str, Node] = field(default_factory=dict, repr=False)
+
+    def shared(self, node: Node) -> Node:
+        """Node the pipe end is merged into (the node itself if it is new)"""
+        if node.id is not None and (known := self.by_id.get(node.id)) is not None:
+            return known
+
+        nearest: Node | None = self.grid.nearest(
+            node.coordinates.x(),
+            node.coordinates.y(),
+            lambda candidate: node.id is None or candidate.id in (None, node.id),
+        )
+        if nearest is None:
+            self.add(node)
+            return node
+        if nearest.id is None and node.id is not None:
+            nearest.id = node.id
+            self.by_id[node.id] = nearest
+        return nearest
+
+    def add(self, node: Node) -> None:
+        """Register a node without merging it"""
+        self.grid.add(node.coordinates.x(), node.coordinates.y(), node)
+        if node.id is not None:
+            self.by_id.setdefault(node.id, node)
+
+    def remove(self, node: Node) -> None:
+        """Forget a node that is no longer in use"""
+        self.grid.remove(node.coordinates.x(), node.coordinates.y(), node)
+        if node.id is not None and self.by_id.get(node.id) is node:
+            del self.by_id[node.id]
 
 
 @dataclass
@@ -112,33 +393,402 @@ class Branch:
 
 @dataclass
 class Network:
-    """Features and attributes in solution"""
+    """Features and attributes in solution
+
+    By default the pipes and buildings are read from the THERMOS layers of the
+    current QGIS project. Pipes and buildings that were loaded otherwise
+    (see modules.loaders) can be passed in instead, together with their CRS.
+    Their topology is resolved, restored from a topology record of the same
+    records (see topology_record), or with resolve False left unresolved for
+    the build stages to be run one by one (see benchmarks.run).
+
+    With use_cache, the resolved topology of project layers is cached next to
+    the project file and reused as long as the layers are unchanged.
+
+    Pipe ends with the same path id, or within snap_tolerance of each other,
+    are merged into one node.
 
+    With workers > 1, pipes are matched to buildings in that many threads; the
+    result is the same as with a single one.
+
+    With instrument, the wall time and counters of every stage are collected in
+    report and written to the QGIS message log. With trace_memory as well, the
+    peak Python memory of every stage is traced too; tracing slows the build
+    down, so the report then marks its timings as taken under tracing.
+    """
+
+    pipes: InitVar[Iterable[Pipe] | None] = None
+    buildings: InitVar[Iterable[Building] | None] = None
+    crs: QgsCoordinateReferenceSystem = field(
+        default_factory=QgsCoordinateReferenceSystem
+    )
+    tolerance: float = 0.01  # metres
+    snap_tolerance: float = 0.001  # metres
+    distance_mode: spatial.DistanceMode = spatial.DistanceMode.ELLIPSOIDAL
+    extent: QgsRectangle | None = None
+    use_cache: bool = False
+    workers: int = 1
+    instrument: bool = False
+    trace_memory: bool = False
+    topology: InitVar[dict[str, Any] | None] = None
+    resolve: InitVar[bool] = True
+    report: instr.BuildReport | None = field(default=None, init=False, repr=False)
+    proximity: spatial.ProximityTester | None = field(
+        default=None, init=False, repr=False
+    )
+    indexed_buildings: list[Building | None] = field(init=False, repr=False)
+    raw_matches: dict[Pipe, list[Building]] = field(init=False, repr=False)
+    node_index: NodeIndex = field(init=False, repr=False)
+    building_pipes: dict[Building, list[Pipe]] = field(init=False, repr=False)
+    buildings_by_id: dict[str, Building] = field(init=False, repr=False)
+    pipes_by_id: dict[str, Pipe] = field(init=False, repr=False)
+    connector_counts: Counter[Building] = field(init=False, repr=False)
     all_pipes: list[Pipe] = field(init=False)
     all_nodes: set[Node] = field(init=False)
     all_buildings: list[Building] = field(init=False)
     forks: list[Node] = field(init=False)
     connectors: list[Pipe] = field(init=False)
     links: list[Pipe] = field(init=False)
+    branches: list[Branch] = field(init=False, default_factory=list)
 
-    def __post_init__(self) -> None:
+    def __post_init__(
+        self,
+        pipes: Iterable[Pipe] | None,
+        buildings: Iterable[Building] | None,
+        topology: dict[str, Any] | None,
+        resolve: bool,
+    ) -> None:
         """Fill class attributes"""
-        thermos_layers = prl.ThermosLayers()
-        self.all_pipes = [
-            Pipe(feat)
-            for feat in list(thermos_layers.pipes.getFeatures())  # type: ignore[reportArgumentType]
-            if self.check_pipe(feat)
-        ]
+        if not self.instrument:
+            self.load(pipes, buildings, topology, resolve=resolve)
+            return
+
+        recorder = instr.Recorder(trace_memory=self.trace_memory)
+        with recorder.active():
+            self.load(pipes, buildings, topology, resolve=resolve)
+        self.report = recorder.report
+        self.report.log()
+
+    def load(
+        self,
+        pipes: Iterable[Pipe] | None,
+        buildings: Iterable[Building] | None,
+        topology: dict[str, Any] | None = None,
+        *,
+        resolve: bool = True,
+    ) -> None:
+        """Read the pipes and buildings and resolve (or restore) the topology"""
+        cache_key: str | None = None
+        if pipes is None or buildings is None:
+            thermos_layers = prl.ThermosLayers()
+            self.crs = thermos_layers.buildings.crs()
+            if self.use_cache:
+                cache_key = cache.topology_key(
+                    [thermos_layers.pipes, thermos_layers.buildings],
+                    {
+                        "tolerance": self.tolerance,
+                        "snap_tolerance": self.snap_tolerance,
+                        "distance_mode": self.distance_mode,
+                        "extent": self.extent,
+                    },
+                )
+            pipe_reader = AttributeReader.for_fields(
+                Pipe, thermos_layers.pipes.fields()
+            )
+            building_reader = AttributeReader.for_fields(
+                Building, thermos_layers.buildings.fields()
+            )
+            pipes = (
+                Pipe(feat, reader=pipe_reader)
+                for feat in thermos_layers.pipe_features(self.extent)
+                if self.check_pipe(feat)
+            )
+            buildings = (
+                Building(feat, reader=building_reader)
+                for feat in thermos_layers.building_features(self.extent)
+                if self.check_building(feat)
+            )
+
+        with instr.stage("read_features"):
+            self.all_pipes = list(pipes)
+            self.all_buildings = list(buildings)
+
+        if topology is not None:
+            with instr.stage("restore_topology"):
+                if not self.restore_topology(topology):
+                    raise ex.TopologyRecordError
+            return
+        if not resolve:
+            return
+
+        cache_dir: Path | None = cache.project_cache_dir() if cache_key else None
+        if cache_key is None or cache_dir is None:
+            self.build()
+            return
+
+        topology_cache = cache.TopologyCache(cache_dir)
+        with instr.stage("restore_topology"):
+            record: dict[str, Any] | None = topology_cache.load(cache_key)
+            restored: bool = record is not None and self.restore_topology(record)
+        if not restored:
+            self.build()
+            with instr.stage("store_topology"):
+                topology_cache.store(cache_key, self.topology_record())
+
+    def build(self) -> None:
+        """Resolve connectors and topology from all_pipes and all_buildings"""
+        with instr.stage("index_ids"):
+            self.index_ids()
+        with instr.stage("match_buildings"):
+            self.match_buildings()
+        with instr.stage("resolve_multi_building_pipes"):
+            self.resolve_multi_building_pipes()
+        with instr.stage("classify_pipes"):
+            self.classify_pipes()
+        with instr.stage("build_nodes"):
+            self.build_nodes()
+        with instr.stage("detect_forks"):
+            self.detect_forks()
+        with instr.stage("count_connectors"):
+            self.count_connectors()
+
+    def topology_record(self) -> dict[str, Any]:
+        """Resolved topology by position of pipes, buildings and nodes
 
-        self.all_buildings = [
-            Building(feat)
-            for feat in list(thermos_layers.buildings.getFeatures())  # type: ignore[reportArgumentType]
-            if self.check_building(feat)
+        The feature ids of the pipes and buildings are stored in the order the
+        positions refer to. Connected buildings are stored like the attribute
+        itself: null, a single position or a list of positions.
+        """
+        building_positions: dict[Building, int] = {
+            building: position for position, building in enumerate(self.all_buildings)
+        }
+        nodes: list[Node] = list(self.all_nodes)
+        node_positions: dict[Node, int] = {
+            node: position for position, node in enumerate(nodes)
+        }
+        return {
+            "pipes": [pipe.fid for pipe in self.all_pipes],
+            "buildings": [building.fid for building in self.all_buildings],
+            "connected": [
+                [building_positions[bldg] for bldg in pipe.connected_buildings]
+                if isinstance(pipe.connected_buildings, list)
+                else building_positions.get(pipe.connected_buildings)  # type: ignore[arg-type]
+                for pipe in self.all_pipes
+            ],
+            "nodes": [
+                [node.coordinates.x(), node.coordinates.y(), node.id] for node in nodes
+            ],
+            "ends": [
+                [
+                    node_positions.get(pipe.node_start, -1),  # type: ignore[arg-type]
+                    node_positions.get(pipe.node_end, -1),  # type: ignore[arg-type]
+                ]
+                for pipe in self.all_pipes
+            ],
+            "forks": [position for position, node in enumerate(nodes) if node.is_fork],
+        }
+
+    def restore_topology(self, record: dict[str, Any]) -> bool:
+        """Apply a topology record instead of building it (False if it does not fit)
+
+        Pipes and buildings are matched to the record by feature id (by
+        position if none of them has one), and every position in the record is
+        checked before anything is applied.
+        """
+        pipes: list[Pipe] | None = self.in_record_order(
+            self.all_pipes, record.get("pipes")
+        )
+        buildings: list[Building] | None = self.in_record_order(
+            self.all_buildings, record.get("buildings")
+        )
+        if (
+            pipes is None
+            or buildings is None
+            or not self.topology_fits(record, len(pipes), len(buildings))
+        ):
+            return False
+
+        self.index_ids()
+        for pipe, connected in zip(pipes, record["connected"], strict=True):
+            pipe.connected_buildings = (
+                [buildings[position] for position in connected]
+                if isinstance(connected, list)
+                else None
+                if connected is None
+                else buildings[connected]
+            )
+        self.index_building_pipes()
+        self.classify_pipes()
+
+        nodes: list[Node] = [
+            Node(QgsPointXY(x, y), node_id) for x, y, node_id in record["nodes"]
         ]
+        adjacency: list[list[Pipe]] = [[] for _ in nodes]
+        for pipe, (start, end) in zip(pipes, record["ends"], strict=True):
+            pipe.node_start = nodes[start] if start >= 0 else None
+            pipe.node_end = nodes[end] if end >= 0 else None
+            for position in {start, end} - {-1}:
+                adjacency[position].append(pipe)
+        for node, node_pipes in zip(nodes, adjacency, strict=True):
+            node.pipes = node_pipes
+        for position in record["forks"]:
+            nodes[position].is_fork = True
+
+        self.node_index = self.new_node_index()
+        for node in nodes:
+            self.node_index.add(node)
+        self.all_nodes = set(nodes)
+        self.forks = [node for node in nodes if node.is_fork]
+        self.count_connectors()
+        return True
+
+    @staticmethod
+    def in_record_order(records: list[Record], fids: Any) -> list[Record] | None:
+        """Pipes or buildings in the order of the feature ids of a topology record
 
+        None if the feature ids are not exactly those of the records.
+        """
+        if not isinstance(fids, list) or len(fids) != len(records):
+            return None
+        if all(record.fid is None for record in records):
+            return list(records) if all(fid is None for fid in fids) else None
+
+        by_fid: dict[int | None, Record] = {record.fid: record for record in records}
+        if (
+            None in by_fid
+            or len(by_fid) != len(records)
+            or not all(isinstance(fid, int) for fid in fids)
+            or len(set(fids)) != len(fids)
+            or not all(fid in by_fid for fid in fids)
+        ):
+            return None
+        return [by_fid[fid] for fid in fids]
+
+    @staticmethod
+    def topology_fits(record: dict[str, Any], pipes: int, buildings: int) -> bool:
+        """Check that all positions of a topology record are in range"""
+        try:
+            nodes: int = len(record["nodes"])
+            return (
+                len(record["connected"]) == pipes
+                and len(record["ends"]) == pipes
+                and all(len(node) == 3 for node in record["nodes"])  # noqa: PLR2004
+                and all(
+                    isinstance(position, int) and 0 <= position < buildings
+                    for connected in record["connected"]
+                    for position in as_list(connected)
+                )
+                and all(
+                    len(ends) == 2  # noqa: PLR2004
+                    and all(isinstance(end, int) and -1 <= end < nodes for end in ends)
+                    for ends in record["ends"]
+                )
+                and all(
+                    isinstance(position, int) and 0 <= position < nodes
+                    for position in record["forks"]
+                )
+            )
+        except (KeyError, TypeError):
+            return False
+
+    def index_ids(self) -> None:
+        """Map the feature ids to pipes and buildings (first one wins on duplicates)"""
+        self.buildings_by_id = {}
+        for building in self.all_buildings:
+            if building.id is not None:
+                self.buildings_by_id.setdefault(building.id, building)
+
+        self.pipes_by_id = {}
         for pipe in self.all_pipes:
-            pipe.connected_buildings = self.directly_connected_building(pipe)
+            if pipe.id is not None:
+                self.pipes_by_id.setdefault(pipe.id, pipe)
+
+    def index_buildings(self) -> None:
+        """Set up the proximity tests against the current buildings
+
+        Positions of the proximity tester refer to indexed_buildings, which is
+        only appended to (and has None for removed buildings) during updates.
+        Only the bounding boxes are indexed; footprints are built from their
+        WKB for the exact tests of the buildings near a pipe.
+        """
+        bounds: list[spatial.Bounds | None] = [
+            building.bounds() for building in self.all_buildings
+        ]
+        self.indexed_buildings = list(self.all_buildings)
+        self.proximity = spatial.proximity_tester(
+            self.distance_mode,
+            bounds,
+            self.building_geometry,
+            self.crs,
+            spatial.combined_extent(bounds),
+            self.tolerance,
+        )
+
+    def building_geometry(self, position: int) -> QgsGeometry:
+        """Footprint of the indexed building at a position of the proximity tester"""
+        return cast(Building, self.indexed_buildings[position]).geometry
+
+    def match_buildings(self) -> None:
+        """Connect every pipe to the buildings close to it
+
+        The unresolved matches are kept in raw_matches for incremental updates.
+        """
+        self.index_buildings()
+        self.raw_matches = {}
+        for pipe, near in zip(
+            self.all_pipes, self.match_pipes(self.all_pipes), strict=True
+        ):
+            self.raw_matches[pipe] = near
+            pipe.connected_buildings = single_or_list(list(near))
+
+    def match_pipes(self, pipes: list[Pipe]) -> list[list[Building]]:
+        """Return the buildings near every pipe, in the order of the pipes
+
+        With several workers, the pipes are cut into spatially coherent chunks
+        (runs along a Z-order curve of their start points, so a thread keeps
+        testing the same buildings) and the chunks are matched in a thread
+        pool. The results are put back by position, so they do not depend on
+        the order in which the threads finish.
+        """
+        if self.workers <= 1 or len(pipes) <= 1:
+            return [self.buildings_near(pipe) for pipe in pipes]
+
+        order: list[int] = spatial.z_order(
+            [
+                (pipe.vertices[0], pipe.vertices[1]) if pipe.vertices else (0.0, 0.0)
+                for pipe in pipes
+            ]
+        )
+        size: int = math.ceil(len(order) / (self.workers * CHUNKS_PER_WORKER))
+        chunks: list[list[int]] = [
+            order[start : start + size] for start in range(0, len(order), size)
+        ]
+        matches: list[list[Building]] = [[] for _ in pipes]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for chunk, results in zip(
+                chunks,
+                pool.map(
+                    lambda chunk: [self.buildings_near(pipes[pos]) for pos in chunk],
+                    chunks,
+                ),
+                strict=True,
+            ):
+                for position, near in zip(chunk, results, strict=True):
+                    matches[position] = near
+        return matches
 
+    def prepare_updates(self) -> None:
+        """Make sure the matching indexes exist (they are skipped on cache hits)"""
+        if self.proximity is not None:
+            return
+        self.index_buildings()
+        self.raw_matches = dict(
+            zip(self.all_pipes, self.match_pipes(self.all_pipes), strict=True)
+        )
+
+    def resolve_multi_building_pipes(self) -> None:
+        """Reduce pipes close to several buildings to the ones not connected otherwise"""
+        self.index_building_pipes()
         for pipe in [
             pip
             for pip in self.all_pipes
@@ -147,26 +797,235 @@ class Network:
         ]:
             self.clean_up_pipe_connected_to_multi_bldg(pipe)
 
-        self.connectors = [pipe for pipe in self.all_pipes if pipe.connected_buildings]
-        self.links = [pipe for pipe in self.all_pipes if pipe not in self.connectors]
+    def index_building_pipes(self) -> None:
+        """Map every building to the pipes connected to it"""
+        self.building_pipes = {building: [] for building in self.all_buildings}
+        for pipe in self.all_pipes:
+            for building in as_list(pipe.connected_buildings):
+                self.building_pipes[building].append(pipe)
 
-        self.all_nodes = {
-            node
+    def count_connectors(self) -> None:
+        """Count the pipes directly connected to a single building, per building"""
+        self.connector_counts = Counter(
+            pipe.connected_buildings
             for pipe in self.all_pipes
-            for node in (pipe.node_start, pipe.node_end)
-            if node is not None
-        }
+            if isinstance(pipe.connected_buildings, Building)
+        )
 
+    def classify_pipes(self) -> None:
+        """Split the pipes into connectors (touching a building) and links"""
+        self.connectors = []
+        self.links = []
+        for pipe in self.all_pipes:
+            (self.connectors if pipe.connected_buildings else self.links).append(pipe)
+
+    def build_nodes(self) -> None:
+        """Merge the pipe end points into nodes and attach the adjacent pipes
+
+        Every pipe end is pointed at the one shared instance of its node (see
+        NodeIndex), so the topology can be walked from pipe to node to pipe.
+        """
+        self.node_index = self.new_node_index()
+        adjacency: dict[Node, list[Pipe]] = {}
+        for pipe in self.all_pipes:
+            if pipe.node_start is not None:
+                pipe.node_start = self.node_index.shared(pipe.node_start)
+            if pipe.node_end is not None:
+                pipe.node_end = self.node_index.shared(pipe.node_end)
+            for node in {pipe.node_start, pipe.node_end} - {None}:
+                adjacency.setdefault(node, []).append(pipe)  # type: ignore[arg-type]
+
+        for node, pipes in adjacency.items():
+            node.pipes = pipes
+
+        self.all_nodes = set(adjacency)
+
+    def new_node_index(self) -> NodeIndex:
+        """Empty node index with the snapping tolerance at the network's latitude"""
+        latitude: float = next(
+            (pipe.vertices[1] for pipe in self.all_pipes if len(pipe.vertices) > 1),
+            0.0,
+        )
+        return NodeIndex(
+            spatial.PointGrid(
+                self.snap_tolerance, spatial.metres_per_unit(self.crs, latitude)
+            )
+        )
+
+    def detect_forks(self) -> None:
+        """Flag nodes where more than two links meet"""
+        links: set[Pipe] = set(self.links)
         for node in self.all_nodes:
-            node.pipes = [
-                pipe
-                for pipe in self.all_pipes
-                if node in (pipe.node_start, pipe.node_end)
-            ]
-            node.is_fork = len([pipe for pipe in node.pipes if pipe in self.links]) > 2  # noqa: PLR2004
+            node.is_fork = (
+                sum(pipe in links for pipe in cast(list[Pipe], node.pipes)) > 2  # noqa: PLR2004
+            )
 
         self.forks = [node for node in self.all_nodes if node.is_fork]
 
+    def supply_connectors(self) -> list[Pipe]:
+        """Connectors of the supply buildings"""
+        return [
+            pipe
+            for building in self.all_buildings
+            if building.supply_capacity
+            for pipe in self.building_pipes.get(building, [])
+        ]
+
+    def supply_nodes(self) -> list[Node]:
+        """Nodes where the connectors of the supply buildings meet the supply
+
+        Only the end of a connector nearer to the footprint of its supply is
+        taken, so the connector itself is the first pipe downstream.
+        """
+        nodes: list[Node] = []
+        for building in self.all_buildings:
+            if not building.supply_capacity:
+                continue
+            footprint: QgsGeometry = building.geometry
+            for pipe in self.building_pipes.get(building, []):
+                if (node := self.nearest_end(pipe, footprint)) is not None:
+                    nodes.append(node)
+        return nodes
+
+    @staticmethod
+    def nearest_end(pipe: Pipe, footprint: QgsGeometry) -> Node | None:
+        """End node of a pipe nearest to a footprint"""
+        return min(
+            (node for node in (pipe.node_start, pipe.node_end) if node is not None),
+            key=lambda node: footprint.distance(
+                QgsGeometry.fromPointXY(node.coordinates)
+            ),
+            default=None,
+        )
+
+    def find_branches(self) -> list[Branch]:
+        """Split the links at the forks into branches, starting from the supplies
+
+        The links are walked breadth first (iteratively, so deep networks do not
+        hit the recursion limit) from the nodes of the connectors of supply
+        buildings. Links that cannot be reached from a supply form branches with
+        connected_to_source False. Connectors and their buildings are attached to
+        the branch that reaches them first.
+        """
+        links: set[Pipe] = set(self.links)
+        branch_of: dict[Pipe, Branch] = {}
+        branch_at: dict[Node, Branch] = {}
+        self.branches = []
+
+        self.walk_branches(
+            [
+                node
+                for pipe in self.supply_connectors()
+                for node in (pipe.node_start, pipe.node_end)
+                if node is not None
+            ],
+            links,
+            branch_of,
+            branch_at,
+            connected=True,
+        )
+
+        # Unreached parts: start at dead ends and forks, then at any node (rings)
+        ends: list[Node] = [
+            node
+            for pipe in self.links
+            for node in (pipe.node_start, pipe.node_end)
+            if node is not None
+        ]
+        self.walk_branches(
+            [node for node in ends if self.link_degree(node, links) != 2],  # noqa: PLR2004
+            links,
+            branch_of,
+            branch_at,
+            connected=False,
+        )
+        self.walk_branches(ends, links, branch_of, branch_at, connected=False)
+
+        self.attach_connectors(branch_of, branch_at)
+        return self.branches
+
+    @staticmethod
+    def link_degree(node: Node, links: set[Pipe]) -> int:
+        """Number of links at a node"""
+        return sum(pipe in links for pipe in as_list(node.pipes))
+
+    def walk_branches(  # noqa: PLR0913
+        self,
+        starts: list[Node],
+        links: set[Pipe],
+        branch_of: dict[Pipe, Branch],
+        branch_at: dict[Node, Branch],
+        *,
+        connected: bool,
+    ) -> None:
+        """Follow the unassigned links from the start nodes, one branch per chain
+
+        A branch ends at a fork, a dead end or an already assigned link; the
+        nodes where branches end are queued to start the next branches.
+        """
+        pending: deque[Node] = deque(starts)
+        while pending:
+            node: Node = pending.popleft()
+            for pipe in as_list(node.pipes):
+                if pipe not in links or pipe in branch_of:
+                    continue
+
+                branch = Branch(
+                    str(len(self.branches) + 1),
+                    connected_to_source=connected,
+                    buildings=[],
+                    pipes=[],
+                )
+                self.branches.append(branch)
+                branch_at.setdefault(node, branch)
+                current, start = pipe, node
+                while True:
+                    cast(list[Pipe], branch.pipes).append(current)
+                    branch_of[current] = branch
+                    end: Node | None = (
+                        current.node_end
+                        if current.node_start is start
+                        else current.node_start
+                    )
+                    if end is None:
+                        break
+                    branch_at.setdefault(end, branch)
+                    onward: list[Pipe] = [
+                        pip
+                        for pip in as_list(end.pipes)
+                        if pip in links and pip not in branch_of
+                    ]
+                    if end.is_fork or self.link_degree(end, links) != 2 or not onward:  # noqa: PLR2004
+                        pending.append(end)
+                        break
+                    current, start = onward[0], end
+
+    def attach_connectors(
+        self, branch_of: dict[Pipe, Branch], branch_at: dict[Node, Branch]
+    ) -> None:
+        """Add the connectors and their buildings to the branch at their nodes
+
+        Chains of connectors are followed from node to node.
+        """
+        attached: set[Building] = set()
+        pending: deque[Node] = deque(branch_at)
+        while pending:
+            node: Node = pending.popleft()
+            branch: Branch = branch_at[node]
+            for pipe in as_list(node.pipes):
+                if pipe in branch_of:
+                    continue
+                branch_of[pipe] = branch
+                cast(list[Pipe], branch.pipes).append(pipe)
+                for building in as_list(pipe.connected_buildings):
+                    if building not in attached:
+                        attached.add(building)
+                        cast(list[Building], branch.buildings).append(building)
+                for other in (pipe.node_start, pipe.node_end):
+                    if other is not None and other not in branch_at:
+                        branch_at[other] = branch
+                        pending.append(other)
+
     def check_pipe(self, feature: QgsFeature) -> bool:
         """Check if a given feature is a pipe"""
         return (
@@ -183,52 +1042,45 @@ class Network:
 
     def get_building_from_id(self, id_str: str) -> Building | None:
         """Return the building with the given id"""
-        return next(bldg for bldg in self.all_buildings if bldg.id == id_str)
+        return self.buildings_by_id.get(id_str)
 
     def get_pipe_from_id(self, id_str: str) -> Pipe | None:
         """Return the pipe with the given id"""
-        return next(pipe for pipe in self.all_pipes if pipe.id == id_str)
+        return self.pipes_by_id.get(id_str)
+
+    def buildings_near(self, pipe: Pipe) -> list[Building]:
+        """Return the buildings close to any vertex of the given pipe
+
+        Only buildings whose buffered bounding box contains a vertex of the pipe
+        are tested exactly.
+        """
+        return [
+            cast(Building, self.indexed_buildings[position])
+            for position in self.proximity.near_points(pipe.polyline())  # type: ignore[union-attr]
+        ]
 
     def directly_connected_building(
         self, pipe: Pipe
     ) -> list[Building] | Building | None:
         """Return the building directly connected to the given pipe"""
-        if buildings_close_to_pipe := [
-            building
-            for building in self.all_buildings
-            if any(
-                self.point_near_polygon(point, building.geometry)
-                for point in pipe.geometry.asPolyline()
-            )
-        ]:
-            return (
-                buildings_close_to_pipe[0]
-                if len(buildings_close_to_pipe) == 1
-                else buildings_close_to_pipe
-            )
-        return None
+        return single_or_list(self.buildings_near(pipe))
 
     def clean_up_pipe_connected_to_multi_bldg(self, pipe: Pipe) -> None:
         """Return the building directly connected to the given pipe,
         when there are multiple buildings close to it
+
+        Buildings that are also connected to another pipe are dropped from this
+        pipe. The building -> pipes index is updated on the way, so pipes are
+        resolved in the order they are cleaned up (all_pipes order in __post_init__).
         """
         if not isinstance(pipe.connected_buildings, list):
             raise ex.PipeNotConnectedToMultipleBuildingsError(pipe)
 
-        for building in pipe.connected_buildings:
-            if [
-                pip
-                for pip in [p for p in self.all_pipes if p != pipe]
-                if (
-                    isinstance(pip.connected_buildings, Building)
-                    and pip.connected_buildings == building
-                )
-                or (
-                    isinstance(pip.connected_buildings, list)
-                    and building in pip.connected_buildings
-                )
-            ]:
+        for building in list(pipe.connected_buildings):
+            connected_pipes: list[Pipe] = self.building_pipes[building]
+            if any(pip is not pipe for pip in connected_pipes):
                 pipe.connected_buildings.remove(building)
+                connected_pipes.remove(pipe)
 
         if len(pipe.connected_buildings) == 1:
             pipe.connected_buildings = pipe.connected_buildings[0]
@@ -237,18 +1089,7 @@ class Network:
         self, point: QgsPointXY, building: QgsGeometry, tolerance: float = 0.01
     ) -> bool:
         """Check if a point is in, on or near a polygon"""
-        point_geom: QgsGeometry = QgsGeometry.fromPointXY(point)
-        shortest_line: QgsGeometry = point_geom.shortestLine(building)
-
-        # Create a QgsDistanceArea object to calculate distances
-        distance_area_object: QgsDistanceArea = QgsDistanceArea()
-        distance_area_object.setEllipsoid("WGS84")  # "WGS84" is the default
-
-        return (
-            building.contains(point_geom)
-            or building.intersects(point_geom)
-            or distance_area_object.measureLength(shortest_line) < tolerance
-        )
+        return spatial.point_near_polygon(point, building, tolerance)
 
     def problematic_pipes(
         self, *, return_ids: bool = True
@@ -276,26 +1117,15 @@ class Network:
         self, *, return_ids: bool = True
     ) -> dict[str, list[Building]] | dict[str, list[str]]:
         """Check if all buildings are connected"""
-        directly_connected_buildings: list[Building] = [
-            pipe.connected_buildings
-            for pipe in self.all_pipes
-            if isinstance(pipe.connected_buildings, Building)
-        ]
         wo: str = "buildings without connector"
         multi: str = "buildings with multiple connectors"
-        dic: dict[str, list[Building]] = {
-            wo: [
-                building
-                for building in self.all_buildings
-                if building not in directly_connected_buildings
-            ],
-            multi: [
-                building
-                for building in self.all_buildings
-                if directly_connected_buildings.count(building) > 1
-                and not building.supply_capacity
-            ],
-        }
+        dic: dict[str, list[Building]] = {wo: [], multi: []}
+        for building in self.all_buildings:
+            count: int = self.connector_counts[building]
+            if count == 0:
+                dic[wo].append(building)
+            elif count > 1 and not building.supply_capacity:
+                dic[multi].append(building)
 
         return (
             {
@@ -0,0 +1,328 @@
+"""Array-backed topology of the network"""
+
+# pylint: disable=[no-name-in-module]
+
+import heapq
+import math
+from array import array
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Self
+
+from qgis.core import QgsCoordinateReferenceSystem
+
+from modules import features as ftr
+from modules import spatial
+
+
+@dataclass
+class Orientation:
+    """Pipes oriented away from the supplies by a breadth first search
+
+    Every pipe reached from a supply has the pipe upstream of it as parent
+    (-1 at a supply) and the node it leads to as downstream node. Pipes that
+    close a ring are reached, but nothing is downstream of them.
+    """
+
+    order: array  # pipe positions, upstream before downstream
+    parent: array  # upstream pipe position per pipe (-1 at a supply or unreached)
+    downstream: array  # node position the pipe leads to (-1 if unreached)
+    reached: bytearray  # 1 for pipes reachable from a supply
+
+
+@dataclass
+class ShortestPaths:
+    """Shortest pipe paths from the nearest supply to every node (Dijkstra)
+
+    Arrays are indexed by node position: distance is the summed pipe length
+    (inf if unreached), previous the last pipe of the path (-1 at a supply or
+    unreached) and origin the supply node the path starts at.
+    """
+
+    graph: "NetworkGraph"
+    lengths: array  # metres per pipe position
+    distance: array
+    previous: array
+    origin: array
+
+    def pipe_path(self, node: int) -> list[int]:
+        """Pipe positions from the supply to a node (empty at a supply or unreached)"""
+        path: list[int] = []
+        pipe: int = self.previous[node]
+        while pipe >= 0:
+            path.append(pipe)
+            node = self.graph.other_end(pipe, node)
+            pipe = self.previous[node]
+        path.reverse()
+        return path
+
+
+@dataclass
+class NetworkGraph:
+    """Pipes and nodes as positions in flat arrays (compressed sparse rows)
+
+    The pipes incident to node n are incident[offsets[n]:offsets[n + 1]], and
+    the nodes of pipe p are ends[2 * p] and ends[2 * p + 1] (-1 if missing).
+    """
+
+    pipes: list[ftr.Pipe]
+    nodes: list[ftr.Node] = field(default_factory=list)
+    ends: array = field(default_factory=lambda: array("l"), repr=False)
+    offsets: array = field(default_factory=lambda: array("l", [0]), repr=False)
+    incident: array = field(default_factory=lambda: array("l"), repr=False)
+    node_positions: dict[int, int] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_network(cls, network: ftr.Network) -> Self:
+        """Build the arrays from the (shared) nodes of the pipes"""
+        graph: Self = cls(list(network.all_pipes))
+        for pipe in graph.pipes:
+            for node in (pipe.node_start, pipe.node_end):
+                if node is None:
+                    graph.ends.append(-1)
+                    continue
+                position: int = graph.node_positions.setdefault(
+                    id(node), len(graph.nodes)
+                )
+                if position == len(graph.nodes):
+                    graph.nodes.append(node)
+                graph.ends.append(position)
+
+        degrees: array = array("l", [0]) * (len(graph.nodes) + 1)
+        for node_position in graph.ends:
+            if node_position >= 0:
+                degrees[node_position + 1] += 1
+        for position in range(len(graph.nodes)):
+            degrees[position + 1] += degrees[position]
+        graph.offsets = degrees
+
+        cursor: array = array("l", degrees[:-1])
+        graph.incident = array("l", [0]) * degrees[-1]
+        for end, node_position in enumerate(graph.ends):
+            if node_position >= 0:
+                graph.incident[cursor[node_position]] = end // 2
+                cursor[node_position] += 1
+        return graph
+
+    def node_position(self, node: ftr.Node) -> int | None:
+        """Position of a node (None if no pipe ends there)"""
+        return self.node_positions.get(id(node))
+
+    def other_end(self, pipe: int, node: int) -> int:
+        """Node at the other end of a pipe"""
+        start, end = self.ends[2 * pipe], self.ends[2 * pipe + 1]
+        return end if start == node else start
+
+    def orient(self, sources: list[int]) -> Orientation:
+        """Orient the pipes breadth first from the source nodes"""
+        pipe_count: int = len(self.pipes)
+        orientation = Orientation(
+            order=array("l"),
+            parent=array("l", [-1]) * pipe_count,
+            downstream=array("l", [-1]) * pipe_count,
+            reached=bytearray(pipe_count),
+        )
+        incoming: array = array("l", [-1]) * len(self.nodes)
+        seen = bytearray(len(self.nodes))
+        queue: deque[int] = deque()
+        for source in sources:
+            if not seen[source]:
+                seen[source] = 1
+                queue.append(source)
+
+        offsets, incident = self.offsets, self.incident
+        while queue:
+            node: int = queue.popleft()
+            for pipe in incident[offsets[node] : offsets[node + 1]]:
+                if orientation.reached[pipe]:
+                    continue
+                orientation.reached[pipe] = 1
+                orientation.parent[pipe] = incoming[node]
+                orientation.order.append(pipe)
+                downstream: int = self.other_end(pipe, node)
+                orientation.downstream[pipe] = downstream
+                if downstream >= 0 and not seen[downstream]:
+                    seen[downstream] = 1
+                    incoming[downstream] = pipe
+                    queue.append(downstream)
+        return orientation
+
+    def loop_pipes(self) -> bytearray:
+        """Flag the pipes on a loop, i.e. all pipes that are not bridges
+
+        Bridges are found by an iterative depth first search (Tarjan): a pipe
+        is a bridge if no node below it reaches above it by another pipe.
+        Parallel pipes and pipes from a node to itself are on a loop.
+        """
+        node_count: int = len(self.nodes)
+        discovered: array = array("l", [-1]) * node_count
+        low: array = array("l", [0]) * node_count
+        in_loop = bytearray([1]) * len(self.pipes)
+        offsets, incident = self.offsets, self.incident
+        time: int = 0
+        for root in range(node_count):
+            if discovered[root] >= 0:
+                continue
+            discovered[root] = low[root] = time
+            time += 1
+            # node, pipe it was entered by, next position in incident
+            stack: list[list[int]] = [[root, -1, offsets[root]]]
+            while stack:
+                frame: list[int] = stack[-1]
+                node, entered, cursor = frame
+                if cursor < offsets[node + 1]:
+                    frame[2] += 1
+                    pipe: int = incident[cursor]
+                    other: int = self.other_end(pipe, node)
+                    if pipe == entered or other < 0:
+                        continue
+                    if discovered[other] < 0:
+                        discovered[other] = low[other] = time
+                        time += 1
+                        stack.append([other, pipe, offsets[other]])
+                    else:
+                        low[node] = min(low[node], discovered[other])
+                    continue
+
+                stack.pop()
+                if stack:
+                    parent: int = stack[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                    if low[node] > discovered[parent]:
+                        in_loop[entered] = 0
+
+        for pipe in range(len(self.pipes)):
+            if self.ends[2 * pipe] < 0 or self.ends[2 * pipe + 1] < 0:
+                in_loop[pipe] = 0  # open ends
+        return in_loop
+
+    def shortest_paths(self, sources: list[int], lengths: array) -> ShortestPaths:
+        """Run one Dijkstra search from all source nodes over the pipe lengths"""
+        node_count: int = len(self.nodes)
+        paths = ShortestPaths(
+            graph=self,
+            lengths=lengths,
+            distance=array("d", [math.inf]) * node_count,
+            previous=array("l", [-1]) * node_count,
+            origin=array("l", [-1]) * node_count,
+        )
+        distance, previous, origin = paths.distance, paths.previous, paths.origin
+        heap: list[tuple[float, int]] = []
+        for source in sources:
+            if distance[source] > 0.0:
+                distance[source] = 0.0
+                origin[source] = source
+                heap.append((0.0, source))
+        heapq.heapify(heap)
+
+        offsets, incident = self.offsets, self.incident
+        while heap:
+            reached, node = heapq.heappop(heap)
+            if reached > distance[node]:
+                continue  # already settled over a shorter path
+            for pipe in incident[offsets[node] : offsets[node + 1]]:
+                other: int = self.other_end(pipe, node)
+                candidate: float = reached + lengths[pipe]
+                if other >= 0 and candidate < distance[other]:
+                    distance[other] = candidate
+                    previous[other] = pipe
+                    origin[other] = origin[node]
+                    heapq.heappush(heap, (candidate, other))
+        return paths
+
+    def supply_positions(self, network: ftr.Network) -> list[int]:
+        """Positions of the supply nodes of the network"""
+        return [
+            position
+            for node in network.supply_nodes()
+            if (position := self.node_position(node)) is not None
+        ]
+
+
+@dataclass
+class BuildingPaths:
+    """Pipe path from the nearest supply to every connected building
+
+    Arrays are indexed like buildings: distance is the path length in metres
+    (inf if no supply is reached), connector the pipe position of the
+    connector the path ends with and entry the node where it enters the
+    connector (-1 if unreached).
+    """
+
+    paths: ShortestPaths
+    buildings: list[ftr.Building]
+    distance: array
+    connector: array
+    entry: array
+
+    def pipe_path(self, index: int) -> list[int]:
+        """Pipe positions from the supply to a building (empty if unreached)"""
+        connector: int = self.connector[index]
+        if connector < 0:
+            return []
+        path: list[int] = self.paths.pipe_path(self.entry[index])
+        if not path or path[-1] != connector:
+            path.append(connector)
+        return path
+
+    def pipes(self, index: int) -> list[ftr.Pipe]:
+        """Pipes from the supply to a building"""
+        return [self.paths.graph.pipes[pipe] for pipe in self.pipe_path(index)]
+
+
+def pipe_lengths(
+    pipes: list[ftr.Pipe], crs: QgsCoordinateReferenceSystem
+) -> array:
+    """Length of every pipe in metres (path/length, measured if it is missing)"""
+    return array(
+        "d",
+        (
+            pipe.length
+            if pipe.length is not None
+            else spatial.line_length(pipe.geometry, crs)
+            for pipe in pipes
+        ),
+    )
+
+
+def supply_paths(network: ftr.Network) -> BuildingPaths:
+    """Shortest pipe paths from the supplies to every connected building
+
+    One Dijkstra search from all supply nodes gives the distance to every
+    node; a building is reached over the nearer end of its best connector.
+    The searches start at the supply end of the supply connectors (see
+    Network.supply_nodes), so every path begins with a supply connector and
+    its length is part of every distance. Supplies themselves are not
+    included.
+    """
+    graph: NetworkGraph = NetworkGraph.from_network(network)
+    paths: ShortestPaths = graph.shortest_paths(
+        graph.supply_positions(network), pipe_lengths(graph.pipes, network.crs)
+    )
+
+    positions: dict[ftr.Building, int] = {}
+    result = BuildingPaths(paths, [], array("d"), array("l"), array("l"))
+    for pipe, connector in enumerate(graph.pipes):
+        entry: int = min(
+            (node for node in graph.ends[2 * pipe : 2 * pipe + 2] if node >= 0),
+            key=lambda node: paths.distance[node],
+            default=-1,
+        )
+        for building in ftr.as_list(connector.connected_buildings):
+            if building.supply_capacity:
+                continue
+            if (index := positions.get(building)) is None:
+                index = positions[building] = len(result.buildings)
+                result.buildings.append(building)
+                result.distance.append(math.inf)
+                result.connector.append(-1)
+                result.entry.append(-1)
+
+            if entry < 0:
+                continue
+            distance: float = paths.distance[entry] + paths.lengths[pipe]
+            if distance < result.distance[index]:
+                result.distance[index] = distance
+                result.connector[index] = pipe
+                result.entry[index] = entry
+    return result
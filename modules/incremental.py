@@ -0,0 +1,423 @@
+"""Incremental network updates driven by layer edits"""
+
+# pylint: disable=[no-name-in-module]
+
+import itertools
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+from typing import Any, Generic, TypeVar
+
+from qgis.core import QgsFeature, QgsRectangle, QgsSpatialIndex, QgsVectorLayer
+
+from modules import features as ftr
+from modules import project_layers as prl
+from modules import spatial
+
+T = TypeVar("T")
+
+
+@dataclass
+class ListPositions(Generic[T]):
+    """Positions of the items of a list, so items are removed in constant time
+
+    The last item is moved into the place of a removed one, so the list keeps
+    its items but not their order.
+    """
+
+    items: list[T]
+    positions: dict[T, int] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        """Fill class attributes"""
+        self.positions = {item: position for position, item in enumerate(self.items)}
+
+    def add(self, item: T) -> None:
+        """Append an item unless it is in the list already"""
+        if item not in self.positions:
+            self.positions[item] = len(self.items)
+            self.items.append(item)
+
+    def remove(self, item: T) -> None:
+        """Remove an item if it is in the list"""
+        position: int | None = self.positions.pop(item, None)
+        if position is None:
+            return
+        last: T = self.items.pop()
+        if last is not item:
+            self.items[position] = last
+            self.positions[last] = position
+
+
+@dataclass
+class NetworkUpdater:
+    """Keep a Network in sync with edits of the THERMOS layers
+
+    Listens to featureAdded, featureDeleted, geometryChanged and
+    attributeValueChanged of the pipe and building layers. Every edit replaces
+    the affected Pipe or Building and re-resolves the pipes whose connectors
+    can depend on it: the edited pipe, the pipes near an edited building and,
+    transitively, every pipe sharing a candidate building with those (their
+    connected component in the pipe - building candidate graph). Components
+    are resolved independently of each other, in the order the pipes were
+    read: an edited pipe keeps the place of the one it replaces and new pipes
+    come last. As long as the layer returns its features in that order (by
+    feature id), the connectors are the same as after a full rebuild.
+
+    An edit costs time in the size of that component, not of the network:
+    all_pipes, all_buildings, connectors, links and forks are patched in
+    place (without keeping their order), fork flags are recomputed only at the
+    nodes of the re-resolved pipes, and the branches are dropped to be found
+    again on demand (see modules.export).
+    """
+
+    network: ftr.Network
+    layers: prl.ThermosLayers = field(default_factory=prl.ThermosLayers)
+    pipes_by_fid: dict[int, ftr.Pipe] = field(init=False, repr=False)
+    buildings_by_fid: dict[int, ftr.Building] = field(init=False, repr=False)
+    building_positions: dict[ftr.Building, int] = field(init=False, repr=False)
+    building_candidates: dict[ftr.Building, list[ftr.Pipe]] = field(
+        init=False, repr=False
+    )
+    pipe_order: dict[ftr.Pipe, int] = field(init=False, repr=False)
+    orders: itertools.count = field(init=False, repr=False)
+    all_pipes: ListPositions[ftr.Pipe] = field(init=False, repr=False)
+    all_buildings: ListPositions[ftr.Building] = field(init=False, repr=False)
+    connectors: ListPositions[ftr.Pipe] = field(init=False, repr=False)
+    links: ListPositions[ftr.Pipe] = field(init=False, repr=False)
+    forks: ListPositions[ftr.Node] = field(init=False, repr=False)
+    pipe_index: QgsSpatialIndex = field(init=False, repr=False)
+    pipe_handles: dict[ftr.Pipe, int] = field(init=False, repr=False)
+    indexed_pipes: dict[int, ftr.Pipe] = field(init=False, repr=False)
+    search_buffer: float = field(init=False, repr=False)
+    connections: list[tuple[Any, Callable[..., None]]] = field(
+        init=False, repr=False, default_factory=list
+    )
+    handles: itertools.count = field(
+        init=False, repr=False, default_factory=itertools.count
+    )
+
+    def __post_init__(self) -> None:
+        """Index the network and connect to the layer signals"""
+        network: ftr.Network = self.network
+        if not hasattr(network, "connector_counts"):  # built with resolve=False
+            network.build()
+        network.prepare_updates()
+
+        self.pipes_by_fid = {
+            pipe.fid: pipe for pipe in network.all_pipes if pipe.fid is not None
+        }
+        self.buildings_by_fid = {
+            bldg.fid: bldg for bldg in network.all_buildings if bldg.fid is not None
+        }
+        self.building_positions = {
+            building: position
+            for position, building in enumerate(network.indexed_buildings)
+            if building is not None
+        }
+        self.building_candidates = {bldg: [] for bldg in network.all_buildings}
+        for pipe, near in network.raw_matches.items():
+            for building in near:
+                self.building_candidates[building].append(pipe)
+        self.pipe_order = {pipe: order for order, pipe in enumerate(network.all_pipes)}
+        self.orders = itertools.count(len(network.all_pipes))
+        self.all_pipes = ListPositions(network.all_pipes)
+        self.all_buildings = ListPositions(network.all_buildings)
+        self.connectors = ListPositions(network.connectors)
+        self.links = ListPositions(network.links)
+        self.forks = ListPositions(network.forks)
+
+        self.pipe_index = QgsSpatialIndex()
+        self.pipe_handles = {}
+        self.indexed_pipes = {}
+        for pipe in network.all_pipes:
+            self.index_pipe(pipe)
+        self.search_buffer = spatial.search_buffer(
+            network.tolerance,
+            network.crs,
+            network.proximity.extent,  # type: ignore[union-attr]
+        )
+
+        self.watch(self.layers.pipes, self.pipe_changed, self.pipe_deleted)
+        self.watch(self.layers.buildings, self.building_changed, self.building_deleted)
+
+    def watch(
+        self,
+        layer: QgsVectorLayer,
+        changed: Callable[[int], None],
+        deleted: Callable[[int], None],
+    ) -> None:
+        """Connect the edit signals of a layer"""
+        for signal, slot in (
+            (layer.featureAdded, changed),
+            (layer.featureDeleted, deleted),
+            (layer.geometryChanged, lambda fid, _geometry: changed(fid)),
+            (layer.attributeValueChanged, lambda fid, _index, _value: changed(fid)),
+        ):
+            signal.connect(slot)
+            self.connections.append((signal, slot))
+
+    def stop(self) -> None:
+        """Disconnect from the layer signals"""
+        for signal, slot in self.connections:
+            signal.disconnect(slot)
+        self.connections.clear()
+
+    def fetch(
+        self, layer: QgsVectorLayer, fid: int, check: Callable[[QgsFeature], bool]
+    ) -> QgsFeature | None:
+        """Return the feature if it (still) belongs to the network"""
+        feature: QgsFeature = layer.getFeature(fid)
+        if not feature.isValid() or not check(feature):
+            return None
+        extent = self.network.extent
+        if extent is not None and not feature.geometry().boundingBox().intersects(
+            extent
+        ):
+            return None
+        return feature
+
+    def pipe_changed(self, fid: int) -> None:
+        """Replace (or add) the pipe of an added or edited feature"""
+        feature = self.fetch(self.layers.pipes, fid, self.network.check_pipe)
+        old: ftr.Pipe | None = self.pipes_by_fid.pop(fid, None)
+        new: ftr.Pipe | None = ftr.Pipe(feature) if feature else None
+        if new:
+            self.pipes_by_fid[fid] = new
+            if old:
+                self.pipe_order[new] = self.pipe_order[old]
+        self.update(
+            add_pipes=[new] if new else [], remove_pipes=[old] if old else []
+        )
+
+    def pipe_deleted(self, fid: int) -> None:
+        """Remove the pipe of a deleted feature"""
+        if old := self.pipes_by_fid.pop(fid, None):
+            self.update(remove_pipes=[old])
+
+    def building_changed(self, fid: int) -> None:
+        """Replace (or add) the building of an added or edited feature"""
+        feature = self.fetch(self.layers.buildings, fid, self.network.check_building)
+        old: ftr.Building | None = self.buildings_by_fid.pop(fid, None)
+        new: ftr.Building | None = ftr.Building(feature) if feature else None
+        if new:
+            self.buildings_by_fid[fid] = new
+        self.update(
+            add_buildings=[new] if new else [],
+            remove_buildings=[old] if old else [],
+        )
+
+    def building_deleted(self, fid: int) -> None:
+        """Remove the building of a deleted feature"""
+        if old := self.buildings_by_fid.pop(fid, None):
+            self.update(remove_buildings=[old])
+
+    def index_pipe(self, pipe: ftr.Pipe) -> None:
+        """Add a pipe to the pipe index (pipes without vertices are skipped)"""
+        if not pipe.vertices:
+            return
+        handle: int = next(self.handles)
+        self.pipe_handles[pipe] = handle
+        self.indexed_pipes[handle] = pipe
+        self.pipe_index.addFeature(handle, pipe.bounding_box())
+
+    def pipes_near(self, building: ftr.Building) -> list[ftr.Pipe]:
+        """Pipes whose bounding box is within the search buffer of a building"""
+        box: QgsRectangle = building.bounding_box()
+        box.grow(self.search_buffer)
+        return [
+            self.indexed_pipes[handle]
+            for handle in sorted(self.pipe_index.intersects(box))
+            if handle in self.indexed_pipes
+        ]
+
+    def update(  # noqa: C901, PLR0912
+        self,
+        *,
+        add_pipes: Iterable[ftr.Pipe] = (),
+        remove_pipes: Iterable[ftr.Pipe] = (),
+        add_buildings: Iterable[ftr.Building] = (),
+        remove_buildings: Iterable[ftr.Building] = (),
+    ) -> None:
+        """Patch the network for added and removed pipes and buildings"""
+        network: ftr.Network = self.network
+        added_pipes: list[ftr.Pipe] = list(add_pipes)
+        rematch: list[ftr.Pipe] = list(added_pipes)
+        reresolve: list[ftr.Pipe] = []
+        touched: set[ftr.Building] = set()
+        dirty_nodes: set[ftr.Node] = set()
+
+        for building in remove_buildings:
+            self.all_buildings.remove(building)
+            if building.id and network.buildings_by_id.get(building.id) is building:
+                del network.buildings_by_id[building.id]
+            position: int = self.building_positions.pop(building)
+            network.proximity.remove(position)  # type: ignore[union-attr]
+            network.indexed_buildings[position] = None
+            for pipe in self.building_candidates.pop(building, []):
+                network.raw_matches[pipe].remove(building)
+                reresolve.append(pipe)
+            network.building_pipes.pop(building, None)
+            network.connector_counts.pop(building, None)
+
+        for pipe in remove_pipes:
+            self.all_pipes.remove(pipe)
+            self.connectors.remove(pipe)
+            self.links.remove(pipe)
+            del self.pipe_order[pipe]
+            if pipe.id and network.pipes_by_id.get(pipe.id) is pipe:
+                del network.pipes_by_id[pipe.id]
+            for building in network.raw_matches.pop(pipe, []):
+                self.building_candidates[building].remove(pipe)
+                touched.add(building)
+            self.detach_connections(pipe)
+            dirty_nodes |= self.detach_nodes(pipe)
+            if (handle := self.pipe_handles.pop(pipe, None)) is not None:
+                self.indexed_pipes.pop(handle)
+
+        for building in add_buildings:
+            self.all_buildings.add(building)
+            if building.id:
+                network.buildings_by_id.setdefault(building.id, building)
+            network.indexed_buildings.append(building)
+            self.building_positions[building] = network.proximity.add(  # type: ignore[union-attr]
+                building.bounds()
+            )
+            self.building_candidates[building] = []
+            network.building_pipes[building] = []
+            rematch.extend(self.pipes_near(building))
+
+        for pipe in added_pipes:
+            self.all_pipes.add(pipe)
+            self.pipe_order.setdefault(pipe, next(self.orders))
+            if pipe.id:
+                network.pipes_by_id.setdefault(pipe.id, pipe)
+            self.index_pipe(pipe)
+            dirty_nodes |= self.attach_nodes(pipe)
+
+        for pipe in dict.fromkeys(rematch):
+            for building in network.raw_matches.get(pipe, []):
+                self.building_candidates[building].remove(pipe)
+                touched.add(building)
+            network.raw_matches[pipe] = network.buildings_near(pipe)
+            for building in network.raw_matches[pipe]:
+                self.building_candidates[building].append(pipe)
+                touched.add(building)
+
+        reresolve.extend(rematch)
+        for building in touched:
+            reresolve.extend(self.building_candidates.get(building, []))
+        component: list[ftr.Pipe] = self.component(reresolve)
+        dirty_nodes |= self.resolve(component)
+
+        for pipe in component:
+            if pipe.connected_buildings:
+                self.links.remove(pipe)
+                self.connectors.add(pipe)
+            else:
+                self.connectors.remove(pipe)
+                self.links.add(pipe)
+        for node in dirty_nodes:
+            node.is_fork = (
+                sum(not pipe.connected_buildings for pipe in ftr.as_list(node.pipes))
+                > 2  # noqa: PLR2004
+            )
+            (self.forks.add if node.is_fork else self.forks.remove)(node)
+        network.branches = []
+
+    def component(self, pipes: Iterable[ftr.Pipe]) -> list[ftr.Pipe]:
+        """Pipes sharing candidate buildings with the given ones, transitively
+
+        The resolution of a pipe depends on the other candidates of its
+        buildings, and theirs on their buildings and so on, so the whole
+        connected component has to be resolved again.
+        """
+        network: ftr.Network = self.network
+        found: dict[ftr.Pipe, None] = dict.fromkeys(
+            pipe for pipe in pipes if pipe in network.raw_matches  # not removed
+        )
+        pending: list[ftr.Pipe] = list(found)
+        visited: set[ftr.Building] = set()
+        while pending:
+            for building in network.raw_matches[pending.pop()]:
+                if building in visited:
+                    continue
+                visited.add(building)
+                for pipe in self.building_candidates[building]:
+                    if pipe not in found:
+                        found[pipe] = None
+                        pending.append(pipe)
+        return list(found)
+
+    def resolve(self, pipes: list[ftr.Pipe]) -> set[ftr.Node]:
+        """Reassign the buildings of the pipes from their matches, as in a build
+
+        Returns the nodes of the pipes, whose fork flags may have changed.
+        """
+        network: ftr.Network = self.network
+        pipes.sort(key=self.pipe_order.__getitem__)  # read order, as in build()
+        for pipe in pipes:
+            self.detach_connections(pipe)
+
+        for pipe in pipes:
+            pipe.connected_buildings = ftr.single_or_list(
+                list(network.raw_matches[pipe])
+            )
+            for building in ftr.as_list(pipe.connected_buildings):
+                network.building_pipes[building].append(pipe)
+
+        nodes: set[ftr.Node] = set()
+        for pipe in pipes:
+            if isinstance(pipe.connected_buildings, list):
+                network.clean_up_pipe_connected_to_multi_bldg(pipe)
+            if isinstance(pipe.connected_buildings, ftr.Building):
+                network.connector_counts[pipe.connected_buildings] += 1
+            nodes |= {pipe.node_start, pipe.node_end} - {None}  # type: ignore[arg-type]
+        return nodes
+
+    def detach_connections(self, pipe: ftr.Pipe) -> None:
+        """Remove a pipe from the building -> pipes index and connector counts"""
+        network: ftr.Network = self.network
+        for building in ftr.as_list(pipe.connected_buildings):
+            if pipe in (connected := network.building_pipes.get(building, [])):
+                connected.remove(pipe)
+        if isinstance(pipe.connected_buildings, ftr.Building):
+            network.connector_counts[pipe.connected_buildings] -= 1
+            if network.connector_counts[pipe.connected_buildings] <= 0:
+                del network.connector_counts[pipe.connected_buildings]
+        pipe.connected_buildings = None
+
+    def attach_nodes(self, pipe: ftr.Pipe) -> set[ftr.Node]:
+        """Point the ends of a new pipe at shared nodes and return those nodes"""
+        network: ftr.Network = self.network
+        nodes: set[ftr.Node] = set()
+        for end in ("node_start", "node_end"):
+            node: ftr.Node | None = getattr(pipe, end)
+            if node is None:
+                continue
+            shared: ftr.Node = network.node_index.shared(node)
+            if shared is node:
+                node.pipes = []
+                network.all_nodes.add(node)
+            setattr(pipe, end, shared)
+            if pipe not in (shared_pipes := ftr.as_list(shared.pipes)):
+                shared_pipes.append(pipe)
+                shared.pipes = shared_pipes
+            nodes.add(shared)
+        return nodes
+
+    def detach_nodes(self, pipe: ftr.Pipe) -> set[ftr.Node]:
+        """Remove a pipe from its nodes and return the nodes still in use"""
+        network: ftr.Network = self.network
+        nodes: set[ftr.Node] = set()
+        for node in {pipe.node_start, pipe.node_end} - {None}:
+            node_pipes: list[ftr.Pipe] = ftr.as_list(node.pipes)  # type: ignore[union-attr]
+            if pipe in node_pipes:
+                node_pipes.remove(pipe)
+            if node_pipes:
+                nodes.add(node)  # type: ignore[arg-type]
+            else:
+                network.all_nodes.discard(node)  # type: ignore[arg-type]
+                network.node_index.remove(node)  # type: ignore[arg-type]
+                node.is_fork = False  # type: ignore[union-attr]
+                self.forks.remove(node)  # type: ignore[arg-type]
+        return nodes
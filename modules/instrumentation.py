@@ -0,0 +1,164 @@
+"""Opt-in timing and counters of the network build"""
+
+# pylint: disable=[no-name-in-module]
+
+import contextlib
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from dataclasses import asdict, dataclass, field
+from typing import Any, TypeVar
+
+from qgis.core import Qgis, QgsMessageLog
+
+T = TypeVar("T")
+
+LOG_TAG: str = "UTEC"
+
+# Recorder of the build in progress (None: instrumentation disabled)
+ACTIVE: "Recorder | None" = None
+
+
+@dataclass
+class StageReport:
+    """Wall time, counters and peak Python memory of one stage"""
+
+    name: str
+    seconds: float = 0.0
+    counters: dict[str, int] = field(default_factory=dict)
+    peak_bytes: int | None = None  # None if memory was not traced
+
+
+@dataclass
+class BuildReport:
+    """Stages of a build in the order they ran"""
+
+    stages: list[StageReport] = field(default_factory=list)
+    memory_traced: bool = False  # timings include the overhead of tracemalloc
+
+    def total_seconds(self) -> float:
+        """Wall time of all stages"""
+        return sum(stage.seconds for stage in self.stages)
+
+    def counters(self) -> dict[str, int]:
+        """Counters summed over all stages"""
+        total: Counter[str] = Counter()
+        for stage in self.stages:
+            total.update(stage.counters)
+        return dict(total)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Report as a JSON-serialisable dictionary"""
+        return {
+            "memory_traced": self.memory_traced,
+            "total_seconds": self.total_seconds(),
+            "counters": self.counters(),
+            "stages": [asdict(stage) for stage in self.stages],
+        }
+
+    def lines(self) -> list[str]:
+        """Report as text, one line per stage"""
+        lines: list[str] = []
+        for stage in self.stages:
+            line: str = f"{stage.name}: {stage.seconds * 1000:.1f} ms"
+            if stage.peak_bytes is not None:
+                line += f", peak {stage.peak_bytes / 1024:.0f} KiB"
+            if stage.counters:
+                line += ", " + ", ".join(
+                    f"{name} {count}" for name, count in sorted(stage.counters.items())
+                )
+            lines.append(line)
+        total: str = f"total: {self.total_seconds() * 1000:.1f} ms"
+        if self.memory_traced:
+            total += " (timed while tracing memory)"
+        lines.append(total)
+        return lines
+
+    def log(self, tag: str = LOG_TAG) -> None:
+        """Write the report to the QGIS message log"""
+        QgsMessageLog.logMessage("\n".join(self.lines()), tag, Qgis.MessageLevel.Info)
+
+
+@dataclass
+class Recorder:
+    """Collects a BuildReport while it is active
+
+    Tracing memory slows down the stages, so their timings are only comparable
+    between reports that were recorded without it (see BuildReport).
+    """
+
+    trace_memory: bool = False
+    report: BuildReport = field(default_factory=BuildReport)
+    current: StageReport | None = field(default=None, init=False, repr=False)
+    lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    @contextlib.contextmanager
+    def active(self) -> Iterator["Recorder"]:
+        """Make this the recorder of the build in progress"""
+        global ACTIVE  # noqa: PLW0603 # pylint: disable=global-statement
+        previous, ACTIVE = ACTIVE, self
+        started_tracing: bool = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        self.report.memory_traced = tracemalloc.is_tracing()
+        try:
+            yield self
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            ACTIVE = previous
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[StageReport]:
+        """Record a stage (stages nested in it are recorded on their own)"""
+        report = StageReport(name)
+        outer, self.current = self.current, report
+        tracing: bool = tracemalloc.is_tracing() and self.trace_memory
+        if tracing:
+            tracemalloc.reset_peak()
+            before: int = tracemalloc.get_traced_memory()[0]
+        start: float = time.perf_counter()
+        try:
+            yield report
+        finally:
+            report.seconds = time.perf_counter() - start
+            if tracing:
+                report.peak_bytes = tracemalloc.get_traced_memory()[1] - before
+            self.current = outer
+            self.report.stages.append(report)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Add to a counter of the current stage (from any thread)"""
+        if self.current is not None:
+            with self.lock:
+                counters: dict[str, int] = self.current.counters
+                counters[name] = counters.get(name, 0) + amount
+
+
+def stage(name: str) -> contextlib.AbstractContextManager:
+    """Record a stage if instrumentation is active"""
+    if ACTIVE is None:
+        return contextlib.nullcontext()
+    return ACTIVE.stage(name)
+
+
+def count(name: str, amount: int = 1) -> None:
+    """Add to a counter of the current stage if instrumentation is active"""
+    if ACTIVE is not None:
+        ACTIVE.count(name, amount)
+
+
+def counted(items: Iterable[T], name: str) -> Iterable[T]:
+    """Count the items as they are consumed (the items themselves if inactive)"""
+    if ACTIVE is None:
+        return items
+    return counting(items, name, ACTIVE)
+
+
+def counting(items: Iterable[T], name: str, recorder: Recorder) -> Iterator[T]:
+    """Yield the items, counting them in the recorder"""
+    for item in items:
+        recorder.count(name)
+        yield item
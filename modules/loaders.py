@@ -0,0 +1,312 @@
+"""Loading THERMOS exports without a QGIS project"""
+
+# pylint: disable=[no-name-in-module]
+
+import contextlib
+import json
+import re
+import sqlite3
+import struct
+import sys
+from array import array
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from qgis.core import QgsCoordinateReferenceSystem
+
+from modules import constants as cont
+from modules import exceptions as ex
+from modules import features as ftr
+
+GEOJSON_CRS: str = "EPSG:4326"
+CHUNK_SIZE: int = 1 << 16
+FEATURES_ARRAY: re.Pattern = re.compile(r'"features"\s*:\s*\[')
+SEPARATORS: re.Pattern = re.compile(r"[\s,]*")
+
+# WKB geometry type codes (ISO offsets of 1000, 2000, 3000 for Z, M, ZM)
+WKB_LINESTRING: int = 2
+WKB_POLYGON: int = 3
+WKB_MULTILINESTRING: int = 5
+WKB_MULTIPOLYGON: int = 6
+WKB_TYPE_NAMES: dict[int, str] = {
+    1: "Point",
+    WKB_LINESTRING: "LineString",
+    WKB_POLYGON: "Polygon",
+    4: "MultiPoint",
+    WKB_MULTILINESTRING: "MultiLineString",
+    WKB_MULTIPOLYGON: "MultiPolygon",
+    7: "GeometryCollection",
+}
+WKB_NATIVE_BYTE_ORDER: int = 1 if sys.byteorder == "little" else 0
+
+
+def iter_geojson_features(
+    path: str | Path, chunk_size: int = CHUNK_SIZE
+) -> Iterator[dict[str, Any]]:
+    """Stream the features of a GeoJSON FeatureCollection one at a time
+
+    The file is read in chunks and every feature is decoded as soon as it is
+    complete, so memory use is bounded by the largest feature, not the file.
+    """
+    decoder = json.JSONDecoder()
+    with Path(path).open(encoding="utf-8") as file:
+        buffer: str = ""
+        while (match := FEATURES_ARRAY.search(buffer)) is None:
+            if not (chunk := file.read(chunk_size)):
+                raise ex.ThermosExportError(str(path), "no features found")
+            buffer += chunk
+
+        position: int = match.end()
+        while True:
+            position = SEPARATORS.match(buffer, position).end()  # type: ignore[union-attr]
+            if position < len(buffer) and buffer[position] == "]":
+                return
+
+            try:
+                if position == len(buffer):
+                    raise json.JSONDecodeError("Expecting value", buffer, position)
+                feature, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                if not (chunk := file.read(chunk_size)):
+                    raise ex.ThermosExportError(str(path), str(error)) from error
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+
+            yield feature
+            if position > chunk_size:
+                buffer, position = buffer[position:], 0
+
+
+def flat_coordinates(points: list[list[float]]) -> array:
+    """Flatten GeoJSON positions into x, y pairs (dropping z)"""
+    return array("d", (value for point in points for value in point[:2]))
+
+
+def polygon_wkb(rings: list[list[list[float]]]) -> bytes:
+    """Encode the rings of a GeoJSON polygon as WKB"""
+    parts: list[bytes] = [
+        struct.pack("=BII", WKB_NATIVE_BYTE_ORDER, WKB_POLYGON, len(rings))
+    ]
+    for ring in rings:
+        parts.append(struct.pack("=I", len(ring)))
+        parts.append(flat_coordinates(ring).tobytes())
+    return b"".join(parts)
+
+
+def multipolygon_wkb(polygons: list[list[list[list[float]]]]) -> bytes:
+    """Encode a GeoJSON multipolygon as WKB"""
+    header: bytes = struct.pack(
+        "=BII", WKB_NATIVE_BYTE_ORDER, WKB_MULTIPOLYGON, len(polygons)
+    )
+    return header + b"".join(polygon_wkb(polygon) for polygon in polygons)
+
+
+def record_from_geojson(
+    feature: dict[str, Any], path: str | Path
+) -> ftr.Pipe | ftr.Building | None:
+    """Convert a GeoJSON feature in the solution into a pipe or a building
+
+    Lines may be single part multilines, as in GeoPackages. None if the
+    feature is not in the solution.
+    """
+    properties: dict[str, Any] = dict(feature.get("properties") or {})
+    if not properties.get(cont.ThermosFields.in_solution):
+        return None
+    properties.setdefault(cont.ThermosFields.id, feature.get("id"))
+
+    geometry: dict[str, Any] = feature.get("geometry") or {}
+    coordinates: Any = geometry.get("coordinates")
+    geometry_type: str | None = geometry.get("type")
+    match geometry_type:
+        case "LineString":
+            return ftr.Pipe(properties, vertices=flat_coordinates(coordinates))
+        case "MultiLineString" if len(coordinates) == 1:
+            return ftr.Pipe(properties, vertices=flat_coordinates(coordinates[0]))
+        case "Polygon":
+            return ftr.Building(properties, wkb=polygon_wkb(coordinates))
+        case "MultiPolygon":
+            return ftr.Building(properties, wkb=multipolygon_wkb(coordinates))
+    kind: str = "pipe" if geometry_type == "MultiLineString" else "feature"
+    raise ex.ThermosExportError(
+        str(path),
+        f"{kind} {properties[cont.ThermosFields.id]} has unsupported geometry "
+        f"{geometry_type}",
+    )
+
+
+def network_from_geojson(path: str | Path, **network_options: Any) -> ftr.Network:
+    """Build a network straight from a THERMOS GeoJSON export"""
+    pipes: list[ftr.Pipe] = []
+    buildings: list[ftr.Building] = []
+    for feature in iter_geojson_features(path):
+        record: ftr.Pipe | ftr.Building | None = record_from_geojson(feature, path)
+        if isinstance(record, ftr.Pipe):
+            pipes.append(record)
+        elif isinstance(record, ftr.Building):
+            buildings.append(record)
+
+    return ftr.Network(
+        pipes=pipes,
+        buildings=buildings,
+        crs=QgsCoordinateReferenceSystem(GEOJSON_CRS),
+        **network_options,
+    )
+
+
+@dataclass
+class GeoPackageTable:
+    """Feature table of a GeoPackage"""
+
+    name: str
+    geometry_column: str
+    geometry_type: str
+    srs_id: int
+    primary_key: str
+    columns: list[str]
+
+
+def quoted(identifier: str) -> str:
+    """Quote an SQL identifier"""
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def geopackage_tables(connection: sqlite3.Connection) -> list[GeoPackageTable]:
+    """List the feature tables of a GeoPackage that have all THERMOS fields"""
+    tables: list[GeoPackageTable] = []
+    for name, geometry_column, geometry_type, srs_id in connection.execute(
+        "SELECT table_name, column_name, geometry_type_name, srs_id "
+        "FROM gpkg_geometry_columns"
+    ):
+        table_info: list[tuple] = connection.execute(
+            f"PRAGMA table_info({quoted(name)})"
+        ).fetchall()
+        columns: list[str] = [column[1] for column in table_info]
+        if cont.THERMOS_FIELD_NAME_SET <= set(columns):
+            tables.append(
+                GeoPackageTable(
+                    name=name,
+                    geometry_column=geometry_column,
+                    geometry_type=geometry_type.upper(),
+                    srs_id=srs_id,
+                    primary_key=next(
+                        (column[1] for column in table_info if column[5]), "fid"
+                    ),
+                    columns=columns,
+                )
+            )
+    return tables
+
+
+def geopackage_crs(
+    connection: sqlite3.Connection, srs_id: int
+) -> QgsCoordinateReferenceSystem:
+    """Look up the CRS of a GeoPackage spatial reference system id"""
+    row: tuple | None = connection.execute(
+        "SELECT organization, organization_coordsys_id FROM gpkg_spatial_ref_sys "
+        "WHERE srs_id = ?",
+        (srs_id,),
+    ).fetchone()
+    if row is None:
+        return QgsCoordinateReferenceSystem()
+    return QgsCoordinateReferenceSystem(f"{row[0].upper()}:{row[1]}")
+
+
+def geopackage_wkb(blob: bytes) -> bytes:
+    """Strip the GeoPackage header (and envelope) from a geometry blob"""
+    envelope_size: int = (0, 32, 48, 48, 64)[(blob[3] >> 1) & 0b111]
+    return blob[8 + envelope_size :]
+
+
+def wkb_geometry_type(wkb: bytes, offset: int = 0) -> tuple[str, int]:
+    """Byte order (for struct) and ISO geometry type code of a WKB geometry"""
+    byte_order: str = "<" if wkb[offset] == 1 else ">"
+    (geometry_type,) = struct.unpack_from(f"{byte_order}I", wkb, offset + 1)
+    return byte_order, geometry_type
+
+
+def linestring_vertices(wkb: bytes, offset: int = 0) -> array | None:
+    """Read the x, y vertices of a (single part) WKB line (None for others)"""
+    byte_order, geometry_type = wkb_geometry_type(wkb, offset)
+    base_type, dimension_code = geometry_type % 1000, geometry_type // 1000
+    if base_type == WKB_MULTILINESTRING:
+        (parts,) = struct.unpack_from(f"{byte_order}I", wkb, offset + 5)
+        return linestring_vertices(wkb, offset + 9) if parts == 1 else None
+    if base_type != WKB_LINESTRING:
+        return None
+
+    dimensions: int = (2, 3, 3, 4)[dimension_code]
+    (count,) = struct.unpack_from(f"{byte_order}I", wkb, offset + 5)
+    values: tuple[float, ...] = struct.unpack_from(
+        f"{byte_order}{count * dimensions}d", wkb, offset + 9
+    )
+    return array(
+        "d",
+        (
+            value
+            for start in range(0, len(values), dimensions)
+            for value in values[start : start + 2]
+        ),
+    )
+
+
+def iter_geopackage_rows(
+    connection: sqlite3.Connection, table: GeoPackageTable
+) -> Iterator[tuple[int, bytes, dict[str, Any]]]:
+    """Stream fid, WKB and ThermosFields attributes of the features in the solution"""
+    attribute_columns: list[str] = [
+        column for column in cont.THERMOS_FIELDS_IN_USE if column in table.columns
+    ]
+    selected: str = ", ".join(
+        quoted(column)
+        for column in [table.primary_key, table.geometry_column, *attribute_columns]
+    )
+    for fid, blob, *values in connection.execute(
+        f"SELECT {selected} FROM {quoted(table.name)} "  # noqa: S608
+        f"WHERE {quoted(cont.ThermosFields.in_solution)}"
+    ):
+        if blob is not None:
+            yield fid, geopackage_wkb(blob), dict(zip(attribute_columns, values))
+
+
+def network_from_geopackage(path: str | Path, **network_options: Any) -> ftr.Network:
+    """Build a network straight from a GeoPackage with THERMOS result layers"""
+    with contextlib.closing(
+        sqlite3.connect(f"file:{Path(path).as_posix()}?mode=ro", uri=True)
+    ) as db:
+        tables: list[GeoPackageTable] = geopackage_tables(db)
+        pipe_table: GeoPackageTable | None = next(
+            (tab for tab in tables if "LINESTRING" in tab.geometry_type), None
+        )
+        building_table: GeoPackageTable | None = next(
+            (tab for tab in tables if "POLYGON" in tab.geometry_type), None
+        )
+        if pipe_table is None or building_table is None:
+            raise ex.ThermosExportError(str(path), "no THERMOS pipe or building layer")
+
+        pipes: list[ftr.Pipe] = []
+        for fid, wkb, attributes in iter_geopackage_rows(db, pipe_table):
+            if (vertices := linestring_vertices(wkb)) is None:
+                base_type: int = wkb_geometry_type(wkb)[1] % 1000
+                raise ex.ThermosExportError(
+                    str(path),
+                    f"pipe {attributes.get(cont.ThermosFields.id, fid)} has "
+                    f"unsupported geometry {WKB_TYPE_NAMES.get(base_type, base_type)}",
+                )
+            pipes.append(ftr.Pipe(attributes, fid=fid, vertices=vertices))
+
+        buildings: list[ftr.Building] = [
+            ftr.Building(attributes, fid=fid, wkb=wkb)
+            for fid, wkb, attributes in iter_geopackage_rows(db, building_table)
+        ]
+        crs: QgsCoordinateReferenceSystem = geopackage_crs(db, building_table.srs_id)
+
+    return ftr.Network(pipes=pipes, buildings=buildings, crs=crs, **network_options)
+
+
+def load_network(path: str | Path, **network_options: Any) -> ftr.Network:
+    """Build a network from a THERMOS GeoJSON export or GeoPackage"""
+    if Path(path).suffix.lower() == ".gpkg":
+        return network_from_geopackage(path, **network_options)
+    return network_from_geojson(path, **network_options)
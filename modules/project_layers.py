@@ -2,19 +2,54 @@
 
 # pylint: disable=[no-name-in-module]
 
+from collections.abc import Iterable
 from dataclasses import dataclass, field
 
 from qgis.core import (
     Qgis,
+    QgsCoordinateReferenceSystem,
+    QgsExpression,
+    QgsFeature,
+    QgsFeatureRequest,
+    QgsFeatureSource,
+    QgsFields,
     QgsLayerTree,
     QgsLayerTreeGroup,
     QgsMapLayer,
     QgsProject,
+    QgsRectangle,
     QgsVectorLayer,
 )
 
 from modules import constants as cont
 from modules import exceptions as ex
+from modules import instrumentation as instr
+
+# layer id -> whether the fields of the layer include all THERMOS result fields
+SCHEMA_CACHE: dict[str, bool] = {}
+
+
+def has_thermos_schema(layer: QgsVectorLayer) -> bool:
+    """Check (once per layer) if the layer has all fields of a THERMOS result
+
+    The answer is cached by layer id and dropped again when the fields or the
+    data source of the layer change, or when the layer is deleted.
+    """
+    layer_id: str = layer.id()
+    if layer_id not in SCHEMA_CACHE:
+        fingerprint: frozenset[str] = frozenset(layer.fields().names())
+        SCHEMA_CACHE[layer_id] = cont.THERMOS_FIELD_NAME_SET <= fingerprint
+
+        def invalidate() -> None:
+            SCHEMA_CACHE.pop(layer_id, None)
+            for signal in signals:
+                signal.disconnect(invalidate)
+
+        signals = (layer.updatedFields, layer.dataSourceChanged, layer.willBeDeleted)
+        for signal in signals:
+            signal.connect(invalidate)
+
+    return SCHEMA_CACHE[layer_id]
 
 
 @dataclass
@@ -29,15 +64,38 @@ class ThermosLayers:
         project: QgsProject | None = QgsProject.instance()
         if not project:
             raise ex.NoProjectError
-        if not project.mapLayers():
-            # project.read(cont.TEST_PROJECT_PATH)
-            project.read(cont.TEST_MINI_PROJECT_PATH)
+        with instr.stage("find_layers"):
+            if not project.mapLayers():
+                # project.read(cont.TEST_PROJECT_PATH)
+                project.read(cont.TEST_MINI_PROJECT_PATH)
 
-        for layer in project.mapLayers().values():
-            if self.is_pipeline_layer(layer):
-                self.pipes = layer
-            if self.is_building_layer(layer):
-                self.buildings = layer
+            for layer in project.mapLayers().values():
+                instr.count("layers checked")
+                if self.is_pipeline_layer(layer):
+                    self.pipes = layer
+                if self.is_building_layer(layer):
+                    self.buildings = layer
+        for kind, name in (("pipe", "pipes"), ("building", "buildings")):
+            if not hasattr(self, name):
+                raise ex.MissingLayerError(kind)
+
+    def pipe_features(
+        self, extent: QgsRectangle | None = None
+    ) -> Iterable[QgsFeature]:
+        """Stream the pipe features in the solution"""
+        return instr.counted(
+            self.pipes.getFeatures(solution_request(self.pipes, extent)),
+            "pipe features read",
+        )
+
+    def building_features(
+        self, extent: QgsRectangle | None = None
+    ) -> Iterable[QgsFeature]:
+        """Stream the building features in the solution"""
+        return instr.counted(
+            self.buildings.getFeatures(solution_request(self.buildings, extent)),
+            "building features read",
+        )
 
     def is_pipeline_layer(self, layer: QgsMapLayer) -> bool:
         """Check if the given layer is a pipeline layer"""
@@ -54,19 +112,38 @@ class ThermosLayers:
         )
 
     def is_thermos_result_layer(self, layer: QgsMapLayer) -> bool:
-        """Check if the given layer is a layer from Thermos results"""
+        """Check if the given layer is a layer from Thermos results
+
+        The (cached) field check runs before asking the provider for features.
+        """
         return (
-            layer.isValid()
+            isinstance(layer, QgsVectorLayer)
+            and layer.isValid()
             and layer.name() != "OpenStreetMap"
-            and isinstance(layer, QgsVectorLayer)
-            and layer.featureCount() > 0
-            and all(
-                field_name in layer.fields().names()
-                for field_name in cont.THERMOS_FIELD_NAMES
-            )
+            and has_thermos_schema(layer)
+            and layer.hasFeatures()
+            != QgsFeatureSource.FeatureAvailability.NoFeaturesAvailable
         )
 
 
+def solution_request(
+    layer: QgsVectorLayer, extent: QgsRectangle | None = None
+) -> QgsFeatureRequest:
+    """Request for the features in the solution, pushed down to the data provider
+
+    Only features with "solution/included" set and only the ThermosFields
+    attributes are fetched, optionally limited to an extent.
+    """
+    request = QgsFeatureRequest()
+    request.setFilterExpression(
+        QgsExpression.quotedColumnRef(cont.ThermosFields.in_solution)
+    )
+    request.setSubsetOfAttributes(cont.THERMOS_FIELDS_IN_USE, layer.fields())
+    if extent is not None:
+        request.setFilterRect(extent)
+    return request
+
+
 def load_project(project_path: str = cont.TEST_PROJECT_PATH) -> QgsProject:
     """Open a QGIS Project using the path to the project file"""
     project: QgsProject | None = QgsProject.instance()
@@ -107,24 +184,17 @@ def add_layer_group(
         raise ex.LayerTreeError
 
 
-def add_temporary_layer(
-    layer_name: str,
+def add_layer_to_project(
+    layer: QgsMapLayer,
     group_name: str | None = None,
-    layer_type: str = "LineString",
     qgis_project: QgsProject | None = None,
 ) -> None:
-    """Add a layer to a QGIS project"""
+    """Add a layer to a QGIS project, optionally to a (new) group"""
     proj: QgsProject = qgis_project or load_project()
     root: QgsLayerTree | None = proj.layerTreeRoot()
     if not root:
         raise ex.LayerTreeError
 
-    # Create a temporary layer (Example: memory layer)
-    layer_type_string: str = f"{layer_type}?crs={proj.crs().authid()}"
-    new_tmp_layer = QgsVectorLayer(layer_type_string, layer_name, "memory")
-    if not new_tmp_layer.isValid():
-        raise ex.NewLayerInvalidError(layer_name)
-
     if group_name:
         # Check if the group exists, if not, create it
         group: QgsLayerTreeGroup | None = root.findGroup(group_name)
@@ -133,9 +203,58 @@ def add_temporary_layer(
 
         # Add the layer to the group
         if group:
-            group.addLayer(new_tmp_layer)
+            proj.addMapLayer(layer, addToLegend=False)
+            group.addLayer(layer)
 
     else:
-        proj.addMapLayer(new_tmp_layer)
+        proj.addMapLayer(layer)
+
 
+def save_project(qgis_project: QgsProject | None = None) -> None:
+    """Write the project file (once after adding several layers)"""
+    proj: QgsProject = qgis_project or load_project()
     proj.write()
+
+
+def memory_layer(
+    layer_name: str,
+    layer_type: str,
+    crs: QgsCoordinateReferenceSystem,
+    fields: QgsFields | None = None,
+) -> QgsVectorLayer:
+    """Create a memory layer with the given fields (not added to a project)"""
+    layer_type_string: str = f"{layer_type}?crs={crs.authid()}"
+    new_tmp_layer = QgsVectorLayer(layer_type_string, layer_name, "memory")
+    if not new_tmp_layer.isValid():
+        raise ex.NewLayerInvalidError(layer_name)
+
+    if fields is not None:
+        new_tmp_layer.dataProvider().addAttributes(fields.toList())
+        new_tmp_layer.updateFields()
+    return new_tmp_layer
+
+
+def add_temporary_layer(  # noqa: PLR0913
+    layer_name: str,
+    group_name: str | None = None,
+    layer_type: str = "LineString",
+    qgis_project: QgsProject | None = None,
+    fields: QgsFields | None = None,
+    crs: QgsCoordinateReferenceSystem | None = None,
+    *,
+    save: bool = True,
+) -> QgsVectorLayer:
+    """Add a memory layer to a QGIS project and return it
+
+    The fields are declared up front, before any features are added. With
+    save=False the project file is not written, so several layers can be added
+    and the project saved once with save_project().
+    """
+    proj: QgsProject = qgis_project or load_project()
+    new_tmp_layer: QgsVectorLayer = memory_layer(
+        layer_name, layer_type, crs or proj.crs(), fields
+    )
+    add_layer_to_project(new_tmp_layer, group_name, proj)
+    if save:
+        save_project(proj)
+    return new_tmp_layer
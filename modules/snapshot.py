@@ -0,0 +1,438 @@
+"""Memory-mapped binary snapshots of resolved networks
+
+A snapshot holds the pipes and buildings (coordinates, footprints and the
+ThermosFields columns), a table of all strings and the resolved topology as
+flat arrays. The file starts with a magic number and a JSON header listing
+the arrays; the arrays follow, 8-byte aligned and in native byte order.
+
+Opening a snapshot maps the file read-only and hands out typed memoryviews
+of the arrays without copying, so worker processes opening the same file
+share its pages. A Network is only materialised from the arrays on request,
+without matching pipes to buildings again.
+"""
+
+# pylint: disable=[no-name-in-module]
+
+import argparse
+import json
+import math
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Self
+
+from qgis.core import QgsCoordinateReferenceSystem
+
+from modules import batch
+from modules import exceptions as ex
+from modules import features as ftr
+from modules import loaders
+from modules import spatial
+
+SNAPSHOT_SUFFIX: str = ".utecsnap"
+SNAPSHOT_VERSION: int = 1
+MAGIC: bytes = b"UTECSNAP"
+PREAMBLE: struct.Struct = struct.Struct("<8sQ")  # magic, header length
+ALIGNMENT: int = 8
+INT_NULL: int = -(2**63)  # None in int columns
+NETWORK_OPTIONS: list[str] = ["tolerance", "snap_tolerance", "distance_mode"]
+
+# None marker and array type code per attribute type (strings: string ids)
+ENCODINGS: dict[type, tuple[str, Any]] = {
+    float: ("d", math.nan),
+    int: ("q", INT_NULL),
+    bool: ("b", -1),
+    str: ("q", -1),
+}
+VALUE_TYPES: dict[Callable[[Any], Any], type] = {
+    convert: value_type for value_type, convert in ftr.CONVERTERS.items()
+}
+
+
+@dataclass
+class StringTable:
+    """Distinct strings by id"""
+
+    ids: dict[str, int] = field(default_factory=dict)
+
+    def id(self, value: str | None) -> int:
+        """Id of a string (-1 for None)"""
+        if value is None:
+            return -1
+        return self.ids.setdefault(value, len(self.ids))
+
+    def arrays(self) -> tuple[array, array]:
+        """Offsets (one more than strings) and UTF-8 data of all strings"""
+        offsets: array = array("q", [0])
+        data: array = array("B")
+        for value in self.ids:
+            data.frombytes(value.encode("utf-8"))
+            offsets.append(len(data))
+        return offsets, data
+
+
+def attribute_arrays(
+    prefix: str, record_type: type, records: list[Any], strings: StringTable
+) -> dict[str, array]:
+    """ThermosFields columns of pipes or buildings as typed arrays"""
+    columns: dict[str, array] = {}
+    for column in ftr.attribute_columns(record_type):
+        value_type: type = VALUE_TYPES[column.convert]
+        typecode, null = ENCODINGS[value_type]
+        values: list[Any] = [getattr(record, column.name) for record in records]
+        columns[f"{prefix}.{column.name}"] = array(
+            typecode,
+            (
+                strings.id(value)
+                if value_type is str
+                else null
+                if value is None
+                else value
+                for value in values
+            ),
+        )
+    return columns
+
+
+def topology_arrays(network: ftr.Network, strings: StringTable) -> dict[str, array]:
+    """Connected buildings, pipe ends and nodes as arrays
+
+    connected_kind per pipe is 0 for None, 1 for a single building and 2 for
+    a list; the buildings are pipe_buildings[offsets[p]:offsets[p + 1]].
+    Nodes are numbered in the order the pipe ends reach them.
+    """
+    building_positions: dict[ftr.Building, int] = {
+        building: position for position, building in enumerate(network.all_buildings)
+    }
+    kinds: array = array("b")
+    offsets: array = array("q", [0])
+    connected: array = array("q")
+    node_positions: dict[ftr.Node, int] = {}
+    ends: array = array("q")
+    for pipe in network.all_pipes:
+        kinds.append(
+            0
+            if pipe.connected_buildings is None
+            else 2
+            if isinstance(pipe.connected_buildings, list)
+            else 1
+        )
+        connected.extend(
+            building_positions[building]
+            for building in ftr.as_list(pipe.connected_buildings)
+        )
+        offsets.append(len(connected))
+        for node in (pipe.node_start, pipe.node_end):
+            ends.append(
+                -1
+                if node is None
+                else node_positions.setdefault(node, len(node_positions))
+            )
+
+    return {
+        "pipe.connected_kind": kinds,
+        "pipe.connected_offsets": offsets,
+        "pipe.connected": connected,
+        "pipe.ends": ends,
+        "node.coordinates": array(
+            "d",
+            (
+                coordinate
+                for node in node_positions
+                for coordinate in (node.coordinates.x(), node.coordinates.y())
+            ),
+        ),
+        "node.id": array("q", (strings.id(node.id) for node in node_positions)),
+        "node.fork": array("b", (node.is_fork for node in node_positions)),
+    }
+
+
+def write_snapshot(network: ftr.Network, path: str | Path) -> None:
+    """Write a built network as a snapshot"""
+    strings = StringTable()
+    pipes: list[ftr.Pipe] = network.all_pipes
+    buildings: list[ftr.Building] = network.all_buildings
+
+    sections: dict[str, array] = {
+        "pipe.fid": array("q", (INT_NULL if p.fid is None else p.fid for p in pipes)),
+        "pipe.vertex_offsets": array("q", [0]),
+        "pipe.vertices": array("d"),
+        "building.fid": array(
+            "q", (INT_NULL if b.fid is None else b.fid for b in buildings)
+        ),
+        "building.bbox": array(
+            "d", (coordinate for b in buildings for coordinate in b.bounds())
+        ),
+        "building.wkb_offsets": array("q", [0]),
+        "building.wkb": array("B"),
+    }
+    for pipe in pipes:
+        sections["pipe.vertices"].extend(pipe.vertices)
+        sections["pipe.vertex_offsets"].append(len(sections["pipe.vertices"]))
+    for building in buildings:
+        sections["building.wkb"].frombytes(building.wkb)
+        sections["building.wkb_offsets"].append(len(sections["building.wkb"]))
+    sections |= attribute_arrays("pipe", ftr.Pipe, pipes, strings)
+    sections |= attribute_arrays("building", ftr.Building, buildings, strings)
+    sections |= topology_arrays(network, strings)
+    sections["strings.offsets"], sections["strings.data"] = strings.arrays()
+
+    directory: dict[str, list[Any]] = {}
+    offset: int = 0
+    for name, values in sections.items():
+        directory[name] = [offset, values.typecode, len(values)]
+        offset += aligned(len(values) * values.itemsize)
+    header: bytes = json.dumps(
+        {
+            "version": SNAPSHOT_VERSION,
+            "byteorder": sys.byteorder,
+            "crs": network.crs.toWkt(),
+            "pipes": len(pipes),
+            "buildings": len(buildings),
+            "options": {name: getattr(network, name) for name in NETWORK_OPTIONS},
+            "sections": directory,
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+    temporary: Path = Path(path).with_suffix(".tmp")
+    with temporary.open("wb") as file:
+        file.write(PREAMBLE.pack(MAGIC, len(header)))
+        file.write(header.ljust(aligned(PREAMBLE.size + len(header)) - PREAMBLE.size))
+        for values in sections.values():
+            data: bytes = values.tobytes()
+            file.write(data.ljust(aligned(len(data)), b"\0"))
+    temporary.replace(path)
+
+
+def aligned(size: int) -> int:
+    """Size rounded up to the alignment of the arrays"""
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+@dataclass
+class Snapshot:
+    """Read-only, memory-mapped snapshot
+
+    The arrays are memoryviews into the mapped file; close the snapshot (or
+    use it as a context manager) once no view of it is needed any more.
+    """
+
+    path: Path
+    header: dict[str, Any]
+    buffer: mmap.mmap = field(repr=False)
+    arrays: dict[str, memoryview] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def open(cls, path: str | Path) -> Self:
+        """Map a snapshot file and check its header"""
+        with Path(path).open("rb") as file:
+            try:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise ex.SnapshotError(str(path), "empty file") from None
+        try:
+            magic, header_length = PREAMBLE.unpack_from(buffer)
+            if magic != MAGIC:
+                raise ex.SnapshotError(str(path), "not a network snapshot")
+            header: dict[str, Any] = json.loads(
+                buffer[PREAMBLE.size : PREAMBLE.size + header_length]
+            )
+            if header.get("version") != SNAPSHOT_VERSION:
+                raise ex.SnapshotError(str(path), "unsupported snapshot version")
+            if header.get("byteorder") != sys.byteorder:
+                raise ex.SnapshotError(str(path), "written with another byte order")
+        except (struct.error, ValueError):
+            buffer.close()
+            raise ex.SnapshotError(str(path), "damaged header") from None
+        except ex.SnapshotError:
+            buffer.close()
+            raise
+
+        snapshot: Self = cls(Path(path), header, buffer)
+        start: int = aligned(PREAMBLE.size + header_length)
+        data = memoryview(buffer)
+        name: str = "directory"
+        try:
+            for name, (offset, typecode, length) in header["sections"].items():
+                end: int = start + offset + length * array(typecode).itemsize
+                if min(offset, length) < 0 or end > len(buffer):
+                    raise ex.SnapshotError(str(path), f"damaged section {name}")
+                snapshot.arrays[name] = data[start + offset : end].cast(typecode)
+        except (AttributeError, KeyError, TypeError, ValueError, ex.SnapshotError):
+            data.release()
+            snapshot.close()
+            raise ex.SnapshotError(str(path), f"damaged section {name}") from None
+        data.release()
+        return snapshot
+
+    def __enter__(self) -> Self:
+        """Use the snapshot in a with block"""
+        return self
+
+    def __exit__(self, *_exc_info: object) -> None:
+        """Close the snapshot at the end of a with block"""
+        self.close()
+
+    def close(self) -> None:
+        """Release the views and unmap the file"""
+        for view in self.arrays.values():
+            view.release()
+        self.arrays.clear()
+        self.buffer.close()
+
+    @property
+    def pipe_count(self) -> int:
+        """Number of pipes"""
+        return self.header["pipes"]
+
+    @property
+    def building_count(self) -> int:
+        """Number of buildings"""
+        return self.header["buildings"]
+
+    def string(self, string_id: int) -> str | None:
+        """String of an id (None for -1)"""
+        if string_id < 0:
+            return None
+        offsets: memoryview = self.arrays["strings.offsets"]
+        return bytes(
+            self.arrays["strings.data"][offsets[string_id] : offsets[string_id + 1]]
+        ).decode("utf-8")
+
+    def vertices(self, pipe: int) -> memoryview:
+        """Flat x, y coordinates of a pipe (no copy)"""
+        offsets: memoryview = self.arrays["pipe.vertex_offsets"]
+        return self.arrays["pipe.vertices"][offsets[pipe] : offsets[pipe + 1]]
+
+    def wkb(self, building: int) -> memoryview:
+        """Footprint of a building as WKB (no copy)"""
+        offsets: memoryview = self.arrays["building.wkb_offsets"]
+        return self.arrays["building.wkb"][offsets[building] : offsets[building + 1]]
+
+    def attributes(self, prefix: str, record_type: type, position: int) -> dict:
+        """ThermosFields attributes of a pipe or building by record field"""
+        values: dict[str, Any] = {}
+        for column in ftr.attribute_columns(record_type):
+            value_type: type = VALUE_TYPES[column.convert]
+            value: Any = self.arrays[f"{prefix}.{column.name}"][position]
+            if value_type is str:
+                value = self.string(value)
+            elif value_type is float:
+                value = None if math.isnan(value) else value
+            elif value == ENCODINGS[value_type][1]:
+                value = None
+            elif value_type is bool:
+                value = bool(value)
+            values[column.name] = value
+        return values
+
+    def fids(self, prefix: str) -> list[int | None]:
+        """Feature ids of the pipes or buildings"""
+        return [
+            None if fid == INT_NULL else fid for fid in self.arrays[f"{prefix}.fid"]
+        ]
+
+    def pipes(self) -> list[ftr.Pipe]:
+        """Pipes with their attributes and vertices (copied out of the file)"""
+        fids: list[int | None] = self.fids("pipe")
+        return [
+            ftr.Pipe(
+                fid=fids[position],
+                vertices=array("d", self.vertices(position)),
+                **self.attributes("pipe", ftr.Pipe, position),
+            )
+            for position in range(self.pipe_count)
+        ]
+
+    def buildings(self) -> list[ftr.Building]:
+        """Buildings with their attributes, footprints and bounding boxes"""
+        fids: list[int | None] = self.fids("building")
+        bbox: memoryview = self.arrays["building.bbox"]
+        return [
+            ftr.Building(
+                fid=fids[position],
+                wkb=bytes(self.wkb(position)),
+                bbox=cast_bounds(bbox[4 * position : 4 * position + 4]),
+                **self.attributes("building", ftr.Building, position),
+            )
+            for position in range(self.building_count)
+        ]
+
+    def topology_record(self) -> dict[str, Any]:
+        """Topology in the form of Network.topology_record"""
+        kinds: memoryview = self.arrays["pipe.connected_kind"]
+        offsets: memoryview = self.arrays["pipe.connected_offsets"]
+        connected: memoryview = self.arrays["pipe.connected"]
+        coordinates: memoryview = self.arrays["node.coordinates"]
+        ends: memoryview = self.arrays["pipe.ends"]
+        forks: memoryview = self.arrays["node.fork"]
+        return {
+            "pipes": self.fids("pipe"),
+            "buildings": self.fids("building"),
+            "connected": [
+                None
+                if kinds[pipe] == 0
+                else connected[offsets[pipe]]
+                if kinds[pipe] == 1
+                else connected[offsets[pipe] : offsets[pipe + 1]].tolist()
+                for pipe in range(self.pipe_count)
+            ],
+            "nodes": [
+                [coordinates[2 * node], coordinates[2 * node + 1], self.string(node_id)]
+                for node, node_id in enumerate(self.arrays["node.id"])
+            ],
+            "ends": [
+                [ends[2 * pipe], ends[2 * pipe + 1]] for pipe in range(self.pipe_count)
+            ],
+            "forks": [node for node, fork in enumerate(forks) if fork],
+        }
+
+    def network(self, **network_options: Any) -> ftr.Network:
+        """Network of the snapshot, with the stored topology instead of a build
+
+        The options the topology was resolved with are the defaults.
+        """
+        options: dict[str, Any] = {**self.header["options"], **network_options}
+        options["distance_mode"] = spatial.DistanceMode(options["distance_mode"])
+        try:
+            return ftr.Network(
+                pipes=self.pipes(),
+                buildings=self.buildings(),
+                crs=QgsCoordinateReferenceSystem.fromWkt(self.header["crs"]),
+                topology=self.topology_record(),
+                **options,
+            )
+        except ex.TopologyRecordError as error:
+            raise ex.SnapshotError(str(self.path), str(error)) from error
+
+
+def cast_bounds(values: memoryview) -> spatial.Bounds:
+    """Bounding box from four stored coordinates"""
+    x_min, y_min, x_max, y_max = values.tolist()
+    return (x_min, y_min, x_max, y_max)
+
+
+def load_snapshot(path: str | Path, **network_options: Any) -> ftr.Network:
+    """Build a network from a snapshot file"""
+    with Snapshot.open(path) as snapshot:
+        return snapshot.network(**network_options)
+
+
+def main() -> None:
+    """Command line entry point: ingest a THERMOS export as a snapshot"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("source", help="THERMOS GeoJSON export or GeoPackage")
+    parser.add_argument("output", type=Path, help=f"snapshot file ({SNAPSHOT_SUFFIX})")
+    args = parser.parse_args()
+
+    batch.init_worker()
+    write_snapshot(loaders.load_network(args.source), args.output)
+
+
+if __name__ == "__main__":
+    main()
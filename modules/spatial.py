@@ -0,0 +1,504 @@
+"""Spatial indexing and proximity tests"""
+
+# pylint: disable=[no-name-in-module]
+
+import math
+import struct
+import sys
+import threading
+from array import array
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from dataclasses import dataclass, field
+from enum import StrEnum
+from typing import Generic, TypeVar
+
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsCoordinateTransformContext,
+    QgsDistanceArea,
+    QgsGeometry,
+    QgsGeometryEngine,
+    QgsPoint,
+    QgsPointXY,
+    QgsRectangle,
+    QgsSpatialIndex,
+)
+
+from modules import instrumentation as instr
+
+METRES_PER_DEGREE: float = 111_320.0
+MAX_LATITUDE: float = 89.0
+WGS84: str = "EPSG:4326"
+
+# WKB geometry type codes (ISO offsets of 1000, 2000, 3000 for Z, M, ZM)
+WKB_POINT: int = 1
+WKB_LINESTRING: int = 2
+WKB_POLYGON: int = 3
+
+Bounds = tuple[float, float, float, float]  # x min, y min, x max, y max
+T = TypeVar("T")
+
+# QGIS calculators are not shared between threads (see wgs84_distance_area)
+THREAD_STATE = threading.local()
+
+
+class DistanceMode(StrEnum):
+    """How distances between pipe vertices and buildings are measured"""
+
+    ELLIPSOIDAL = "ellipsoidal"  # WGS84 ellipsoid, as THERMOS exports are in degrees
+    PLANAR = "planar"  # local UTM zone, metres
+
+
+def search_buffer(
+    tolerance: float, crs: QgsCoordinateReferenceSystem, extent: QgsRectangle
+) -> float:
+    """Convert a tolerance in metres into a (generous) buffer in map units
+
+    For geographic coordinates the buffer is derived from the length of a degree
+    of longitude at the latitude of the extent farthest from the equator, and
+    doubled so that bounding box searches never miss a building that the exact
+    ellipsoidal test would accept.
+    """
+    if crs.isValid() and not crs.isGeographic():
+        return tolerance
+
+    latitude: float = max(abs(extent.yMinimum()), abs(extent.yMaximum()))
+    return 2 * tolerance / metres_per_unit(crs, latitude)[0]
+
+
+def metres_per_unit(
+    crs: QgsCoordinateReferenceSystem, latitude: float = 0.0
+) -> tuple[float, float]:
+    """Approximate metres per map unit in x and y near the given latitude
+
+    Projected coordinates are taken as metres; geographic (or unknown)
+    coordinates as degrees.
+    """
+    if crs.isValid() and not crs.isGeographic():
+        return (1.0, 1.0)
+    latitude = min(abs(latitude), MAX_LATITUDE)
+    return (METRES_PER_DEGREE * math.cos(math.radians(latitude)), METRES_PER_DEGREE)
+
+
+def combined_bounds(bounds: Iterable[Bounds | None]) -> Bounds:
+    """Bounding box of all bounding boxes (inverted and infinite if empty)"""
+    x_min = y_min = math.inf
+    x_max = y_max = -math.inf
+    for box in bounds:
+        if box is not None:
+            x_min, y_min = min(x_min, box[0]), min(y_min, box[1])
+            x_max, y_max = max(x_max, box[2]), max(y_max, box[3])
+    return (x_min, y_min, x_max, y_max)
+
+
+def combined_extent(bounds: Iterable[Bounds | None]) -> QgsRectangle:
+    """Return the extent of all bounding boxes"""
+    box: Bounds = combined_bounds(bounds)
+    if box[0] > box[2]:
+        return QgsRectangle()
+    return rectangle(box)
+
+
+def rectangle(bounds: Bounds) -> QgsRectangle:
+    """Bounding box as a QgsRectangle"""
+    return QgsRectangle(*bounds)
+
+
+def rectangle_bounds(box: QgsRectangle) -> Bounds:
+    """QgsRectangle as a bounding box"""
+    return (box.xMinimum(), box.yMinimum(), box.xMaximum(), box.yMaximum())
+
+
+def coordinate_bounds(coordinates: Sequence[float], dimensions: int = 2) -> Bounds:
+    """Bounding box of flat coordinates (x, y, ... per point)"""
+    xs, ys = coordinates[0::dimensions], coordinates[1::dimensions]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def wkb_coordinates(wkb: bytes) -> Iterator[tuple[array, int]]:
+    """Coordinate runs (points, lines and rings) of ISO WKB with their dimensions
+
+    Parts of multi geometries and collections follow their header directly,
+    so the bytes are read front to back without building a geometry.
+    """
+    offset: int = 0
+    while offset < len(wkb):
+        byte_order: str = "<" if wkb[offset] == 1 else ">"
+        (geometry_type,) = struct.unpack_from(f"{byte_order}I", wkb, offset + 1)
+        base_type, dimension_code = geometry_type % 1000, geometry_type // 1000
+        dimensions: int = (2, 3, 3, 4)[dimension_code]
+        offset += 5
+
+        runs: int = 1
+        if base_type == WKB_POLYGON:
+            (runs,) = struct.unpack_from(f"{byte_order}I", wkb, offset)
+            offset += 4
+        elif base_type not in (WKB_POINT, WKB_LINESTRING):
+            offset += 4  # number of parts, which follow as geometries
+            continue
+
+        for _ in range(runs):
+            count: int = 1
+            if base_type != WKB_POINT:
+                (count,) = struct.unpack_from(f"{byte_order}I", wkb, offset)
+                offset += 4
+            coordinates = array("d", wkb[offset : offset + 8 * count * dimensions])
+            if (byte_order == "<") != (sys.byteorder == "little"):
+                coordinates.byteswap()
+            offset += 8 * count * dimensions
+            yield coordinates, dimensions
+
+
+def wkb_bounds(wkb: bytes) -> Bounds:
+    """Bounding box of a geometry in ISO WKB"""
+    return combined_bounds(
+        coordinate_bounds(coordinates, dimensions)
+        for coordinates, dimensions in wkb_coordinates(wkb)
+        if coordinates
+    )
+
+
+def utm_crs(
+    extent: QgsRectangle, crs: QgsCoordinateReferenceSystem
+) -> QgsCoordinateReferenceSystem:
+    """Return the UTM zone containing the centre of the extent"""
+    centre: QgsPointXY = extent.center()
+    wgs84 = QgsCoordinateReferenceSystem(WGS84)
+    if crs.isValid() and crs != wgs84:
+        centre = QgsCoordinateTransform(
+            crs, wgs84, QgsCoordinateTransformContext()
+        ).transform(centre)
+
+    zone: int = int((centre.x() + 180) // 6) % 60 + 1
+    epsg: int = (32600 if centre.y() >= 0 else 32700) + zone
+    return QgsCoordinateReferenceSystem(f"EPSG:{epsg}")
+
+
+def wgs84_distance_area() -> QgsDistanceArea:
+    """Distance calculator on the WGS84 ellipsoid, shared within a thread"""
+    distance_area_object: QgsDistanceArea | None = getattr(
+        THREAD_STATE, "distance_area", None
+    )
+    if distance_area_object is None:
+        distance_area_object = QgsDistanceArea()
+        distance_area_object.setEllipsoid("WGS84")
+        THREAD_STATE.distance_area = distance_area_object
+    return distance_area_object
+
+
+def z_order(points: Sequence[tuple[float, float]], bits: int = 16) -> list[int]:
+    """Positions of the points along a Z-order curve over their bounding box
+
+    Points close in the order are close in space, so runs of the order are
+    spatially coherent chunks.
+    """
+    if not points:
+        return []
+    x_min, y_min, x_max, y_max = coordinate_bounds(
+        [coordinate for point in points for coordinate in point]
+    )
+    cells: int = (1 << bits) - 1
+    x_scale: float = cells / (x_max - x_min) if x_max > x_min else 0.0
+    y_scale: float = cells / (y_max - y_min) if y_max > y_min else 0.0
+
+    def key(position: int) -> int:
+        column: int = int((points[position][0] - x_min) * x_scale)
+        row: int = int((points[position][1] - y_min) * y_scale)
+        code: int = 0
+        for bit in range(bits):
+            code |= ((column >> bit) & 1) << (2 * bit)
+            code |= ((row >> bit) & 1) << (2 * bit + 1)
+        return code
+
+    return sorted(range(len(points)), key=key)
+
+
+def line_length(geometry: QgsGeometry, crs: QgsCoordinateReferenceSystem) -> float:
+    """Length of a line in metres (on the WGS84 ellipsoid for geographic CRS)"""
+    if crs.isValid() and not crs.isGeographic():
+        return geometry.length()
+    return wgs84_distance_area().measureLength(geometry)
+
+
+def point_near_polygon(
+    point: QgsPointXY, polygon: QgsGeometry, tolerance: float = 0.01
+) -> bool:
+    """Check if a point is in, on or near a polygon (ellipsoidal distance)"""
+    point_geom: QgsGeometry = QgsGeometry.fromPointXY(point)
+    instr.count("contains")
+    if polygon.contains(point_geom):
+        return True
+    instr.count("intersects")
+    if polygon.intersects(point_geom):
+        return True
+
+    instr.count("shortestLine")
+    shortest_line: QgsGeometry = point_geom.shortestLine(polygon)
+    return wgs84_distance_area().measureLength(shortest_line) < tolerance
+
+
+@dataclass
+class GeometryIndex:
+    """Spatial index over bounding boxes
+
+    Positions returned by the queries refer to the list of bounding boxes.
+    Removed entries are set to None, so positions stay stable.
+    """
+
+    bounds: list[Bounds | None]
+    buffer: float = 0.0
+    index: QgsSpatialIndex = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        """Fill the index"""
+        self.index = QgsSpatialIndex()
+        for position, box in enumerate(self.bounds):
+            if box is not None:
+                self.index.addFeature(position, rectangle(box))
+
+    def add(self, box: Bounds) -> int:
+        """Append a bounding box and return its position"""
+        self.bounds.append(box)
+        self.index.addFeature(len(self.bounds) - 1, rectangle(box))
+        return len(self.bounds) - 1
+
+    def remove(self, position: int) -> None:
+        """Drop the entry at the position from query results"""
+        self.bounds[position] = None
+
+    def near_point(self, point: QgsPointXY) -> list[int]:
+        """Positions of entries whose buffered bounding box contains the point"""
+        return [
+            position
+            for position in self.index.intersects(
+                QgsRectangle(
+                    point.x() - self.buffer,
+                    point.y() - self.buffer,
+                    point.x() + self.buffer,
+                    point.y() + self.buffer,
+                )
+            )
+            if self.bounds[position] is not None
+        ]
+
+    def near_points(self, points: list[QgsPointXY]) -> list[int]:
+        """Positions of entries near any of the points, in ascending order"""
+        return sorted({pos for point in points for pos in self.near_point(point)})
+
+
+@dataclass
+class EllipsoidalProximity:
+    """Proximity of points to polygons, measured on the WGS84 ellipsoid
+
+    Only the bounding boxes are indexed; a polygon is loaded (by position)
+    the first time a point comes near its bounding box and kept for the exact
+    tests that follow. Loaded polygons are kept per thread, like the prepared
+    ones of PlanarProximity.
+    """
+
+    bounds: list[Bounds | None]
+    geometry: Callable[[int], QgsGeometry]
+    crs: QgsCoordinateReferenceSystem
+    extent: QgsRectangle
+    tolerance: float = 0.01  # metres
+    index: GeometryIndex = field(init=False, repr=False)
+    local: threading.local = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        """Build the bounding box index"""
+        self.local = threading.local()
+        self.index = GeometryIndex(
+            self.bounds,
+            buffer=search_buffer(self.tolerance, self.crs, self.extent),
+        )
+
+    @property
+    def polygons(self) -> dict[int, QgsGeometry]:
+        """Loaded polygons by position, for the current thread"""
+        if (polygons := getattr(self.local, "polygons", None)) is None:
+            polygons = self.local.polygons = {}
+        return polygons
+
+    def polygon(self, position: int) -> QgsGeometry:
+        """Polygon at the position, loaded on first use"""
+        if (polygon := self.polygons.get(position)) is None:
+            polygon = self.polygons[position] = self.geometry(position)
+        return polygon
+
+    def add(self, box: Bounds) -> int:
+        """Add a polygon by its bounding box and return its position"""
+        return self.index.add(box)  # shares the list of bounding boxes
+
+    def remove(self, position: int) -> None:
+        """Remove the polygon at the position"""
+        self.polygons.pop(position, None)
+        self.index.remove(position)
+
+    def near_points(self, points: list[QgsPointXY]) -> list[int]:
+        """Positions of polygons near any of the points, in ascending order"""
+        near: list[int] = []
+        for position in self.index.near_points(points):
+            polygon: QgsGeometry = self.polygon(position)
+            if any(
+                point_near_polygon(point, polygon, self.tolerance) for point in points
+            ):
+                near.append(position)
+        return near
+
+
+@dataclass
+class PlanarProximity:
+    """Proximity of points to polygons, measured in a local UTM zone
+
+    The bounding boxes are reprojected and indexed. A polygon is loaded,
+    reprojected and prepared the first time a point comes near its bounding
+    box; the prepared geometry is kept, so every further test is a single
+    planar GEOS distance. Prepared geometries and the transform are kept per
+    thread, as neither may be used by several threads at once.
+    """
+
+    bounds: list[Bounds | None]
+    geometry: Callable[[int], QgsGeometry]
+    crs: QgsCoordinateReferenceSystem
+    extent: QgsRectangle
+    tolerance: float = 0.01  # metres
+    index: GeometryIndex = field(init=False, repr=False)
+    local: threading.local = field(init=False, repr=False)
+    utm: QgsCoordinateReferenceSystem = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        """Reproject and index the bounding boxes"""
+        self.local = threading.local()
+        self.utm = utm_crs(self.extent, self.crs)
+        self.index = GeometryIndex(
+            [self.project(box) if box else None for box in self.bounds],
+            buffer=self.tolerance,
+        )
+
+    @property
+    def transform(self) -> QgsCoordinateTransform:
+        """Transform into the UTM zone, for the current thread"""
+        if (transform := getattr(self.local, "transform", None)) is None:
+            transform = self.local.transform = QgsCoordinateTransform(
+                self.crs, self.utm, QgsCoordinateTransformContext()
+            )
+        return transform
+
+    @property
+    def engines(self) -> dict[int, QgsGeometryEngine]:
+        """Prepared polygons by position, for the current thread"""
+        if (engines := getattr(self.local, "engines", None)) is None:
+            engines = self.local.engines = {}
+        return engines
+
+    def project(self, box: Bounds) -> Bounds:
+        """Reproject a bounding box"""
+        return rectangle_bounds(self.transform.transformBoundingBox(rectangle(box)))
+
+    def engine(self, position: int) -> QgsGeometryEngine:
+        """Reprojected polygon at the position, prepared for distance tests"""
+        if (engine := self.engines.get(position)) is None:
+            projected = QgsGeometry(self.geometry(position))
+            projected.transform(self.transform)
+            engine = QgsGeometry.createGeometryEngine(projected.constGet())
+            engine.prepareGeometry()
+            self.engines[position] = engine
+        return engine
+
+    def add(self, box: Bounds) -> int:
+        """Add a polygon by its bounding box and return its position"""
+        self.bounds.append(box)
+        return self.index.add(self.project(box))
+
+    def remove(self, position: int) -> None:
+        """Remove the polygon at the position"""
+        self.bounds[position] = None
+        self.engines.pop(position, None)
+        self.index.remove(position)
+
+    def near_points(self, points: list[QgsPointXY]) -> list[int]:
+        """Positions of polygons near any of the points, in ascending order"""
+        projected: list[QgsPoint] = [
+            QgsPoint(self.transform.transform(point)) for point in points
+        ]
+        return [
+            position
+            for position in self.index.near_points(projected)  # type: ignore[arg-type]
+            if any(self.near(position, point) for point in projected)
+        ]
+
+    def near(self, position: int, point: QgsPoint) -> bool:
+        """Check if a projected point is within the tolerance of a polygon"""
+        instr.count("distance")
+        return self.engine(position).distance(point) < self.tolerance
+
+
+@dataclass
+class PointGrid(Generic[T]):
+    """Hash grid of items at points, for lookups within a distance in metres
+
+    The cells are as large as the tolerance, so all items within the tolerance
+    of a point are in its cell or the eight neighbouring cells.
+    """
+
+    tolerance: float  # metres
+    scale: tuple[float, float] = (1.0, 1.0)  # metres per map unit in x and y
+    cells: dict[tuple[int, int], list[tuple[float, float, T]]] = field(
+        default_factory=dict, repr=False
+    )
+
+    def cell(self, x: float, y: float) -> tuple[int, int]:
+        """Cell of a point"""
+        return (
+            math.floor(x * self.scale[0] / self.tolerance),
+            math.floor(y * self.scale[1] / self.tolerance),
+        )
+
+    def add(self, x: float, y: float, item: T) -> None:
+        """Add an item at a point"""
+        self.cells.setdefault(self.cell(x, y), []).append((x, y, item))
+
+    def remove(self, x: float, y: float, item: T) -> None:
+        """Remove an item added at a point"""
+        entries: list[tuple[float, float, T]] = self.cells.get(self.cell(x, y), [])
+        entries[:] = [entry for entry in entries if entry[2] is not item]
+
+    def nearest(
+        self, x: float, y: float, accept: Callable[[T], bool] = lambda _item: True
+    ) -> T | None:
+        """Nearest accepted item within the tolerance of a point"""
+        column, row = self.cell(x, y)
+        best: T | None = None
+        best_distance: float = self.tolerance**2
+        for neighbour_column in (column - 1, column, column + 1):
+            for neighbour_row in (row - 1, row, row + 1):
+                for item_x, item_y, item in self.cells.get(
+                    (neighbour_column, neighbour_row), ()
+                ):
+                    distance: float = ((item_x - x) * self.scale[0]) ** 2 + (
+                        (item_y - y) * self.scale[1]
+                    ) ** 2
+                    if distance <= best_distance and accept(item):
+                        best, best_distance = item, distance
+        return best
+
+
+ProximityTester = EllipsoidalProximity | PlanarProximity
+
+
+def proximity_tester(  # noqa: PLR0913
+    mode: DistanceMode,
+    bounds: list[Bounds | None],
+    geometry: Callable[[int], QgsGeometry],
+    crs: QgsCoordinateReferenceSystem,
+    extent: QgsRectangle,
+    tolerance: float = 0.01,
+) -> ProximityTester:
+    """Create the proximity tester for the given distance mode
+
+    geometry loads the polygon at a position of bounds when it is needed.
+    """
+    if mode == DistanceMode.PLANAR:
+        return PlanarProximity(bounds, geometry, crs, extent, tolerance)
+    return EllipsoidalProximity(bounds, geometry, crs, extent, tolerance)
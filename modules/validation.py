@@ -0,0 +1,335 @@
+"""Streaming validation of THERMOS results, tile by tile
+
+The extent of the layers is cut into square tiles. Every feature belongs to
+the tile holding the lower left corner of its bounding box, so features that
+span tiles are reported exactly once. For every tile, the features it owns are
+read together with their candidate component: the buildings near its pipes,
+the pipes near those buildings and so on, until no further feature is near.
+The issues of a feature only depend on that component, so a Network built
+from this subset alone reports the same issues for the owned features as one
+built from the whole layers. They are yielded before the next tile is read;
+memory thus depends on the tile size and the extent of the components, not
+on the layer size.
+"""
+
+# pylint: disable=[no-name-in-module]
+
+import argparse
+import json
+import math
+import sys
+from collections.abc import Iterable, Iterator
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, TextIO
+
+from qgis.core import QgsFeature, QgsRectangle, QgsVectorLayer
+
+from modules import batch
+from modules import features as ftr
+from modules import project_layers as prl
+from modules import spatial
+
+TILE_SIZE: float = 1_000.0  # metres
+
+
+@dataclass
+class ValidationIssue:
+    """Issue of one pipe or building"""
+
+    issue: str
+    kind: str  # "pipe" or "building"
+    id: str | None
+    fid: int | None
+    tile: tuple[int, int]  # column, row
+
+
+@dataclass
+class Tiling:
+    """Square tiles over an extent (in map units)"""
+
+    bounds: spatial.Bounds
+    width: float
+    height: float
+    columns: int = field(init=False)
+    rows: int = field(init=False)
+
+    def __post_init__(self) -> None:
+        """Fill class attributes"""
+        xmin, ymin, xmax, ymax = self.bounds
+        self.columns = max(1, math.ceil((xmax - xmin) / self.width))
+        self.rows = max(1, math.ceil((ymax - ymin) / self.height))
+
+    def tile_of(self, bounds: spatial.Bounds) -> tuple[int, int]:
+        """Tile owning a feature (the one with the lower left corner of its box)"""
+        column: int = math.floor((bounds[0] - self.bounds[0]) / self.width)
+        row: int = math.floor((bounds[1] - self.bounds[1]) / self.height)
+        return (
+            min(max(column, 0), self.columns - 1),
+            min(max(row, 0), self.rows - 1),
+        )
+
+    def tile_bounds(self, tile: tuple[int, int]) -> spatial.Bounds:
+        """Bounds of a tile"""
+        xmin: float = self.bounds[0] + tile[0] * self.width
+        ymin: float = self.bounds[1] + tile[1] * self.height
+        return (xmin, ymin, xmin + self.width, ymin + self.height)
+
+    def tiles(self) -> Iterator[tuple[int, int]]:
+        """All tiles, row by row"""
+        for row in range(self.rows):
+            for column in range(self.columns):
+                yield (column, row)
+
+
+@dataclass
+class TileValidator:
+    """Validates the features of a pipe and a building layer tile by tile"""
+
+    pipes: QgsVectorLayer
+    buildings: QgsVectorLayer
+    tile_size: float = TILE_SIZE  # metres
+    tolerance: float = 0.01  # metres
+    network_options: dict[str, Any] = field(default_factory=dict)
+    tiling: Tiling = field(init=False, repr=False)
+    buffer: float = field(init=False, repr=False)  # map units
+    pipe_reader: ftr.AttributeReader = field(init=False, repr=False)
+    building_reader: ftr.AttributeReader = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        """Fill class attributes"""
+        extent = QgsRectangle(self.pipes.extent())
+        extent.combineExtentWith(self.buildings.extent())
+        bounds: spatial.Bounds = spatial.rectangle_bounds(extent)
+        scale: tuple[float, float] = spatial.metres_per_unit(
+            self.buildings.crs(), max(abs(bounds[1]), abs(bounds[3]))
+        )
+        self.tiling = Tiling(
+            bounds, self.tile_size / scale[0], self.tile_size / scale[1]
+        )
+        self.buffer = spatial.search_buffer(
+            self.tolerance, self.buildings.crs(), extent
+        )
+        self.pipe_reader = ftr.AttributeReader.for_fields(
+            ftr.Pipe, self.pipes.fields()
+        )
+        self.building_reader = ftr.AttributeReader.for_fields(
+            ftr.Building, self.buildings.fields()
+        )
+
+    def read(
+        self,
+        bounds: spatial.Bounds,
+        pipes: dict[int, ftr.Pipe],
+        buildings: dict[int, ftr.Building],
+    ) -> bool:
+        """Add the features intersecting the bounds (True if any were new)"""
+        extent: QgsRectangle = spatial.rectangle(bounds)
+        new: bool = False
+        for feature in features(self.pipes, extent):
+            if feature.id() not in pipes:
+                pipes[feature.id()] = ftr.Pipe(feature, reader=self.pipe_reader)
+                new = True
+        for feature in features(self.buildings, extent):
+            if feature.id() not in buildings:
+                buildings[feature.id()] = ftr.Building(
+                    feature, reader=self.building_reader
+                )
+                new = True
+        return new
+
+    def tile_network(
+        self, tile: tuple[int, int]
+    ) -> tuple[ftr.Network, set[ftr.Pipe], set[ftr.Building]] | None:
+        """Network of a tile with its neighbourhood, and the features it owns
+
+        None if the tile owns no features.
+        """
+        pipes: dict[int, ftr.Pipe] = {}
+        buildings: dict[int, ftr.Building] = {}
+        self.read(self.tiling.tile_bounds(tile), pipes, buildings)
+        owned_pipes: set[ftr.Pipe] = {
+            pipe
+            for pipe in pipes.values()
+            if pipe.vertices and self.tiling.tile_of(pipe.bounds()) == tile
+        }
+        owned_buildings: set[ftr.Building] = {
+            building
+            for building in buildings.values()
+            if self.tiling.tile_of(building.bounds()) == tile
+        }
+        if not owned_pipes and not owned_buildings:
+            return None
+
+        self.read_component([*owned_pipes, *owned_buildings], pipes, buildings)
+        network = ftr.Network(
+            pipes=[pipes[fid] for fid in sorted(pipes)],
+            buildings=[buildings[fid] for fid in sorted(buildings)],
+            crs=self.buildings.crs(),
+            tolerance=self.tolerance,
+            **self.network_options,
+        )
+        return network, owned_pipes, owned_buildings
+
+    def read_component(
+        self,
+        features: list[ftr.Pipe | ftr.Building],
+        pipes: dict[int, ftr.Pipe],
+        buildings: dict[int, ftr.Building],
+    ) -> None:
+        """Read the candidate component of the features
+
+        A pipe and a building are candidates of each other if a vertex of the
+        pipe lies in the buffered bounding box of the building, the test that
+        decides which buildings a Network matches exactly. The neighbourhood
+        of the component is read one breadth first level at a time, until no
+        new feature joins.
+        """
+        reached: set[ftr.Pipe | ftr.Building] = set(features)
+        frontier: list[ftr.Pipe | ftr.Building] = features
+        while frontier:
+            box: spatial.Bounds = spatial.combined_bounds(
+                item.bounds() for item in frontier
+            )
+            self.read(
+                (
+                    box[0] - self.buffer,
+                    box[1] - self.buffer,
+                    box[2] + self.buffer,
+                    box[3] + self.buffer,
+                ),
+                pipes,
+                buildings,
+            )
+            frontier = [
+                *self.buildings_near(
+                    [item for item in frontier if isinstance(item, ftr.Pipe)],
+                    [bldg for bldg in buildings.values() if bldg not in reached],
+                ),
+                *self.pipes_near(
+                    [item for item in frontier if isinstance(item, ftr.Building)],
+                    [
+                        pipe
+                        for pipe in pipes.values()
+                        if pipe.vertices and pipe not in reached
+                    ],
+                ),
+            ]
+            reached.update(frontier)
+
+    def buildings_near(
+        self, pipes: list[ftr.Pipe], buildings: list[ftr.Building]
+    ) -> list[ftr.Building]:
+        """Buildings that are candidates of any of the pipes"""
+        if not pipes or not buildings:
+            return []
+        index = spatial.GeometryIndex(
+            [building.bounds() for building in buildings], buffer=self.buffer
+        )
+        return [
+            buildings[position]
+            for position in index.near_points(
+                [point for pipe in pipes for point in pipe.polyline()]
+            )
+        ]
+
+    def pipes_near(
+        self, buildings: list[ftr.Building], pipes: list[ftr.Pipe]
+    ) -> list[ftr.Pipe]:
+        """Pipes that are candidates of any of the buildings"""
+        if not buildings or not pipes:
+            return []
+        index = spatial.GeometryIndex(
+            [building.bounds() for building in buildings], buffer=self.buffer
+        )
+        return [pipe for pipe in pipes if index.near_points(pipe.polyline())]
+
+    def validate_tile(self, tile: tuple[int, int]) -> list[ValidationIssue]:
+        """Issues of the features owned by a tile, sorted by issue and id"""
+        built = self.tile_network(tile)
+        if built is None:
+            return []
+        network, owned_pipes, owned_buildings = built
+
+        found: list[ValidationIssue] = []
+        pipe_issues: dict[str, list[ftr.Pipe]] = network.problematic_pipes(
+            return_ids=False
+        )  # type: ignore[assignment]
+        for issue, pipes in pipe_issues.items():
+            found.extend(
+                ValidationIssue(issue, "pipe", pipe.id, pipe.fid, tile)
+                for pipe in pipes
+                if pipe in owned_pipes
+            )
+        building_issues: dict[str, list[ftr.Building]] = (
+            network.problematic_buildings(return_ids=False)
+        )  # type: ignore[assignment]
+        for issue, buildings in building_issues.items():
+            found.extend(
+                ValidationIssue(issue, "building", building.id, building.fid, tile)
+                for building in buildings
+                if building in owned_buildings
+            )
+        return sorted(found, key=lambda item: (item.issue, (item.id or "").lower()))
+
+    def issues(self) -> Iterator[ValidationIssue]:
+        """Stream the issues of all tiles"""
+        for tile in self.tiling.tiles():
+            yield from self.validate_tile(tile)
+
+
+def features(layer: QgsVectorLayer, extent: QgsRectangle) -> Iterator[QgsFeature]:
+    """Features in the solution with a geometry intersecting the extent"""
+    for feature in layer.getFeatures(prl.solution_request(layer, extent)):
+        if feature.hasGeometry():
+            yield feature
+
+
+def validate_project(
+    tile_size: float = TILE_SIZE, tolerance: float = 0.01, **network_options: Any
+) -> Iterator[ValidationIssue]:
+    """Stream the issues of the THERMOS layers of the current project"""
+    thermos_layers = prl.ThermosLayers()
+    return TileValidator(
+        thermos_layers.pipes,
+        thermos_layers.buildings,
+        tile_size,
+        tolerance=tolerance,
+        network_options=network_options,
+    ).issues()
+
+
+def write_jsonl(issues: Iterable[ValidationIssue], file: TextIO) -> int:
+    """Write one JSON object per issue as it arrives and return the count"""
+    count: int = 0
+    for issue in issues:
+        file.write(json.dumps(asdict(issue), separators=(",", ":")) + "\n")
+        count += 1
+    return count
+
+
+def main() -> None:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("project", help="QGIS project with the THERMOS layers")
+    parser.add_argument(
+        "--tile-size", type=float, default=TILE_SIZE, help="tile size in metres"
+    )
+    parser.add_argument(
+        "--output", type=Path, default=None, help="JSONL file (default: stdout)"
+    )
+    args = parser.parse_args()
+
+    batch.init_worker()
+    batch.read_project(args.project)
+
+    issues: Iterator[ValidationIssue] = validate_project(args.tile_size)
+    if args.output is None:
+        write_jsonl(issues, sys.stdout)
+        return
+    with args.output.open("w", encoding="utf-8") as file:
+        write_jsonl(issues, file)
+
+
+if __name__ == "__main__":
+    main()
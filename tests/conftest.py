@@ -0,0 +1,66 @@
+"""Fixtures of the tests (they are skipped without a QGIS installation)"""
+
+# pylint: disable=[no-name-in-module, import-outside-toplevel]
+
+from collections.abc import Iterator
+from typing import Any
+
+import pytest
+
+CRS: str = "EPSG:25832"
+
+
+@pytest.fixture(scope="session")
+def qgis_application() -> Iterator[None]:
+    """QGIS application for the whole test session"""
+    batch = pytest.importorskip("modules.batch")
+    batch.init_worker()
+    yield
+    batch.QGIS_APPLICATION.exitQgis()  # type: ignore[union-attr]
+
+
+def square(x: float, y: float, size: float = 3.0) -> str:
+    """WKT of a square building with its lower left corner at x, y"""
+    return (
+        f"POLYGON(({x} {y}, {x + size} {y}, {x + size} {y + size}, "
+        f"{x} {y + size}, {x} {y}))"
+    )
+
+
+def line(*points: tuple[float, float]) -> str:
+    """WKT of a pipe through the points"""
+    return "LINESTRING(" + ", ".join(f"{x} {y}" for x, y in points) + ")"
+
+
+def thermos_fields() -> Any:
+    """All THERMOS result fields (values are only set where needed)"""
+    from qgis.core import QgsField, QgsFields  # noqa: PLC0415
+    from qgis.PyQt.QtCore import QVariant  # noqa: PLC0415
+
+    from modules import constants as cont  # noqa: PLC0415
+
+    fields = QgsFields()
+    for name in cont.THERMOS_FIELD_NAMES:
+        field_type: QVariant.Type = (
+            QVariant.Bool if name == cont.ThermosFields.in_solution else QVariant.String
+        )
+        fields.append(QgsField(name, field_type))
+    return fields
+
+
+def add_features(layer: Any, features: dict[str, str]) -> dict[str, int]:
+    """Add features in the solution by id and WKT and return their feature ids"""
+    from qgis.core import QgsFeature, QgsGeometry  # noqa: PLC0415
+
+    from modules import constants as cont  # noqa: PLC0415
+
+    added: dict[str, int] = {}
+    for feature_id, wkt in features.items():
+        feature = QgsFeature(layer.fields())
+        feature.setAttribute(cont.ThermosFields.id, feature_id)
+        feature.setAttribute(cont.ThermosFields.in_solution, True)
+        feature.setGeometry(QgsGeometry.fromWkt(wkt))
+        _ok, (added_feature,) = layer.dataProvider().addFeatures([feature])
+        added[feature_id] = added_feature.id()
+    layer.updateExtents()
+    return added
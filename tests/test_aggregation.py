@@ -0,0 +1,87 @@
+"""Downstream demand and diversity along the network"""
+
+# pylint: disable=[no-name-in-module]
+
+from array import array
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("qgis.core")
+
+from qgis.core import QgsCoordinateReferenceSystem  # noqa: E402
+
+from benchmarks.synthetic import SyntheticNetwork  # noqa: E402
+from modules import aggregation as agg  # noqa: E402
+from modules import features as ftr  # noqa: E402
+from modules import loaders  # noqa: E402
+
+
+def building(
+    building_id: str, x: float, y: float, **attributes: float
+) -> ftr.Building:
+    """Square building of 3 m with its lower left corner at x, y"""
+    ring: list[list[float]] = [
+        [x, y],
+        [x + 3, y],
+        [x + 3, y + 3],
+        [x, y + 3],
+        [x, y],
+    ]
+    return ftr.Building(
+        {"id": building_id, **attributes}, wkb=loaders.polygon_wkb([ring])
+    )
+
+
+def pipe(pipe_id: str, *coordinates: float, **attributes: float) -> ftr.Pipe:
+    """Pipe through the coordinates (x, y, x, y, ...)"""
+    return ftr.Pipe({"id": pipe_id, **attributes}, vertices=array("d", coordinates))
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_synthetic_network_has_no_issues(
+    qgis_application: None,  # noqa: ARG001
+    tmp_path: Path,
+    seed: int,
+) -> None:
+    """The THERMOS results of a generated tree fit the aggregated demand"""
+    path: Path = SyntheticNetwork(1000, seed).write(tmp_path / "network.geojson")
+    network: ftr.Network = loaders.network_from_geojson(path)
+    aggregation: agg.LoadAggregation = agg.aggregate_loads(network)
+
+    assert not any(aggregation.issues().values())
+    (supply_connector,) = network.supply_connectors()
+    position: int = aggregation.graph.pipes.index(supply_connector)
+    assert aggregation.orientation.parent[position] == -1
+    assert aggregation.buildings[position] == len(network.all_buildings) - 1
+
+
+def test_loops_are_reported(
+    qgis_application: None,  # noqa: ARG001
+) -> None:
+    """Pipes on a ring are reported as such instead of by their capacity"""
+    capacity: str = "solution/capacity-kw"
+    network = ftr.Network(
+        pipes=[
+            pipe("c0", -1, 1, 0, 0, **{capacity: 10.0}),
+            pipe("r1", 0, 0, 10, 0, **{capacity: 5.0}),
+            pipe("r2", 10, 0, 10, 10, **{capacity: 5.0}),
+            pipe("r3", 10, 10, 0, 10, **{capacity: 5.0}),
+            pipe("r4", 0, 10, 0, 0, **{capacity: 5.0}),
+            pipe("c1", 10, 10, 12, 12, **{capacity: 10.0}),
+        ],
+        buildings=[
+            building("s", -4, 0, **{"supply/capacity-kwp": 100.0}),
+            building("b", 12, 12, **{"demand/kwp": 10.0}),
+        ],
+        crs=QgsCoordinateReferenceSystem("EPSG:25832"),
+    )
+    issues: dict[str, list[str]] = agg.aggregate_loads(network).issues()  # type: ignore[assignment]
+
+    assert issues.pop("pipes in loops (load depends on the flow split)") == [
+        "r1",
+        "r2",
+        "r3",
+        "r4",
+    ]
+    assert not any(issues.values())
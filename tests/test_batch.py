@@ -0,0 +1,55 @@
+"""Batch analysis of scenarios that cannot be analysed"""
+
+# pylint: disable=[no-name-in-module]
+
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("qgis.core")
+
+from qgis.core import QgsCoordinateReferenceSystem, QgsProject  # noqa: E402
+
+from modules import batch  # noqa: E402
+from modules import project_layers as prl  # noqa: E402
+
+
+def write_project(path: Path, *layer_types: str) -> str:
+    """Project file with empty memory layers of the given geometry types"""
+    project: QgsProject = QgsProject.instance()  # type: ignore[assignment]
+    project.clear()
+    crs = QgsCoordinateReferenceSystem("EPSG:25832")
+    project.addMapLayers(
+        [prl.memory_layer(layer_type, layer_type, crs) for layer_type in layer_types]
+    )
+    assert project.write(str(path))
+    project.clear()
+    return str(path)
+
+
+def test_empty_project_is_an_error(
+    qgis_application: None,  # noqa: ARG001
+    tmp_path: Path,
+) -> None:
+    """A project without layers is reported instead of reading the test project"""
+    report: batch.ScenarioReport = batch.analyse_scenario(
+        write_project(tmp_path / "empty.qgs")
+    )
+
+    assert report.error is not None
+    assert report.error.startswith("ThermosExportError")
+    assert report.pipes == 0
+
+
+def test_missing_thermos_layers_are_an_error(
+    qgis_application: None,  # noqa: ARG001
+    tmp_path: Path,
+) -> None:
+    """A project without THERMOS layers names the missing layer"""
+    report: batch.ScenarioReport = batch.analyse_scenario(
+        write_project(tmp_path / "other.qgs", "LineString", "Polygon")
+    )
+
+    assert report.error == (
+        "MissingLayerError: No THERMOS pipe layer found in the project"
+    )
@@ -0,0 +1,94 @@
+"""Topology records of the network"""
+
+# pylint: disable=[no-name-in-module]
+
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+pytest.importorskip("qgis.core")
+
+from benchmarks.synthetic import SyntheticNetwork  # noqa: E402
+from modules import features as ftr  # noqa: E402
+from modules import loaders  # noqa: E402
+from modules import spatial  # noqa: E402
+
+
+def connections(network: ftr.Network) -> dict[int | None, list[int | None]]:
+    """Feature ids of the connected buildings by pipe feature id"""
+    return {
+        pipe.fid: sorted(bldg.fid for bldg in ftr.as_list(pipe.connected_buildings))  # type: ignore[type-var]
+        for pipe in network.all_pipes
+    }
+
+
+def test_topology_is_restored_by_feature_id(
+    qgis_application: None,  # noqa: ARG001
+    tmp_path: Path,
+) -> None:
+    """A record applies to the same features in another order, and to no others"""
+    path: Path = SyntheticNetwork(300).write(tmp_path / "network.geojson")
+    network: ftr.Network = loaders.network_from_geojson(path)
+    for fid, record in enumerate([*network.all_pipes, *network.all_buildings]):
+        record.fid = fid
+    topology: dict[str, Any] = json.loads(json.dumps(network.topology_record()))
+
+    restored: ftr.Network = loaders.network_from_geojson(path)
+    for fid, record in enumerate([*restored.all_pipes, *restored.all_buildings]):
+        record.fid = fid
+    restored.all_pipes.reverse()
+    restored.all_buildings.reverse()
+    assert restored.restore_topology(topology)
+    assert connections(restored) == connections(network)
+    assert len(restored.forks) == len(network.forks)
+
+    topology["ends"][0] = [0, len(topology["nodes"])]  # no such node
+    assert not restored.restore_topology(topology)
+    restored.all_pipes.pop()
+    assert not restored.restore_topology(network.topology_record())
+
+
+def near_by_id(
+    matches: dict[ftr.Pipe, list[ftr.Building]],
+) -> dict[str | None, list[str | None]]:
+    """Ids of the buildings matched to every pipe, by pipe id"""
+    return {
+        pipe.id: sorted(bldg.id for bldg in buildings)  # type: ignore[type-var]
+        for pipe, buildings in matches.items()
+    }
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_matching_equals_all_pairs(
+    qgis_application: None,  # noqa: ARG001
+    tmp_path: Path,
+    workers: int,
+) -> None:
+    """Indexed matching, serial or threaded, finds the pairs of an all-pairs test"""
+    path: Path = SyntheticNetwork(200).write(tmp_path / "network.geojson")
+    network: ftr.Network = loaders.network_from_geojson(path, workers=workers)
+    reference: dict[ftr.Pipe, list[ftr.Building]] = {
+        pipe: [
+            building
+            for building in network.all_buildings
+            if any(
+                spatial.point_near_polygon(
+                    point, building.geometry, network.tolerance
+                )
+                for point in pipe.polyline()
+            )
+        ]
+        for pipe in network.all_pipes
+    }
+    serial: ftr.Network = loaders.network_from_geojson(path)
+
+    assert near_by_id(network.raw_matches) == near_by_id(reference)
+    assert {
+        bldg.id: sorted(pipe.id for pipe in pipes)  # type: ignore[type-var]
+        for bldg, pipes in network.building_pipes.items()
+    } == {
+        bldg.id: sorted(pipe.id for pipe in pipes)  # type: ignore[type-var]
+        for bldg, pipes in serial.building_pipes.items()
+    }
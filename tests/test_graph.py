@@ -0,0 +1,33 @@
+"""Shortest supply paths over the array graph"""
+
+# pylint: disable=[no-name-in-module]
+
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("qgis.core")
+
+from benchmarks.synthetic import SyntheticNetwork  # noqa: E402
+from modules import features as ftr  # noqa: E402
+from modules import graph as grp  # noqa: E402
+from modules import loaders  # noqa: E402
+
+
+def test_supply_paths_include_the_supply_connector(
+    qgis_application: None,  # noqa: ARG001
+    tmp_path: Path,
+) -> None:
+    """Every path starts with the supply connector and sums to its distance"""
+    path: Path = SyntheticNetwork(1000).write(tmp_path / "network.geojson")
+    network: ftr.Network = loaders.network_from_geojson(path)
+    paths: grp.BuildingPaths = grp.supply_paths(network)
+    (supply_connector,) = network.supply_connectors()
+
+    assert len(paths.buildings) == len(network.all_buildings) - 1
+    for index in range(len(paths.buildings)):
+        pipes: list[int] = paths.pipe_path(index)
+        assert paths.paths.graph.pipes[pipes[0]] is supply_connector
+        assert paths.distance[index] == pytest.approx(
+            sum(paths.paths.lengths[pipe] for pipe in pipes)
+        )
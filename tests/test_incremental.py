@@ -0,0 +1,177 @@
+"""Incremental network updates against full rebuilds"""
+
+# pylint: disable=[no-name-in-module]
+
+from array import array
+from collections.abc import Iterator
+from typing import Any
+
+import pytest
+
+pytest.importorskip("qgis.core")
+
+from qgis.core import (  # noqa: E402
+    QgsCoordinateReferenceSystem,
+    QgsGeometry,
+    QgsProject,
+    QgsVectorLayer,
+)
+
+from modules import constants as cont  # noqa: E402
+from modules import features as ftr  # noqa: E402
+from modules import incremental as inc  # noqa: E402
+from modules import project_layers as prl  # noqa: E402
+from tests.conftest import (  # noqa: E402
+    CRS,
+    add_features,
+    line,
+    square,
+    thermos_fields,
+)
+
+
+def topology(network: ftr.Network) -> dict[str, Any]:
+    """Resolved connectors, links and forks by feature id"""
+    return {
+        "connected": {
+            pipe.id: sorted(bldg.id for bldg in ftr.as_list(pipe.connected_buildings))
+            for pipe in network.all_pipes
+        },
+        "connector_counts": {
+            building.id: network.connector_counts[building]
+            for building in network.all_buildings
+        },
+        "connectors": sorted(pipe.id for pipe in network.connectors),
+        "links": sorted(pipe.id for pipe in network.links),
+        "forks": sorted(
+            (node.coordinates.x(), node.coordinates.y()) for node in network.forks
+        ),
+    }
+
+
+@pytest.fixture
+def layers(
+    qgis_application: None,  # noqa: ARG001
+) -> Iterator[tuple[QgsVectorLayer, QgsVectorLayer]]:
+    """Pipe and building layers in the project
+
+    Pipe q is near buildings b0 and x, p near x and y, r near y and z, and the
+    links l1 to l4 meet in a fork at 50, 10.
+    """
+    project: QgsProject = QgsProject.instance()  # type: ignore[assignment]
+    project.clear()
+    crs = QgsCoordinateReferenceSystem(CRS)
+    pipes: QgsVectorLayer = prl.memory_layer(
+        "pipes", "LineString", crs, thermos_fields()
+    )
+    buildings: QgsVectorLayer = prl.memory_layer(
+        "buildings", "Polygon", crs, thermos_fields()
+    )
+    add_features(
+        buildings,
+        {
+            "b0": square(0, 0),
+            "x": square(10, 0),
+            "y": square(20, 0),
+            "z": square(30, 0),
+        },
+    )
+    add_features(
+        pipes,
+        {
+            "q": line((1.5, 1.5), (11.5, 1.5)),
+            "p": line((11.5, 1.5), (21.5, 1.5)),
+            "r": line((21.5, 1.5), (31.5, 1.5)),
+            "l1": line((40, 10), (50, 10)),
+            "l2": line((50, 10), (60, 10)),
+            "l3": line((50, 10), (50, 20)),
+            "l4": line((50, 10), (50, 0)),
+        },
+    )
+    project.addMapLayers([pipes, buildings])
+    yield pipes, buildings
+    project.clear()
+
+
+def fid_of(layer: QgsVectorLayer, feature_id: str) -> int:
+    """Feature id of the feature with a THERMOS id"""
+    return next(
+        feature.id()
+        for feature in layer.getFeatures()
+        if feature[cont.ThermosFields.id] == feature_id
+    )
+
+
+def test_updates_match_rebuild(
+    layers: tuple[QgsVectorLayer, QgsVectorLayer],
+) -> None:
+    """Every edit leaves the same topology as building the network anew
+
+    The layers are changed through their data providers and the handlers are
+    called as the edit signals would call them.
+    """
+    pipes, buildings = layers
+    network = ftr.Network()
+    updater = inc.NetworkUpdater(network)
+    assert topology(network)["connected"]["p"] == ["x"]
+
+    # deleting b0 leaves q with x only, so p loses x although it was not near b0
+    fid: int = fid_of(buildings, "b0")
+    buildings.dataProvider().deleteFeatures([fid])
+    updater.building_deleted(fid)
+    assert topology(network)["connected"]["p"] == []
+    assert topology(network) == topology(ftr.Network())
+
+    # moving z away
+    fid = fid_of(buildings, "z")
+    buildings.dataProvider().changeGeometryValues(
+        {fid: QgsGeometry.fromWkt(square(30, 30))}
+    )
+    updater.building_changed(fid)
+    assert topology(network) == topology(ftr.Network())
+
+    # adding a building at the end of l3 and pipes near y and the moved z
+    updater.building_changed(add_features(buildings, {"w": square(49, 19)})["w"])
+    assert "l3" in topology(network)["connectors"]
+    for changed in add_features(
+        pipes,
+        {
+            "s": line((21.5, 1.5), (21.5, 10)),
+            "t": line((31.5, 31.5), (40, 10)),
+        },
+    ).values():
+        updater.pipe_changed(changed)
+    assert topology(network) == topology(ftr.Network())
+
+    # deleting links until the fork at 50, 10 is gone
+    for feature_id in ("l4", "l2"):
+        fid = fid_of(pipes, feature_id)
+        pipes.dataProvider().deleteFeatures([fid])
+        updater.pipe_deleted(fid)
+        assert topology(network) == topology(ftr.Network())
+    assert topology(network)["forks"] == []
+
+    updater.stop()
+
+
+def test_updater_resolves_an_unresolved_network(
+    layers: tuple[QgsVectorLayer, QgsVectorLayer],
+) -> None:
+    """A network built with resolve=False, and with a pipe without vertices"""
+    pipes, buildings = layers
+    network = ftr.Network(
+        pipes=[
+            *(ftr.Pipe(feature) for feature in pipes.getFeatures()),
+            ftr.Pipe({"id": "empty"}, vertices=array("d")),
+        ],
+        buildings=[ftr.Building(feature) for feature in buildings.getFeatures()],
+        crs=pipes.crs(),
+        resolve=False,
+    )
+    updater = inc.NetworkUpdater(network)
+
+    expected: dict[str, Any] = topology(ftr.Network())
+    expected["connected"]["empty"] = []
+    expected["links"] = sorted([*expected["links"], "empty"])
+    assert topology(network) == expected
+    updater.stop()
@@ -0,0 +1,43 @@
+"""Records read from THERMOS GeoJSON exports"""
+
+import pytest
+
+pytest.importorskip("qgis.core")
+
+from modules import constants as cont  # noqa: E402
+from modules import exceptions as ex  # noqa: E402
+from modules import features as ftr  # noqa: E402
+from modules import loaders  # noqa: E402
+
+
+def line_feature(geometry_type: str, coordinates: list) -> dict:
+    """GeoJSON feature of a pipe in the solution"""
+    return {
+        "type": "Feature",
+        "id": "p",
+        "properties": {cont.ThermosFields.in_solution: True},
+        "geometry": {"type": geometry_type, "coordinates": coordinates},
+    }
+
+
+def test_single_part_multiline_is_a_pipe() -> None:
+    """A multiline of one part is read like the line itself"""
+    points: list[list[float]] = [[0.0, 0.0], [1.0, 1.0]]
+    line = loaders.record_from_geojson(line_feature("LineString", points), "x")
+    multiline = loaders.record_from_geojson(
+        line_feature("MultiLineString", [points]), "x"
+    )
+
+    assert isinstance(multiline, ftr.Pipe)
+    assert isinstance(line, ftr.Pipe)
+    assert multiline.vertices == line.vertices
+
+
+def test_unsupported_pipe_geometry_is_an_error() -> None:
+    """Pipes of several parts are reported instead of being dropped"""
+    feature: dict = line_feature(
+        "MultiLineString", [[[0.0, 0.0], [1.0, 1.0]], [[2.0, 2.0], [3.0, 3.0]]]
+    )
+
+    with pytest.raises(ex.ThermosExportError, match="pipe p has unsupported"):
+        loaders.record_from_geojson(feature, "export.geojson")
@@ -0,0 +1,64 @@
+"""Network snapshots written and read back"""
+
+# pylint: disable=[no-name-in-module]
+
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("qgis.core")
+
+from benchmarks.synthetic import SyntheticNetwork  # noqa: E402
+from modules import exceptions as ex  # noqa: E402
+from modules import features as ftr  # noqa: E402
+from modules import loaders  # noqa: E402
+from modules import snapshot  # noqa: E402
+
+
+def connections(network: ftr.Network) -> dict[str | None, list[str | None]]:
+    """Ids of the connected buildings by pipe id"""
+    return {
+        pipe.id: sorted(bldg.id for bldg in ftr.as_list(pipe.connected_buildings))  # type: ignore[type-var]
+        for pipe in network.all_pipes
+    }
+
+
+@pytest.fixture
+def network(
+    qgis_application: None,  # noqa: ARG001
+    tmp_path: Path,
+) -> ftr.Network:
+    """Small synthetic network"""
+    return loaders.network_from_geojson(
+        SyntheticNetwork(300).write(tmp_path / "network.geojson")
+    )
+
+
+def test_snapshot_round_trip(network: ftr.Network, tmp_path: Path) -> None:
+    """A snapshot restores the records and the topology of the network"""
+    path: Path = tmp_path / f"network{snapshot.SNAPSHOT_SUFFIX}"
+    snapshot.write_snapshot(network, path)
+    restored: ftr.Network = snapshot.load_snapshot(path)
+
+    assert [pipe.id for pipe in restored.all_pipes] == [
+        pipe.id for pipe in network.all_pipes
+    ]
+    assert [bldg.id for bldg in restored.all_buildings] == [
+        bldg.id for bldg in network.all_buildings
+    ]
+    assert connections(restored) == connections(network)
+    assert len(restored.forks) == len(network.forks)
+
+
+def test_truncated_snapshot_is_rejected(network: ftr.Network, tmp_path: Path) -> None:
+    """Sections beyond the end of the file are reported, not read"""
+    path: Path = tmp_path / f"network{snapshot.SNAPSHOT_SUFFIX}"
+    snapshot.write_snapshot(network, path)
+    data: bytes = path.read_bytes()
+    _magic, header_length = snapshot.PREAMBLE.unpack_from(data)
+    path.write_bytes(
+        data[: snapshot.aligned(snapshot.PREAMBLE.size + header_length) + 8]
+    )
+
+    with pytest.raises(ex.SnapshotError, match="damaged section"):
+        snapshot.load_snapshot(path)
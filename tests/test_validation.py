@@ -0,0 +1,67 @@
+"""Tile by tile validation against the issues of the whole network"""
+
+# pylint: disable=[no-name-in-module]
+
+import pytest
+
+pytest.importorskip("qgis.core")
+
+from qgis.core import (  # noqa: E402
+    QgsCoordinateReferenceSystem,
+    QgsProject,
+    QgsVectorLayer,
+)
+
+from modules import features as ftr  # noqa: E402
+from modules import project_layers as prl  # noqa: E402
+from modules import validation as val  # noqa: E402
+from tests.conftest import (  # noqa: E402
+    CRS,
+    add_features,
+    line,
+    square,
+    thermos_fields,
+)
+
+
+def test_tiles_match_whole_network(
+    qgis_application: None,  # noqa: ARG001
+) -> None:
+    """A chain of buildings sharing pipes is resolved the same in every tile
+
+    Every pipe is near two buildings, so which building a pipe keeps depends on
+    the pipes at the far end of the chain, many tiles away.
+    """
+    project: QgsProject = QgsProject.instance()  # type: ignore[assignment]
+    project.clear()
+    crs = QgsCoordinateReferenceSystem(CRS)
+    pipes: QgsVectorLayer = prl.memory_layer(
+        "pipes", "LineString", crs, thermos_fields()
+    )
+    buildings: QgsVectorLayer = prl.memory_layer(
+        "buildings", "Polygon", crs, thermos_fields()
+    )
+    add_features(buildings, {f"b{i}": square(10 * i, 0) for i in range(8)})
+    add_features(
+        pipes,
+        {
+            f"p{i}": line((10 * i + 1.5, 1.5), (10 * i + 11.5, 1.5))
+            for i in range(7)
+        },
+    )
+    project.addMapLayers([pipes, buildings])
+
+    validator = val.TileValidator(pipes, buildings, tile_size=5.0)
+    tiled: set[tuple[str, str | None]] = {
+        (issue.issue, issue.id) for issue in validator.issues()
+    }
+    network = ftr.Network()
+    whole: set[tuple[str, str | None]] = {
+        (issue, feature_id)
+        for found in (network.problematic_pipes(), network.problematic_buildings())
+        for issue, feature_ids in found.items()
+        for feature_id in feature_ids
+    }
+    project.clear()
+
+    assert tiled == whole